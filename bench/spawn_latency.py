@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Measure process spawn latency against the nofile limit.
+
+For each limit, a fresh interpreter is started with that soft RLIMIT_NOFILE
+(subprocess reads the limit once, at import), and times spawning /bin/true:
+
+  close_fds     subprocess.Popen(close_fds=True), one close() per fd number
+  inherit       psutil.Popen(), which leaks the parent's descriptors
+  spawn         platform_cli.spawn.popen()
+  spawn-pool    spawn.popen() from a thread pool worker, as snap runs it
+
+Limits above the hard limit are skipped unless it can be raised, e.g. as root.
+
+Usage: python bench/spawn_latency.py [--runs N] [LIMIT ...]
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+DEFAULT_LIMITS = (1024, 65536, 1048576)
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(runs):
+  """Print the median and p90 spawn latency of each method, in milliseconds."""
+  sys.path.insert(0, PACKAGE_ROOT)
+  import psutil
+  from multiprocessing.pool import ThreadPool
+  from platform_cli import spawn
+
+  pool = ThreadPool(4)
+  methods = (
+      ('close_fds', lambda: subprocess.Popen(['/bin/true'], close_fds=True)),
+      ('inherit', lambda: psutil.Popen(['/bin/true'])),
+      ('spawn', lambda: spawn.popen(['/bin/true'])),
+      ('spawn-pool', lambda: pool.apply(spawn.popen, (['/bin/true'],))),
+  )
+  limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+  for name, start in methods:
+    latencies = []
+    for _ in range(runs):
+      started = time.time()
+      proc = start()
+      latencies.append(time.time() - started)
+      proc.wait()
+    latencies.sort()
+    print '{:>9} {:>12} {:>10.3f} {:>10.3f}'.format(
+        limit, name, 1000 * latencies[len(latencies) // 2],
+        1000 * latencies[int(len(latencies) * 0.9)])
+  pool.close()
+  pool.join()
+  sys.stdout.flush()
+
+
+def main():
+  """Run one child interpreter per limit."""
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('limits', nargs='*', type=int, default=DEFAULT_LIMITS)
+  parser.add_argument('--runs', type=int, default=50)
+  parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+  if args.child:
+    measure(args.runs)
+    return
+  print '{:>9} {:>12} {:>10} {:>10}'.format('nofile', 'method', 'p50 ms', 'p90 ms')
+  sys.stdout.flush()
+  for limit in args.limits:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and limit > hard:
+      try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, limit))
+        hard = limit
+      except (ValueError, resource.error):
+        print '{:>9} skipped: above the hard limit of {}'.format(limit, hard)
+        continue
+    subprocess.check_call(
+        [sys.executable, os.path.abspath(__file__), '--child', '--runs', str(args.runs)],
+        preexec_fn=lambda limit=limit: resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard)))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""On-disk cache for structures derived from the configuration.
+
+Some structures, such as the key index, take time proportional to the size
+of the variable catalog to build. They are pickled into one file next to the
+overrides file, '<config>.cache', each under a name and a signature of its
+inputs. An entry whose signature no longer matches is rebuilt. The cache is
+only an optimization: a missing, corrupt or unwritable cache file is ignored.
+"""
+
+import cPickle
+import hashlib
+import os
+
+FORMAT_VERSION = 1
+
+
+def signature(parts):
+  """Hash an iterable of strings into a signature."""
+  digest = hashlib.sha1()
+  for part in parts:
+    digest.update(part)
+    digest.update('\0')
+  return digest.hexdigest()
+
+
+class Cache(object):
+  """Named, signed entries pickled into a single file."""
+
+  def __init__(self, path):
+    self.path = path
+    self._entries = None
+
+  def _load(self):
+    """Read the cache file once; return its entries."""
+    if self._entries is None:
+      try:
+        with open(self.path, 'rb') as cache_file:
+          entries = cPickle.load(cache_file)
+      except Exception: # pylint: disable=broad-except
+        entries = None
+      if not isinstance(entries, dict) or entries.get('__version__') != FORMAT_VERSION:
+        entries = {'__version__': FORMAT_VERSION}
+      self._entries = entries
+    return self._entries
+
+  def _save(self):
+    """Atomically replace the cache file, ignoring failures."""
+    temp_path = '{}.{}.temp'.format(self.path, os.getpid())
+    try:
+      with open(temp_path, 'wb') as temp_file:
+        cPickle.dump(self._entries, temp_file, cPickle.HIGHEST_PROTOCOL)
+      os.rename(temp_path, self.path)
+    except (IOError, OSError):
+      try:
+        os.unlink(temp_path)
+      except OSError:
+        pass
+
+  def peek(self, name):
+    """Return the value stored for name whatever its signature, or None."""
+    entry = self._load().get(name)
+    return entry[1] if entry is not None else None
+
+  def get(self, name, sig, build):
+    """Return the entry for name if its signature is sig, else build() and store it."""
+    entries = self._load()
+    entry = entries.get(name)
+    if entry is not None and entry[0] == sig:
+      return entry[1]
+    value = build()
+    entries[name] = (sig, value)
+    self._save()
+    return value
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Place services in cgroup v2 groups and read their accounting files.
+
+When main.cgroup_parent names a delegated cgroup v2 directory, each service
+is started in a cgroup of its own below it, with memory.max, cpu.max and
+io.weight set from its properties. Its processes, memory and CPU usage are
+then read from the cgroup's files instead of walking its process tree. Where
+cgroup v2 is missing or the parent is not writable, services start as before.
+
+This module also reads the memory and CPU limits of the cgroup (v2 or v1)
+that this process runs in.
+"""
+
+import errno
+import os
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+CONTROLLERS = ('memory', 'cpu', 'io')
+CPU_PERIOD_USEC = 100000
+UNLIMITED = {
+    'memory.max': 'max',
+    'cpu.max': 'max {}'.format(CPU_PERIOD_USEC),
+    'io.weight': 'default 100',
+}
+
+
+class Error(Exception):
+  """Base exception class for this module."""
+
+
+def read_first_line(path):
+  """Return the stripped first line of a file, or None."""
+  try:
+    with open(path, 'r') as cgroup_file:
+      return cgroup_file.readline().strip()
+  except IOError:
+    return None
+
+
+def _cgroup_dirs(controller, root=CGROUP_ROOT):
+  """Yield candidate directories of this process's cgroup for a controller."""
+  try:
+    with open('/proc/self/cgroup', 'r') as cgroup_file:
+      lines = cgroup_file.readlines()
+  except IOError:
+    lines = []
+  for line in lines:
+    _, controllers, path = line.strip().split(':', 2)
+    if controllers == '':
+      yield os.path.join(root, path.lstrip('/'))
+    elif controller in controllers.split(','):
+      yield os.path.join(root, controllers, path.lstrip('/'))
+      yield os.path.join(root, controllers)
+  yield root
+  yield os.path.join(root, controller)
+
+
+def memory_limit():
+  """Return the memory limit in bytes of this process's cgroup (v2 or v1), or None."""
+  for directory in _cgroup_dirs('memory'):
+    for name in ('memory.max', 'memory.limit_in_bytes'):
+      value = read_first_line(os.path.join(directory, name))
+      if value is not None:
+        return int(value) if value.isdigit() else None
+  return None
+
+
+def cpu_limit():
+  """Return the CPU quota in CPUs of this process's cgroup (v2 or v1), or None."""
+  for directory in _cgroup_dirs('cpu'):
+    value = read_first_line(os.path.join(directory, 'cpu.max'))
+    if value is not None:
+      quota, _, period = value.partition(' ')
+      return float(quota) / int(period) if quota != 'max' else None
+    quota = read_first_line(os.path.join(directory, 'cpu.cfs_quota_us'))
+    period = read_first_line(os.path.join(directory, 'cpu.cfs_period_us'))
+    if quota is not None and period is not None:
+      return float(quota) / int(period) if int(quota) > 0 else None
+  return None
+
+
+def service_path(parent, name, root=CGROUP_ROOT):
+  """Return the cgroup directory of a service below parent, relative to root."""
+  return os.path.join(root, parent.strip('/'), name)
+
+
+def limit_files(memory_max_bytes=None, cpu_max=None, io_weight=None):
+  """Return a dictionary of cgroup file names to contents for the given limits.
+
+  Limits that are not given are reset to their UNLIMITED contents, so a limit
+  that was removed does not linger in an existing cgroup.
+
+  Args:
+    memory_max_bytes: Memory limit in bytes.
+    cpu_max: CPU limit in CPUs, e.g. 1.5.
+    io_weight: IO weight, from 1 to 10000.
+  """
+  files = dict(UNLIMITED)
+  if memory_max_bytes is not None:
+    files['memory.max'] = str(memory_max_bytes)
+  if cpu_max is not None:
+    files['cpu.max'] = '{} {}'.format(int(cpu_max * CPU_PERIOD_USEC), CPU_PERIOD_USEC)
+  if io_weight is not None:
+    files['io.weight'] = 'default {}'.format(io_weight)
+  return files
+
+
+def _write(path, value):
+  """Write a value to a cgroup file, raising Error on failure."""
+  try:
+    with open(path, 'w') as cgroup_file:
+      cgroup_file.write(value)
+  except (IOError, OSError), err:
+    raise Error('Cannot write {} to {}: {}'.format(value, path, err.strerror or err))
+
+
+def prepare(path, files, root=CGROUP_ROOT):
+  """Create a service cgroup and write its limit files.
+
+  The controllers the limits need are enabled in the parent's
+  cgroup.subtree_control first, if they are not already. Files reset to their
+  UNLIMITED contents need no controller, and are skipped where the controller
+  is not enabled.
+
+  Raises:
+    Error: cgroup v2 is not mounted at root, or the cgroup cannot be created,
+      joined or limited.
+  """
+  if not os.path.exists(os.path.join(root, 'cgroup.controllers')):
+    raise Error('No cgroup v2 hierarchy at {}.'.format(root))
+  parent = os.path.dirname(path)
+  if not os.path.isdir(parent):
+    raise Error('Parent cgroup {} does not exist.'.format(parent))
+  wanted = set(name.split('.')[0] for name, value in files.iteritems()
+               if value != UNLIMITED.get(name))
+  enabled = (read_first_line(os.path.join(parent, 'cgroup.subtree_control')) or '').split()
+  for controller in CONTROLLERS:
+    if controller in wanted and controller not in enabled:
+      _write(os.path.join(parent, 'cgroup.subtree_control'), '+{}'.format(controller))
+  try:
+    os.mkdir(path)
+  except OSError, err:
+    if err.errno != errno.EEXIST:
+      raise Error('Cannot create cgroup {}: {}'.format(path, err.strerror))
+  if not os.access(os.path.join(path, 'cgroup.procs'), os.W_OK):
+    raise Error('Cannot join cgroup {}: cgroup.procs is not writable.'.format(path))
+  for name, value in sorted(files.iteritems()):
+    file_path = os.path.join(path, name)
+    if value == UNLIMITED.get(name) and not os.path.exists(file_path):
+      continue
+    _write(file_path, value)
+
+
+def join(path):
+  """Move the calling process into a cgroup. Return True if it moved.
+
+  Safe to call between fork and exec: failures are not raised.
+  """
+  try:
+    with open(os.path.join(path, 'cgroup.procs'), 'w') as procs_file:
+      procs_file.write(str(os.getpid()))
+    return True
+  except (IOError, OSError):
+    return False
+
+
+def procs(path):
+  """Return the pids in a cgroup, or None if it cannot be read."""
+  try:
+    with open(os.path.join(path, 'cgroup.procs'), 'r') as procs_file:
+      return [int(line) for line in procs_file if line.strip()]
+  except IOError:
+    return None
+
+
+def thread_count(path):
+  """Return the number of threads in a cgroup, or 0 if it cannot be read."""
+  try:
+    with open(os.path.join(path, 'cgroup.threads'), 'r') as threads_file:
+      return sum(1 for line in threads_file if line.strip())
+  except IOError:
+    return 0
+
+
+def memory_current(path):
+  """Return the memory in bytes charged to a cgroup, or 0 if it cannot be read."""
+  value = read_first_line(os.path.join(path, 'memory.current'))
+  return int(value) if value and value.isdigit() else 0
+
+
+def _read_keyed(path, name):
+  """Read a flat keyed cgroup file such as cpu.stat into a dictionary of ints."""
+  values = {}
+  try:
+    with open(os.path.join(path, name), 'r') as keyed_file:
+      for line in keyed_file:
+        fields = line.split()
+        if len(fields) == 2 and fields[1].isdigit():
+          values[fields[0]] = int(fields[1])
+  except IOError:
+    pass
+  return values
+
+
+def cpu_seconds(path):
+  """Return the CPU seconds used by a cgroup, from cpu.stat."""
+  return _read_keyed(path, 'cpu.stat').get('usage_usec', 0) / 1e6
+
+
+def io_bytes(path):
+  """Return a tuple of bytes read and written by a cgroup on all devices, from io.stat."""
+  read_bytes = write_bytes = 0
+  try:
+    with open(os.path.join(path, 'io.stat'), 'r') as io_file:
+      for line in io_file:
+        for field in line.split()[1:]:
+          key, _, value = field.partition('=')
+          if key == 'rbytes':
+            read_bytes += int(value)
+          elif key == 'wbytes':
+            write_bytes += int(value)
+  except IOError:
+    pass
+  return read_bytes, write_bytes
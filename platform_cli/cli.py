@@ -4,12 +4,21 @@
 """Glue the config to the service profiles and make command line interface."""
 
 import collections
-import subprocess
+import copy
+import fnmatch
+import os
+import signal
 import sys
+import threading
 import time
 import textwrap
-from platform_cli import config
-from clint.textui import puts, indent
+from multiprocessing.pool import ThreadPool
+from platform_cli import (clock, completion, config, fanout, lifecycle, logwriter, metrics,
+                          pidfile, prewarm, proctable, proptypes, samplestore, scheduler, sizing,
+                          trigger, watchdog)
+from clint.textui import colored, puts, indent
+
+STATUS_THREADS = 8
 
 
 class CLI(object):
@@ -17,30 +26,65 @@ class CLI(object):
 
   #pylint: disable=too-many-arguments
   def __init__(self, progname, overrides_path, defaults, suggestions, docs, service_profiles,
-               os_requirements):
+               os_requirements, service_sizings=None):
 
     self.progname = progname
     self.conf = config.Config(overrides_path, defaults, suggestions, docs)
     self.template_values, self.different_suggestions, _ = self.conf.get_active_values_and_metadata()
+    self.typed_values, self.invalid_values = self.conf.get_typed_values(self.template_values)
+    self.sizing_error = None
+    if service_sizings:
+      try:
+        self._add_sizing_suggestions(service_sizings, suggestions)
+      except (sizing.Error, proptypes.Error), err:
+        self.sizing_error = 'Cannot suggest sizes for this host: {}'.format(err)
 
     self.os_requirements = os_requirements
+    self.instance_args = (defaults, suggestions, docs, service_profiles, os_requirements,
+                          service_sizings)
 
     for service in service_profiles:
-      service.assign_template_values(self.template_values)
+      service.assign_template_values(self.template_values, self.typed_values)
 
     self.services_by_name = collections.OrderedDict(
         (service.name, service) for service in sorted(service_profiles,
                                                       key=lambda x: x.priority)
     )
+    try:
+      self.dependency_graph = scheduler.build_graph(self.services_by_name.values())
+      self.dependency_error = None
+    except scheduler.Error, err:
+      self.dependency_graph = None
+      self.dependency_error = str(err)
+    self.parallelism = self._get_value('main.parallelism', '1', proptypes.INT)
+    self.subcommand_parsers = {}
+
+  def _get_value(self, key, default, fallback_type):
+    """Return a property value, parsed with fallback_type unless it is typed."""
+    return proptypes.get_value(self.template_values, self.typed_values, key, default,
+                               fallback_type)
+
+  def _add_sizing_suggestions(self, service_sizings, declared_suggestions):
+    """Add suggestions sized from host resources, unless a declared suggestion covers them."""
+    declared_names = set(suggestion.name for suggestion in declared_suggestions)
+    reserved_mib = self._get_value('main.sizing_reserved_memory_mb', '512', proptypes.INT)
+    for suggestion in sizing.suggest(service_sizings, self.template_values,
+                                     sizing.read_host_resources(), reserved_mib * sizing.MIB):
+      if (suggestion.name not in declared_names and
+          self.template_values[suggestion.name] != suggestion.value):
+        self.different_suggestions[suggestion.name] = suggestion
 
   def add_subcommands(self, subparsers):
     """Add subparsers for the operation of the CLI."""
+    argument_kinds = {}
 
     def add_service_name_argument(parser):
-      """Standardize the way we set service_name as an argument."""
-      parser.add_argument('service_name', nargs='?', default=None,
-                          choices=self.services_by_name.keys(),
-                         )
+      """Standardize the way we select services as arguments."""
+      argument_kinds[parser] = 'service'
+      parser.add_argument('service_names', nargs='*', metavar='service_name',
+                          help='service name or glob, e.g. "search*" (default: all)')
+      parser.add_argument('--tag', '-t', action='append', default=[], dest='tags',
+                          help='select services carrying this tag; may be repeated')
 
     start_parser = subparsers.add_parser('start', help='start service(s)')
     add_service_name_argument(start_parser)
@@ -53,6 +97,15 @@ class CLI(object):
 
     restart_parser = subparsers.add_parser('restart', help='restart service(s)')
     restart_parser.add_argument('--graceful', action='store_true')
+    restart_parser.add_argument('--rolling', action='store_true',
+                                help='restart one group at a time, waiting for each to be '
+                                     'ready before moving on')
+    restart_parser.add_argument('--group-by', choices=('priority', 'tag'), default='priority',
+                                help='how --rolling groups services')
+    restart_parser.add_argument('--max-unavailable', type=int, default=1,
+                                help='services of a group restarted at once when rolling')
+    restart_parser.add_argument('--continue-on-failure', action='store_true',
+                                help='keep rolling after a service fails to become ready')
     restart_parser.add_argument('--skip-setup', action='store_true')
     add_service_name_argument(restart_parser)
     restart_parser.set_defaults(func=self.restart)
@@ -67,19 +120,24 @@ class CLI(object):
     enable_parser.add_argument('service_name',
                                choices=self.services_by_name.keys())
     enable_parser.set_defaults(func=self.conf.enable)
+    argument_kinds[enable_parser] = 'service'
 
     disable_parser = subparsers.add_parser('disable',
                                            help='disable a service')
     disable_parser.add_argument('service_name',
                                 choices=self.services_by_name.keys())
     disable_parser.set_defaults(func=self.conf.disable)
+    argument_kinds[disable_parser] = 'service'
 
     list_parser = subparsers.add_parser('list',
                                         help='list startup properties')
     list_parser.add_argument('--verbose', '-v', action='store_true')
     list_parser.add_argument('--as-props', '-p', action='store_true')
+    list_parser.add_argument('--fuzzy', '-f', action='store_true',
+                             help='match names approximately, best match first')
     list_parser.add_argument('substring_match', nargs='?', default=None)
     list_parser.set_defaults(func=self.conf.list_vars)
+    argument_kinds[list_parser] = 'property'
 
     set_parser = subparsers.add_parser('set',
                                        help='set startup property override',
@@ -90,73 +148,463 @@ class CLI(object):
     set_parser.add_argument('property_name')
     set_parser.add_argument('property_value')
     set_parser.set_defaults(func=self.conf.set_var)
+    argument_kinds[set_parser] = 'property'
 
     delete_parser = subparsers.add_parser(
         'del', help='delete startup property override')
     delete_parser.add_argument('property_name')
     delete_parser.set_defaults(func=self.conf.delete_var)
+    argument_kinds[delete_parser] = 'property'
+
+    history_parser = subparsers.add_parser(
+        'history', help='show recent startup property override changes')
+    history_parser.add_argument('--limit', '-n', default=20, type=int)
+    history_parser.add_argument('substring_match', nargs='?', default=None)
+    history_parser.set_defaults(func=self.conf.show_history)
+    argument_kinds[history_parser] = 'property'
+
+    rollback_parser = subparsers.add_parser(
+        'rollback', help='undo the most recent startup property override changes')
+    rollback_parser.add_argument('count', type=int,
+                                 help='number of changes to undo, as numbered by history')
+    rollback_parser.set_defaults(func=self.conf.rollback)
 
     doc_parser = subparsers.add_parser(
         'doc', help='get documentation on each startup property')
+    doc_parser.add_argument('pattern', nargs='?', default=None,
+                            help='only show properties whose name or documentation contains this')
+    doc_parser.add_argument('--format', choices=('text', 'json'), default='text')
     doc_parser.set_defaults(func=self.conf.show_docs)
+    argument_kinds[doc_parser] = 'property'
 
     setup_parser = subparsers.add_parser(
         'setup', help='check OS-level and service requirements')
     add_service_name_argument(setup_parser)
     setup_parser.set_defaults(func=self.setup)
 
+    watch_parser = subparsers.add_parser(
+        'watch', help='restart enabled services when they crash')
+    add_service_name_argument(watch_parser)
+    watch_parser.add_argument('--interval', '-i', default=2, type=float,
+                              help='seconds between process table scans')
+    watch_parser.set_defaults(func=self.watch)
+
     snap_parser = subparsers.add_parser(
         'snap', help='take performance snapshots')
-    snap_parser.add_argument('--count', '-c', default=1, type=int)
-    snap_parser.add_argument('--interval', '-i', default=3, type=int)
+    snap_parser.add_argument('--count', '-c', type=int,
+                             help='number of snapshots (default: 1, or unlimited with --trigger)')
+    snap_parser.add_argument('--interval', '-i', default=3, type=float,
+                             help='seconds between the starts of snapshot iterations, or '
+                                  'between samples with --trigger')
+    snap_parser.add_argument('--trigger', action='store_true',
+                             help='sample services and snap each one when it crosses its '
+                                  '<service>.trigger_* thresholds')
+    snap_parser.add_argument('--timeout', type=int,
+                             help='seconds before a snap command is killed '
+                                  '(default: <service>.snap_timeout_seconds)')
     snap_parser.add_argument('--output', '-o')
+    snap_parser.add_argument('--store', '-s',
+                             help='directory of per-service sample stores '
+                                  '(default: main.snap_store_dir)')
+    snap_parser.add_argument('--prom', metavar='PATH',
+                             help='also rewrite this Prometheus textfile every iteration')
     add_service_name_argument(snap_parser)
     snap_parser.set_defaults(func=self.snap)
 
+    snap_query_parser = subparsers.add_parser(
+        'snap-query', help='summarize stored performance samples')
+    snap_query_parser.add_argument('--store', '-s',
+                                   help='directory of per-service sample stores '
+                                        '(default: main.snap_store_dir)')
+    snap_query_parser.add_argument('--since', default=3600, type=int,
+                                   help='start of the window, in seconds ago')
+    snap_query_parser.add_argument('--until', default=0, type=int,
+                                   help='end of the window, in seconds ago')
+    snap_query_parser.add_argument('--csv', action='store_true',
+                                   help='export the samples in the window as CSV')
+    add_service_name_argument(snap_query_parser)
+    snap_query_parser.set_defaults(func=self.snap_query)
+
+    metrics_parser = subparsers.add_parser(
+        'export-metrics', help='write service metrics for the Prometheus textfile collector')
+    metrics_parser.add_argument('--output', '-o', metavar='PATH',
+                                help='.prom file to replace atomically '
+                                     '(default: main.metrics_path, else stdout)')
+    metrics_parser.set_defaults(func=self.export_metrics)
+
+    fanout_parser = subparsers.add_parser(
+        'fanout', help='run an operation across several installs on this host')
+    fanout_parser.add_argument('operation', choices=('status', 'start', 'stop', 'snap'))
+    fanout_parser.add_argument('targets', nargs='+', metavar='target',
+                               help='overrides file, or install directory holding an '
+                                    'overrides file named like this one')
+    fanout_parser.add_argument('--format', '-f', choices=('table', 'json'), default='table')
+    fanout_parser.add_argument('--processes', '-P', type=int,
+                               help='number of installs handled at once (default: CPUs)')
+    fanout_parser.add_argument('--verbose', '-v', action='store_true')
+    fanout_parser.add_argument('--skip-setup', action='store_true')
+    fanout_parser.set_defaults(func=self.fan_out)
+
+    completion_parser = subparsers.add_parser(
+        'completion', help='print a shell completion script, e.g. '
+                           'eval "$({} completion bash)"'.format(self.progname))
+    completion_parser.add_argument('shell', choices=('bash', 'zsh'))
+    completion_parser.set_defaults(func=self.print_completion)
+
+    self.subcommand_parsers = dict(subparsers.choices)
+    self._refresh_completion_index(
+        sorted((name, argument_kinds.get(parser)) for name, parser in subparsers.choices.items()))
+
+  def _refresh_completion_index(self, commands):
+    """Keep the static completion index in line with the catalog and overrides."""
+    tags = sorted(set(tag for srv in self.services_by_name.values() for tag in srv.tags))
+    body = completion.build_index(commands, self.services_by_name.keys(), tags,
+                                  sorted(self.conf.get_default_names()))
+    completion.refresh_index(completion.index_path(self.conf.config_path), body)
+
+  def print_completion(self, args):
+    """Print the completion script for a shell."""
+    sys.stdout.write(completion.script(args.shell, self.progname,
+                                       completion.index_path(self.conf.config_path)))
+
   def start(self, args):
-    """Start all enabled services in priority order."""
-    persistent_skip_setup = self.template_values.get('main.skip_setup')
-    if not args.skip_setup and not persistent_skip_setup in ('True', 'true', '1'):
+    """Start enabled services, each after the services it depends on.
+
+    Up to main.parallelism services are started at once. Services that become
+    startable together are prewarmed together first.
+    """
+    persistent_skip_setup = self._get_value('main.skip_setup', 'false', proptypes.FLAG)
+    if not args.skip_setup and not persistent_skip_setup:
       setup_ok = self.setup(args)
       if not setup_ok:
         puts('\nTo ignore setup checks, use --skip-setup or set an override for main.skip_setup.')
         sys.exit(1)
-    if args.service_name is None:
-      for service in self.services_by_name.values():
-        if service.enabled:
-          service.start()
-    else:
-      self.services_by_name[args.service_name].start()
+    graph = self._get_dependency_graph(
+        srv.name for srv in self._select_services(args, enabled_only=True))
+    results = scheduler.run(
+        graph, lambda name: self._start_service(self.services_by_name[name]), self.parallelism,
+        before_batch=lambda names: self._prewarm([self.services_by_name[name]
+                                                  for name in names]))
+    self._exit_on_failures(results, 'start')
     puts('To view listening ports, run "{} status -v".'.format(self.progname))
 
-  def stop(self, args):
-    """Stop all running services in reverse priority order."""
-    if args.service_name is None:
-      for service in self.services_by_name.values()[::-1]:
-        service.stop()
+  @staticmethod
+  def _write_progress(text):
+    """Show lifecycle progress on the console."""
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+  def _start_service(self, service):
+    """Start one service, reporting on the console. Return True on success."""
+    try:
+      result = service.start(self._write_progress)
+    except lifecycle.StartError, err:
+      puts(colored.red(str(err)))
+      return False
+    if result.already_running:
+      puts('{} is already running.'.format(service.name))
     else:
-      self.services_by_name[args.service_name].stop()
+      puts(colored.green('process started.'))
+    return True
+
+  def _stop_service(self, service):
+    """Stop one service, reporting on the console. Return True on success."""
+    try:
+      result = service.stop(self._write_progress)
+    except lifecycle.StopError, err:
+      puts(colored.red(str(err)))
+      return False
+    if result.stopped_by is not None:
+      puts(colored.green('stopped'))
+    return True
+
+  def _select_services(self, args, enabled_only=False):
+    """Resolve the service selectors in args to ServiceProfiles in priority order.
+
+    Exact service names are always selected. Globs and --tag select matching
+    services, limited to enabled ones if enabled_only. Without selectors, all
+    services are selected, or all enabled ones if enabled_only.
+    """
+    names = getattr(args, 'service_names', None) or []
+    tags = getattr(args, 'tags', None) or []
+    services = self.services_by_name.values()
+    if not names and not tags:
+      return [srv for srv in services if srv.enabled or not enabled_only]
+    selected = set()
+    for pattern in names:
+      if pattern in self.services_by_name:
+        selected.add(pattern)
+        continue
+      matches = [srv.name for srv in services if fnmatch.fnmatchcase(srv.name, pattern) and
+                 (srv.enabled or not enabled_only)]
+      if not matches and not any(fnmatch.fnmatchcase(name, pattern)
+                                 for name in self.services_by_name):
+        puts('Unknown service "{}". Choose from: {}.'.format(
+             pattern, ', '.join(self.services_by_name.keys())))
+        sys.exit(2)
+      selected.update(matches)
+    for tag in tags:
+      matches = [srv.name for srv in services if tag in srv.tags]
+      if not matches:
+        puts('No service is tagged "{}".'.format(tag))
+        sys.exit(2)
+      selected.update(name for name in matches
+                      if self.services_by_name[name].enabled or not enabled_only)
+    return [srv for srv in services if srv.name in selected]
+
+  def _get_dependency_graph(self, names):
+    """Get the dependency graph restricted to names, exiting if it is invalid."""
+    if self.dependency_error is not None:
+      puts(self.dependency_error)
+      sys.exit(1)
+    return scheduler.subgraph(self.dependency_graph, names)
+
+  @staticmethod
+  def _exit_on_failures(results, operation):
+    """Report services that failed or were skipped by the scheduler, then exit."""
+    failed = [name for name, succeeded in results.iteritems() if succeeded is False]
+    skipped = [name for name, succeeded in results.iteritems() if succeeded is None]
+    if failed:
+      puts('Failed to {}: {}.'.format(operation, ', '.join(failed)))
+    if skipped:
+      puts('Did not {} because a dependency failed: {}.'.format(operation, ', '.join(skipped)))
+    if failed or skipped:
+      sys.exit(1)
+
+  def _prewarm(self, services):
+    """Pull prewarm_paths for stopped services into page cache concurrently."""
+    plans = [(srv.name, srv.prewarm_paths, srv.prewarm_max_bytes)
+             for srv in services
+             if srv.prewarm_paths and not srv.is_running()]
+    if not plans:
+      return
+    threads = self._get_value('main.prewarm_threads', '4', proptypes.INT)
+    reports = prewarm.prewarm_many(plans, threads)
+    for name, _, _ in plans:
+      report = reports[name]
+      if report.resident_bytes is None:
+        resident = 'residency unknown'
+      else:
+        resident = '{} already resident'.format(prewarm.format_bytes(report.resident_bytes))
+      puts('Prewarmed {}: {} files, {} ({}) in {:.2f}s.'.format(
+           name, report.files, prewarm.format_bytes(report.bytes), resident, report.seconds))
+      if report.skipped_bytes:
+        puts('    {} over {}.prewarm_max_bytes not prewarmed.'.format(
+             prewarm.format_bytes(report.skipped_bytes), name))
+
+  def stop(self, args):
+    """Stop all running services, each after the services that depend on it."""
+    graph = scheduler.reverse(self._get_dependency_graph(
+        srv.name for srv in self._select_services(args)))
+    results = scheduler.run(graph, lambda name: self._stop_service(self.services_by_name[name]),
+                            self.parallelism)
+    self._exit_on_failures(results, 'stop')
 
   def restart(self, args):
     """Restart all enabled services."""
-    if args.graceful:
-      if args.service_name is None:
-        for service in self.services_by_name.values():
-          if service.enabled:
-            service.graceful()
-      else:
-        self.services_by_name[args.service_name].graceful()
+    if args.rolling:
+      self.rolling_restart(args)
+    elif args.graceful:
+      services = self._select_services(args, enabled_only=True)
+      failed = [service.name for service in services if not service.graceful()]
+      if failed:
+        puts('Graceful restart failed: {}.'.format(', '.join(failed)))
+        sys.exit(1)
     else:
       self.stop(args)
       self.start(args)
 
+  def watch(self, args):
+    """Restart enabled services that crash, until interrupted.
+
+    Restarts back off from main.watch_backoff_seconds, doubling per crash up
+    to main.watch_backoff_max_seconds. A service that crashes more than
+    main.watch_restart_budget times within main.watch_budget_window_seconds
+    is given up on. Each crash is logged to the service's stdout file with the
+    tail of that file. A service whose pid file is removed, e.g. by stop, is
+    no longer watched.
+    """
+    services = self._select_services(args, enabled_only=True)
+    budget = watchdog.RestartBudget(
+        self._get_value('main.watch_restart_budget', '5', proptypes.INT),
+        self._get_value('main.watch_budget_window_seconds', '600', proptypes.DURATION),
+        self._get_value('main.watch_backoff_seconds', '1', proptypes.DURATION),
+        self._get_value('main.watch_backoff_max_seconds', '300', proptypes.DURATION))
+    records = {}
+    restart_at = {}
+    vanished = set()
+
+    def track(service):
+      """Remember the pid and start time of a running service. Return False if not running."""
+      proc = service.get_process()
+      record = service.get_pidfile_record() if proc is not None else None
+      if record is None or record.pid != proc.pid:
+        return False
+      if record.start_time is None:
+        record = record._replace(start_time=pidfile.proc_start_time(proc.pid))
+      records[service.name] = record
+      return True
+
+    for service in services:
+      if not track(service):
+        restart_at[service.name] = clock.monotonic()
+
+    def on_crash(service, description):
+      """Log a crash and schedule a restart if the budget allows."""
+      now = clock.monotonic()
+      delay = budget.record_crash(service.name, now)
+      if delay is None:
+        outcome = 'giving up after {} crashes within {:.0f}s'.format(
+            len(budget.crashes[service.name]), budget.window_seconds)
+        puts(colored.red('{} {}; {}.'.format(service.name, description, outcome)))
+      else:
+        outcome = 'restarting in {:.0f}s'.format(delay)
+        restart_at[service.name] = now + delay
+        puts(colored.yellow('{} {}; {}.'.format(service.name, description, outcome)))
+      output_tail = watchdog.tail(service.stdout)
+      logwriter.append(service.stdout, '[{}] {} watch: {} {}; {}. Last output:\n{}\n'.format(
+          time.strftime('%Y-%m-%d %H:%M:%S'), self.progname, service.name, description,
+          outcome, output_tail))
+
+    wake = threading.Event()
+    previous_handler = signal.signal(signal.SIGCHLD, lambda signum, frame: wake.set())
+    signal.siginterrupt(signal.SIGCHLD, False)
+    puts('Watching {}. Press Ctrl-C to stop watching.'.format(
+         ', '.join(srv.name for srv in services)))
+    try:
+      while records or restart_at:
+        logwriter.reap()
+        statuses = watchdog.reap_children()
+        live = watchdog.live_pids()
+        for service in services:
+          record = records.get(service.name)
+          if record is None:
+            continue
+          alive = pidfile.check_alive(record) if record.pid not in statuses else False
+          if alive is None:
+            alive = record.pid in live and not watchdog.is_zombie(record.pid)
+          if alive:
+            continue
+          del records[service.name]
+          current = service.get_pidfile_record(wait_for_lock=True)
+          if current is None:
+            puts('{} was stopped; no longer watching it.'.format(service.name))
+          elif current.pid != record.pid and track(service):
+            puts('{} was restarted as pid {}.'.format(service.name, current.pid))
+          else:
+            vanished.add(service.name)
+            on_crash(service, watchdog.describe_exit(statuses.get(record.pid)))
+        for name, when in sorted(restart_at.items(), key=lambda item: item[1]):
+          if when > clock.monotonic():
+            continue
+          service = self.services_by_name[name]
+          if name in vanished:
+            vanished.discard(name)
+            # stop removes the pid file only once the process is gone, so check again.
+            if service.get_pidfile_record() is None:
+              del restart_at[name]
+              puts('{} was stopped; no longer watching it.'.format(service.name))
+              continue
+          proc = service.get_process()
+          if proc is not None and watchdog.is_zombie(proc.pid):
+            # The old process has not been reaped yet; start() would think it is running.
+            restart_at[name] = clock.monotonic() + args.interval
+            continue
+          del restart_at[name]
+          if not (self._start_service(service) and track(service)):
+            on_crash(service, 'failed to start')
+        timeout = args.interval
+        if restart_at:
+          timeout = min(timeout, max(0, min(restart_at.values()) - clock.monotonic()))
+        wake.wait(timeout)
+        wake.clear()
+      puts(colored.red('No services left to watch.'))
+      sys.exit(1)
+    except KeyboardInterrupt:
+      puts('Stopped watching; services keep running.')
+    finally:
+      signal.signal(signal.SIGCHLD, previous_handler)
+
+  @staticmethod
+  def _get_rolling_groups(services, group_by='priority'):
+    """Split services into labelled restart groups.
+
+    Groups are priority tiers, or with group_by='tag', one group per tag in
+    sorted order. A service with several tags joins the group of its first
+    tag in sorted order; untagged services form a last group.
+    """
+    groups = collections.OrderedDict()
+    if group_by == 'tag':
+      for tag in sorted(set(tag for service in services for tag in service.tags)):
+        groups['tag {}'.format(tag)] = []
+      groups['untagged'] = []
+      for service in services:
+        label = 'tag {}'.format(sorted(service.tags)[0]) if service.tags else 'untagged'
+        groups[label].append(service)
+      return [(label, group) for label, group in groups.iteritems() if group]
+    for service in services:
+      groups.setdefault('priority {}'.format(service.priority), []).append(service)
+    return groups.items()
+
+  def rolling_restart(self, args):
+    """Restart services group by group, gating each batch on readiness.
+
+    Within a group at most --max-unavailable services are down at once. A
+    service that fails to stop, start or become ready within its
+    ready_timeout_seconds aborts the restart unless --continue-on-failure.
+    """
+    persistent_skip_setup = self._get_value('main.skip_setup', 'false', proptypes.FLAG)
+    if not args.skip_setup and not persistent_skip_setup:
+      if not self.setup(args):
+        puts('\nTo ignore setup checks, use --skip-setup or set an override for main.skip_setup.')
+        sys.exit(1)
+    services = self._select_services(args, enabled_only=True)
+    batch_size = max(1, args.max_unavailable)
+    failed = []
+    groups = self._get_rolling_groups(services, args.group_by)
+    for group_number, (label, group) in enumerate(groups, 1):
+      puts('Rolling restart of group {}/{} ({}): {}'.format(
+           group_number, len(groups), label, ', '.join(srv.name for srv in group)))
+      for offset in range(0, len(group), batch_size):
+        batch = group[offset:offset + batch_size]
+        stopped = []
+        for service in batch:
+          if self._stop_service(service):
+            stopped.append(service)
+          else:
+            failed.append(service.name)
+        started = [service for service in stopped if self._start_service(service)]
+        failed.extend(service.name for service in stopped if service not in started)
+        for service in started:
+          sys.stdout.write('Waiting for {}:'.format(service.name))
+          sys.stdout.flush()
+          started_at = time.time()
+          if service.wait_until_ready():
+            puts(colored.green(' ready after {:.1f}s.'.format(time.time() - started_at)))
+          else:
+            puts(colored.red(' not ready after {:g}s.'.format(service.ready_timeout_seconds)))
+            failed.append(service.name)
+        if failed and not args.continue_on_failure:
+          puts('Aborting rolling restart; failed: {}.'.format(', '.join(failed)))
+          sys.exit(1)
+    if failed:
+      puts('Rolling restart finished; failed: {}.'.format(', '.join(failed)))
+      sys.exit(1)
+
   def status(self, args):
     """Show status for all enabled services."""
-    if args.service_name is None:
-      for service in self.services_by_name.values():
-        service.status(args.verbose)
-    else:
-      self.services_by_name[args.service_name].status(args.verbose)
+    listening_by_pid = proctable.listening_addresses_by_pid() if args.verbose else None
+    process_table = proctable.read_process_table() if args.verbose else None
+    services = self._select_services(args)
+    pool = ThreadPool(max(1, min(len(services), STATUS_THREADS)))
+    try:
+      statuses = pool.map(lambda srv: srv.get_status(args.verbose, listening_by_pid,
+                                                     process_table), services)
+    finally:
+      pool.close()
+      pool.join()
+    for service, service_status in zip(services, statuses):
+      service.print_status(service_status, args.verbose)
 
 
   def _get_setup_steps(self, services):
@@ -177,6 +625,28 @@ class CLI(object):
           if title:
             setup_steps[title] = []
 
+    if self.invalid_values:
+      setup_steps['Fix malformed property values:'] = [
+          '{}\n    {} set {} <value>'.format(self.invalid_values[name], self.progname, name)
+          for name in sorted(self.invalid_values)]
+
+    if self.dependency_error is not None:
+      setup_steps[self.dependency_error] = [
+          'Fix the depends_on settings of the services named above.']
+
+    if self.sizing_error is not None:
+      setup_steps[self.sizing_error] = [
+          'Fix the sizing declarations, or main.sizing_reserved_memory_mb.']
+
+    invalid_ports = [message for srv in services if srv.enabled for message in srv.invalid_ports]
+    if invalid_ports:
+      setup_steps['Fix the properties that set these service ports:'] = invalid_ports
+
+    port_conflicts = self._get_port_conflicts(services)
+    if port_conflicts:
+      title = 'Stop the processes holding ports needed by services that are not running:'
+      setup_steps[title] = port_conflicts
+
     if self.different_suggestions:
       for suggestion in self.different_suggestions.values():
         setup_steps.setdefault(suggestion.why, [])
@@ -191,12 +661,27 @@ class CLI(object):
     return setup_steps
 
 
+  @staticmethod
+  def _get_port_conflicts(services):
+    """Check declared ports of stopped, enabled services with one socket scan."""
+    services_by_port = {}
+    for service in services:
+      if service.enabled and service.ports and not service.is_running():
+        for port in service.ports:
+          services_by_port.setdefault(port, []).append(service.name)
+    conflicts = []
+    for port, owner in sorted(proctable.find_port_owners(services_by_port.keys()).iteritems()):
+      if owner.pid is None:
+        held_by = 'a process owned by another user'
+      else:
+        held_by = '{} (pid {})'.format(owner.name, owner.pid)
+      conflicts.append('port {} for {} is held by {}'.format(
+          port, ', '.join(services_by_port[port]), held_by))
+    return conflicts
+
   def setup(self, args):
     """Report on OS-level and service reqs, returning True if setup is complete."""
-    if args.service_name is None:
-      services = [srv for srv in self.services_by_name.values() if srv.enabled]
-    else:
-      services = [self.services_by_name[args.service_name],]
+    services = self._select_services(args, enabled_only=True)
     setup_steps = self._get_setup_steps(services)
     if setup_steps:
       puts('Setup required.')
@@ -212,25 +697,207 @@ class CLI(object):
       return True
 
   def snap(self, args):
-    """Return a performance snapshot."""
-    if args.service_name is None:
-      services = [srv for srv in self.services_by_name.values()]
-    else:
-      services = [self.services_by_name[args.service_name],]
+    """Take performance snapshots.
+
+    In each iteration the system info command and every service's snap
+    command run concurrently, each with a timeout, and their captured output
+    is written one service after another. Iterations start on interval
+    boundaries of a monotonic clock; a boundary missed by a slow iteration is
+    skipped. With --trigger, services are only sampled on those boundaries,
+    and snapped along with the system info when they cross their thresholds.
+    """
+    services = self._select_services(args)
     system_info_cmd = self.template_values.get('main.system_info_cmd')
-    for iteration in range(1, args.count + 1):
-      if system_info_cmd:
-        if args.output:
-          out = open(args.output, 'a+')
-        else:
-          out = sys.stdout
-        out.write('[{}] System info #{}. Running: {}.\n'.format(
-                  time.strftime('%Y-%m-%d %H:%M:%S'), iteration, system_info_cmd))
-        out.flush()
-        subprocess.call(system_info_cmd, shell=True, stdout=out, stderr=out)
-        if args.output:
-          out.close()
-      for svc in services:
-        svc.snap(iteration, args.output)
-      if iteration != args.count:
-        time.sleep(args.interval)
+    store_dir = args.store or self.template_values.get('main.snap_store_dir')
+    stores = {}
+    stores_lock = threading.Lock()
+
+    def store_sample(svc, sample):
+      """Append a sample to the service's store, creating the store on first use."""
+      with stores_lock:
+        if svc.name not in stores:
+          stores[svc.name] = samplestore.RingStore(self._get_store_path(store_dir, svc.name))
+      stores[svc.name].append(sample)
+
+    def take_snapshot(iteration, svc, sample_too=True):
+      """Capture output for one service, or the system info if svc is None."""
+      if svc is None:
+        header = '[{}] System info #{}. Running: {}.\n'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S'), iteration, system_info_cmd)
+        timeout = args.timeout or self._get_value('main.snap_timeout_seconds', '30',
+                                                  proptypes.DURATION)
+        return header + lifecycle.run_captured(system_info_cmd, timeout=timeout)[1]
+      result = svc.capture_snapshot(iteration, args.timeout)
+      if store_dir and sample_too:
+        # Only running services are sampled, so stopped ones get no store.
+        sample = svc.sample()
+        if sample is not None:
+          store_sample(svc, sample)
+      return result.output if result is not None else ''
+
+    def write_outputs(outputs):
+      """Write captured outputs to --output, or else stdout."""
+      out = open(args.output, 'a+') if args.output else sys.stdout
+      out.write(''.join(outputs))
+      out.flush()
+      if args.output:
+        out.close()
+
+    tasks = ([None] if system_info_cmd else []) + services
+    pool = ThreadPool(max(1, len(tasks)))
+    try:
+      if args.trigger:
+        self._snap_on_trigger(args, services, store_sample if store_dir else None, pool,
+                              take_snapshot, write_outputs, bool(system_info_cmd))
+        return
+      count = args.count or 1
+      origin = clock.monotonic()
+      for iteration in range(1, count + 1):
+        write_outputs(pool.map(lambda svc: take_snapshot(iteration, svc), tasks))
+        if args.prom:
+          metrics.write_textfile(args.prom, self._render_metrics())
+        if iteration != count and args.interval > 0:
+          clock.sleep_until_boundary(origin, args.interval)
+    finally:
+      pool.close()
+      for store in stores.values():
+        store.close()
+
+  # pylint: disable=too-many-arguments
+  def _snap_on_trigger(self, args, services, store_sample, pool, take_snapshot, write_outputs,
+                       with_system_info):
+    """Sample services every --interval seconds and snap those that cross their thresholds.
+
+    Samples are passed to store_sample(svc, sample) unless it is None.
+    Captures of a service are at least main.trigger_cooldown_seconds apart,
+    and at most main.trigger_max_per_hour are taken across all services.
+    """
+    if args.interval <= 0:
+      puts(colored.red('--interval must be positive with --trigger.'))
+      sys.exit(1)
+    detectors = dict((svc.name, trigger.Detector(svc.trigger_thresholds))
+                     for svc in services if trigger.is_enabled(svc.trigger_thresholds))
+    if not detectors:
+      puts(colored.red('No thresholds set. Set <service>.trigger_cpu_percent, '
+                       'trigger_rss_growth_per_second, trigger_threads or trigger_fds.'))
+      sys.exit(1)
+    limiter = trigger.CaptureLimiter(
+        self._get_value('main.trigger_cooldown_seconds', '300', proptypes.DURATION),
+        self._get_value('main.trigger_max_per_hour', '6', proptypes.INT))
+    captures = 0
+    origin = clock.monotonic()
+    puts('Sampling {} every {:g}s. Press Ctrl-C to stop.'.format(
+        ', '.join(sorted(detectors)), args.interval))
+    try:
+      while True:
+        for svc in services:
+          if svc.name not in detectors:
+            continue
+          sample = svc.sample()
+          if sample is None:
+            detectors[svc.name].reset()
+            continue
+          if store_sample is not None:
+            store_sample(svc, sample)
+          now = clock.monotonic()
+          reasons = detectors[svc.name].check(sample, now)
+          if not reasons or not limiter.allow(svc.name, now):
+            continue
+          captures += 1
+          header = '[{}] Triggered snapshot #{} for {}: {}.\n'.format(
+              time.strftime('%Y-%m-%d %H:%M:%S'), captures, svc.name, ', '.join(reasons))
+          tasks = ([None] if with_system_info else []) + [svc]
+          iteration = captures
+          write_outputs([header] + pool.map(lambda task: take_snapshot(iteration, task, False),
+                                            tasks))
+          if args.output:
+            puts(header.rstrip('\n'))
+          if captures == args.count:
+            return
+        clock.sleep_until_boundary(origin, args.interval)
+    except KeyboardInterrupt:
+      puts('Stopped sampling.')
+
+  @staticmethod
+  def _get_store_path(store_dir, service_name):
+    """Get the sample store path for a service."""
+    return os.path.join(store_dir, '{}.ring'.format(service_name))
+
+  def snap_query(self, args):
+    """Summarize or export stored snap samples over a time window."""
+    services = self._select_services(args)
+    store_dir = args.store or self.template_values.get('main.snap_store_dir')
+    if not store_dir:
+      puts('No sample store directory. Use --store or set main.snap_store_dir.')
+      sys.exit(1)
+    now = time.time()
+    start, end = now - args.since, now - args.until
+    if args.csv:
+      puts(','.join(('service',) + samplestore.Sample._fields))
+    for svc in services:
+      store_path = self._get_store_path(store_dir, svc.name)
+      if not os.path.exists(store_path):
+        continue
+      with samplestore.RingStore(store_path, readonly=True) as store:
+        if args.csv:
+          for sample in store.iter_window(start, end):
+            puts(','.join([svc.name] + [str(value) for value in sample]))
+          continue
+        samples = list(store.iter_window(start, end))
+      puts('{} ({} samples)'.format(svc.name, len(samples)))
+      with indent(4):
+        puts(''.join(column.rjust(14) for column in ('', 'min', 'avg', 'p95', 'max')))
+        for stats in samplestore.summarize(samples):
+          puts(stats.field.rjust(14) + ''.join('{:14.1f}'.format(value) for value in stats[1:]))
+
+  def _render_metrics(self):
+    """Collect metrics for all services and render them as Prometheus text."""
+    started = time.time()
+    services = self.services_by_name.values()
+    families = metrics.service_families(services, proctable.listening_addresses_by_pid(),
+                                        started)
+    metrics.add(families, 'platform_setup_check_failures', 'gauge',
+                'Setup checks currently failing for enabled services.', {},
+                len(self._get_setup_steps([srv for srv in services if srv.enabled])))
+    metrics.add(families, 'platform_cli_metrics_collection_seconds', 'gauge',
+                'Time taken to collect these metrics.', {}, time.time() - started)
+    return metrics.render(families, {'cli': self.progname})
+
+  def export_metrics(self, args):
+    """Write service metrics in the Prometheus text format."""
+    path = args.output or self.template_values.get('main.metrics_path')
+    text = self._render_metrics()
+    if path:
+      metrics.write_textfile(path, text)
+    else:
+      sys.stdout.write(text)
+
+  def fan_out(self, args):
+    """Run start, stop, status or snap for several installs and aggregate the results."""
+    targets = fanout.resolve_targets(args.targets, os.path.basename(self.conf.config_path))
+    listening_by_pid = None
+    if args.operation == 'status' and args.verbose:
+      listening_by_pid = proctable.listening_addresses_by_pid()
+    # Start from the operation's own defaults so that every option it reads is present.
+    op_args = self.subcommand_parsers[args.operation].parse_args([])
+    op_args.verbose = args.verbose
+    op_args.skip_setup = args.skip_setup
+
+    def run_instance(target):
+      """Build the CLI for one install and run the operation on it."""
+      (defaults, suggestions, docs, service_profiles, os_requirements,
+       service_sizings) = self.instance_args
+      instance = type(self)(self.progname, target, defaults, suggestions, docs,
+                            copy.deepcopy(service_profiles), os_requirements, service_sizings)
+      if args.operation == 'status':
+        return [service.get_status(args.verbose, listening_by_pid)._asdict()
+                for service in instance.services_by_name.values()]
+      getattr(instance, args.operation)(op_args)
+
+    results = fanout.run(targets, run_instance, args.processes)
+    if args.format == 'json':
+      puts(fanout.format_json(args.operation, results))
+    else:
+      puts(fanout.format_table(results))
+    if any(result.exit_code for result in results):
+      sys.exit(1)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""A monotonic clock for scheduling.
+
+Python 2 has no time.monotonic(), so CLOCK_MONOTONIC is read with
+clock_gettime() through ctypes. Where that is unavailable we fall back to
+time.time(), which can jump when the wall clock is adjusted.
+"""
+
+import ctypes
+import ctypes.util
+import time
+
+CLOCK_MONOTONIC = 1
+
+
+class _Timespec(ctypes.Structure):
+  """struct timespec."""
+  _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _load_clock_gettime():
+  """Return libc's clock_gettime, or None."""
+  for name in (ctypes.util.find_library('c'), ctypes.util.find_library('rt')):
+    if name is None:
+      continue
+    try:
+      func = ctypes.CDLL(name, use_errno=True).clock_gettime
+    except (OSError, AttributeError):
+      continue
+    func.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+    func.restype = ctypes.c_int
+    return func
+  return None
+
+
+_CLOCK_GETTIME = _load_clock_gettime()
+
+
+def monotonic():
+  """Return seconds from an arbitrary fixed point, unaffected by wall clock changes."""
+  if _CLOCK_GETTIME is not None:
+    timespec = _Timespec()
+    if _CLOCK_GETTIME(CLOCK_MONOTONIC, ctypes.byref(timespec)) == 0:
+      return timespec.tv_sec + timespec.tv_nsec * 1e-9
+  return time.time()
+
+
+def sleep_until_boundary(origin, interval):
+  """Sleep until the next multiple of interval seconds after origin.
+
+  origin is a monotonic() time. Boundaries already missed are skipped rather
+  than caught up on. Returns the boundary slept until.
+  """
+  now = monotonic()
+  boundary = origin + (int((now - origin) / interval) + 1) * interval
+  time.sleep(max(0, boundary - now))
+  return boundary
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Shell completion from a static index file.
+
+Constructing the CLI resolves every template, which is too slow to do on each
+press of the tab key. Instead, every invocation of the CLI keeps a plain text
+index next to the overrides file, '<config>.completion', up to date, and the
+generated bash and zsh functions read it with awk without starting Python.
+Each line of the index is one of:
+
+  command <name> <argument kind, or ->
+  service <name>
+  tag <name>
+  property <name>
+"""
+
+import hashlib
+import os
+import pipes
+import re
+
+HEADER_PREFIX = '# platform_cli completion index '
+
+BASH_TEMPLATE = r'''_{func}_complete() {{
+  local index={index} cur=${{COMP_WORDS[COMP_CWORD]}} prev=${{COMP_WORDS[COMP_CWORD-1]}} kind
+  if [ "$COMP_CWORD" -eq 1 ]; then
+    kind=command
+  elif [ "$prev" = --tag ] || [ "$prev" = -t ]; then
+    kind=tag
+  else
+    kind=$(awk -v c="${{COMP_WORDS[1]}}" '$1 == "command" && $2 == c {{ print $3 }}' "$index")
+  fi
+  if [ -z "$kind" ] || [ "$kind" = - ]; then
+    return 0
+  fi
+  COMPREPLY=($(awk -v k="$kind" -v p="$cur" '$1 == k && index($2, p) == 1 {{ print $2 }}' "$index"))
+}}
+complete -F _{func}_complete {progname}
+'''
+
+ZSH_TEMPLATE = r'''_{func}_complete() {{
+  local index={index} kind
+  if (( CURRENT == 2 )); then
+    kind=command
+  elif [[ ${{words[CURRENT-1]}} == (--tag|-t) ]]; then
+    kind=tag
+  else
+    kind=$(awk -v c="${{words[2]}}" '$1 == "command" && $2 == c {{ print $3 }}' "$index")
+  fi
+  if [[ -z $kind || $kind == - ]]; then
+    return 1
+  fi
+  compadd -- ${{(f)"$(awk -v k="$kind" '$1 == k {{ print $2 }}' "$index")"}}
+}}
+compdef _{func}_complete {progname}
+'''
+
+
+def index_path(config_path):
+  """Return the path of the completion index for an overrides file."""
+  return '{}.completion'.format(config_path)
+
+
+def build_index(commands, services, tags, properties):
+  """Render the index body.
+
+  Args:
+    commands: (name, argument kind) pairs; the kind is 'service', 'property'
+      or None.
+    services, tags, properties: Names to complete.
+  """
+  lines = ['command {} {}'.format(name, kind or '-') for name, kind in commands]
+  lines.extend('service {}'.format(name) for name in services)
+  lines.extend('tag {}'.format(name) for name in tags)
+  lines.extend('property {}'.format(name) for name in properties)
+  return '\n'.join(lines) + '\n'
+
+
+def refresh_index(path, body):
+  """Rewrite the index at path if its body changed. Return True if written.
+
+  The header carries a hash of the body, so only the first line of an
+  existing index is read. Failures to write are ignored.
+  """
+  header = HEADER_PREFIX + hashlib.sha1(body).hexdigest()
+  try:
+    with open(path, 'r') as index_file:
+      if index_file.readline().rstrip('\n') == header:
+        return False
+  except IOError:
+    pass
+  temp_path = '{}.{}.temp'.format(path, os.getpid())
+  try:
+    with open(temp_path, 'w') as temp_file:
+      temp_file.write(header + '\n' + body)
+    os.rename(temp_path, path)
+  except (IOError, OSError):
+    return False
+  return True
+
+
+def script(shell, progname, path):
+  """Return the completion script for shell ('bash' or 'zsh')."""
+  template = BASH_TEMPLATE if shell == 'bash' else ZSH_TEMPLATE
+  return template.format(func=re.sub(r'\W', '_', progname), progname=progname,
+                         index=pipes.quote(path))
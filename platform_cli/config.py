@@ -6,11 +6,16 @@
 Manage a set of variables shared among multiple services that may be used
 during startup. Variables have three different incarnations:
 
-  Default: Has a name and a value. Passed into ConfigCLI when it is
-  instantiated, based on statically-set values.
+  Default: Has a name, a value and optionally a proptypes.PropertyType.
+  Passed into ConfigCLI when it is instantiated, based on statically-set
+  values.
 
   Override: Has a name and a value. Read by ConfigCLI from the global
-  user override configuration file.
+  user override configuration file and from the '*.properties' fragments in
+  the directory next to it named '<config>.d'. Fragments are applied in
+  lexical order of their names, e.g. '10-memory.properties' before
+  '20-ports.properties', and every fragment takes precedence over the main
+  file, which is the one 'set' and 'del' edit.
 
   Suggestion: Has a name, a value, and a "why" string. Meant to be generated by
   the script that imports ConfigCLI, and passed in when ConfigCLIU is
@@ -26,13 +31,15 @@ What doesn't go here:
     startup process itself.
 """
 
-import difflib
 import sys
 import collections
+import json
+import os
 import textwrap
+import time
 import subprocess
 
-from . import props, protected_file_path, template
+from . import cache, journal, keyindex, props, proptypes, protected_file_path, template
 from clint.textui import colored, puts, indent
 
 
@@ -40,10 +47,12 @@ class Error(Exception):
   """Base exception class for this module."""
 
 # pylint: disable=invalid-name
-Default = collections.namedtuple('Default', ['name', 'value'])
+Default = collections.namedtuple('Default', ['name', 'value', 'type'])
+Default.__new__.__defaults__ = (None,)
 Override = collections.namedtuple('Override', ['name', 'value'])
 Suggestion = collections.namedtuple('Suggestion', ['name', 'value', 'why'])
 Doc = collections.namedtuple('Doc', ['name', 'doc'])
+DocEntry = collections.namedtuple('DocEntry', ['name', 'category', 'doc', 'lines', 'default'])
 
 
 def validate_and_map_by_name(variables):
@@ -77,6 +86,44 @@ class Config(object):
     self.defaults = defaults if defaults is not None else []
     self.suggestions = suggestions if suggestions is not None else []
     self.docs = docs if docs is not None else []
+    self._cache = None
+    self._default_names = None
+    self._defaults_by_name = None
+    self._docs_by_name = None
+    self._docs_index = None
+    self._key_index = None
+
+  def get_cache(self):
+    """Return the on-disk cache kept next to the overrides file."""
+    if self._cache is None:
+      self._cache = cache.Cache('{}.cache'.format(self.config_path))
+    return self._cache
+
+  def get_defaults_by_name(self):
+    """Return the defaults mapped by name."""
+    if self._defaults_by_name is None:
+      self._defaults_by_name = validate_and_map_by_name(self.defaults)
+    return self._defaults_by_name
+
+  def get_docs_by_name(self):
+    """Return the docs mapped by name."""
+    if self._docs_by_name is None:
+      self._docs_by_name = validate_and_map_by_name(self.docs)
+    return self._docs_by_name
+
+  def get_default_names(self):
+    """Return the set of all default variable names."""
+    if self._default_names is None:
+      self._default_names = frozenset(default.name for default in self.defaults)
+    return self._default_names
+
+  def get_key_index(self):
+    """Return a KeyIndex over the default names, loaded from the cache when current."""
+    if self._key_index is None:
+      names = sorted(self.get_default_names())
+      self._key_index = self.get_cache().get('key_index', cache.signature(names),
+                                             lambda: keyindex.KeyIndex(names))
+    return self._key_index
 
   def list_vars(self, args):
     """Console output of active variable values."""
@@ -85,8 +132,13 @@ class Config(object):
       namelist = sorted(vals.keys())
     else:
       namelist = sorted(different_defaults.keys())
-    if args.substring_match is not None:
+    if args.substring_match is not None and args.fuzzy:
+      shown = set(namelist)
+      namelist = [name for name in self.get_key_index().search(args.substring_match)
+                  if name in shown]
+    elif args.substring_match is not None:
       namelist = [name for name in namelist if args.substring_match in name]
+    sources = self.get_layered_overrides()[1] if args.verbose else {}
     if namelist:
       column_width = max(len(name) for name in namelist) + 1
       for name in namelist:
@@ -94,18 +146,27 @@ class Config(object):
           puts('{}={}'.format(name, vals[name]))
         else:
           if name in different_defaults:
-            puts(colored.green('{} {} (default is {})'.format(
-                 name.ljust(column_width), vals[name], different_defaults[name].value)))
+            source = ' from {}'.format(self._format_source(sources[name])) if sources else ''
+            puts(colored.green('{} {} (default is {}){}'.format(
+                 name.ljust(column_width), vals[name], different_defaults[name].value, source)))
           else:
             puts('{} {}'.format(name.ljust(column_width), vals[name]))
 
   def enable(self, args):
     """Enable a service."""
-    self.set_override('{}.enabled'.format(args.service_name), 'True')
+    try:
+      self.set_override('{}.enabled'.format(args.service_name), 'True')
+    except journal.Error, err:
+      puts(colored.red('Error: {}'.format(err)))
+      sys.exit(1)
 
   def disable(self, args):
     """Disable a service."""
-    self.delete_override('{}.enabled'.format(args.service_name))
+    try:
+      self.delete_override('{}.enabled'.format(args.service_name))
+    except journal.Error, err:
+      puts(colored.red('Error: {}'.format(err)))
+      sys.exit(1)
 
   def set_var(self, args):
     """Set variable override value."""
@@ -115,7 +176,19 @@ class Config(object):
         ('Error: Can\'t set override value for "{}" '
          'because it is an unknown variable name.').format(args.property_name)
     )
-    self.set_override(args.property_name, args.property_value)
+    default = self.get_defaults_by_name()[args.property_name]
+    if default.type is not None and '{{' not in args.property_value:
+      try:
+        default.type.parse(args.property_value, args.property_name)
+      except proptypes.Error, err:
+        puts('Error: {}'.format(err))
+        sys.exit(1)
+    try:
+      self.set_override(args.property_name, args.property_value)
+    except journal.Error, err:
+      puts(colored.red('Error: {}'.format(err)))
+      sys.exit(1)
+    self._warn_if_masked(args.property_name)
 
   def delete_var(self, args):
     """Delete variable override value."""
@@ -124,14 +197,18 @@ class Config(object):
         ('Error: Can\'t delete override value for "{}" '
          'because it is an unknown variable name.').format(args.property_name)
     )
-    self.delete_override(args.property_name)
+    try:
+      self.delete_override(args.property_name)
+    except journal.Error, err:
+      puts(colored.red('Error: {}'.format(err)))
+      sys.exit(1)
+    self._warn_if_masked(args.property_name)
 
   def exit_on_unknown_key(self, key, message):
     """If a key is not in the defaults, show close matches and exit."""
-    default_names = [default.name for default in self.defaults]
-    if key not in default_names:
+    if key not in self.get_default_names():
       puts(message)
-      close_matches = difflib.get_close_matches(key, default_names)
+      close_matches = self.get_key_index().suggest(key)
       if close_matches:
         puts('Did you mean:')
         with indent(4):
@@ -146,21 +223,141 @@ class Config(object):
       conf_items = props.get_items(self.config_path, create_new=True)
     return [Override(name, value) for name, value in conf_items]
 
+  def get_fragment_dir(self):
+    """Return the directory of override fragments layered over the main file."""
+    return '{}.d'.format(self.config_path)
+
+  def _get_override_files(self):
+    """Return the main override file and the fragments, lowest precedence first."""
+    try:
+      names = sorted(name for name in os.listdir(self.get_fragment_dir())
+                     if name.endswith('.properties') and not name.startswith('.'))
+    except OSError:
+      names = []
+    return [self.config_path] + [os.path.join(self.get_fragment_dir(), name) for name in names]
+
+  def get_layered_overrides(self):
+    """Merge the main override file and its fragments.
+
+    Each file is parsed only when its (path, inode, mtime, size) differs from
+    what the cache recorded, so unchanged files are never reparsed.
+
+    Returns:
+      A tuple of a list of Override and a dictionary mapping each overridden
+      name to the path of the file that supplied its value.
+    """
+    if not os.path.exists(self.config_path):
+      self.get_overrides()
+    stat_sigs = collections.OrderedDict()
+    for path in self._get_override_files():
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue
+      stat_sigs[path] = '{}:{}:{!r}:{}'.format(path, stat.st_ino, stat.st_mtime, stat.st_size)
+
+    def build():
+      """Parse the files that changed, reusing the cached items of the others."""
+      previous = self.get_cache().peek('override_files') or {}
+      parsed = {}
+      for path, stat_sig in stat_sigs.iteritems():
+        if path in previous and previous[path][0] == stat_sig:
+          parsed[path] = previous[path]
+        elif path == self.config_path:
+          parsed[path] = (stat_sig, [tuple(override) for override in self.get_overrides()])
+        else:
+          parsed[path] = (stat_sig, props.get_items(path))
+      return parsed
+
+    parsed = self.get_cache().get('override_files', cache.signature(stat_sigs.values()), build)
+    values = {}
+    sources = {}
+    for path in stat_sigs:
+      for name, value in parsed[path][1]:
+        values[name] = value
+        sources[name] = path
+    return [Override(name, values[name]) for name in sorted(values)], sources
+
+  def _format_source(self, path):
+    """Show an override file relative to the directory of the main file."""
+    return os.path.relpath(path, os.path.dirname(os.path.abspath(self.config_path)))
+
+  def _warn_if_masked(self, key):
+    """Tell the user when a fragment overrides the main file's value for key."""
+    source = self.get_layered_overrides()[1].get(key)
+    if source is not None and source != self.config_path:
+      puts(colored.yellow('Note: {} is also set in {}, which takes precedence.'.format(
+          key, self._format_source(source))))
+
+  def _journal_change(self, key, new_value):
+    """Return a props before_write callback that journals a change of key to new_value."""
+    def record(old_value):
+      """Append the change, unless it changes nothing."""
+      if old_value != new_value:
+        journal.append(journal.journal_path(self.config_path),
+                       journal.new_entry(key, old_value, new_value))
+    return record
+
   def delete_override(self, key):
-    """Delete an override for a single key."""
+    """Delete an override for a single key, recording it in the journal first.
+
+    Raises journal.Error, leaving the override in place, if the change cannot
+    be journaled.
+    """
     with protected_file_path.ProtectedFilePath(self.config_path):
-      props.delete_key(self.config_path, key, create_new=True)
+      props.delete_key(self.config_path, key, create_new=True,
+                       before_write=self._journal_change(key, None))
 
   def set_override(self, key, value):
-    """Set an override for a single key."""
+    """Set an override for a single key, recording it in the journal first.
+
+    Raises journal.Error, leaving the old value in place, if the change cannot
+    be journaled.
+    """
     with protected_file_path.ProtectedFilePath(self.config_path):
-      props.set_key(self.config_path, key, value, create_new=True)
+      props.set_key(self.config_path, key, value, create_new=True,
+                    before_write=self._journal_change(key, value))
+
+  def show_history(self, args):
+    """Show the most recent override changes, numbered back from the latest."""
+    entries = journal.read(journal.journal_path(self.config_path))
+    numbered = [(len(entries) - position, entry) for position, entry in enumerate(entries)
+                if args.substring_match is None or args.substring_match in entry.key]
+    for number, entry in numbered[-args.limit:]:
+      if entry.new is None:
+        change = 'deleted {} (was {})'.format(entry.key, entry.old)
+      elif entry.old is None:
+        change = 'set {} = {}'.format(entry.key, entry.new)
+      else:
+        change = 'set {} = {} (was {})'.format(entry.key, entry.new, entry.old)
+      puts('{} {} {} {}'.format(
+          str(number).rjust(4), time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.timestamp)),
+          entry.user.ljust(12), change))
+
+  def rollback(self, args):
+    """Undo the most recent override changes, newest first."""
+    entries = journal.read(journal.journal_path(self.config_path))
+    if not 0 < args.count <= len(entries):
+      puts(colored.red('Error: Can\'t roll back {} change(s); the journal holds {}.'.format(
+          args.count, len(entries))))
+      sys.exit(1)
+    for entry in reversed(entries[-args.count:]):
+      try:
+        if entry.old is None:
+          self.delete_override(entry.key)
+          puts('Deleted {}'.format(entry.key))
+        else:
+          self.set_override(entry.key, entry.old)
+          puts('Set {} = {}'.format(entry.key, entry.old))
+      except journal.Error, err:
+        puts(colored.red('Error: {}'.format(err)))
+        sys.exit(1)
 
   def get_active_values_and_metadata(self):
     """Obtain the active variable mapping plus metadata."""
 
     defaults_by_name = validate_and_map_by_name(self.defaults)
-    overrides_by_name = validate_and_map_by_name(self.get_overrides())
+    overrides_by_name = validate_and_map_by_name(self.get_layered_overrides()[0])
     suggestions_by_name = validate_and_map_by_name(self.suggestions)
 
     active_values = {}
@@ -181,26 +378,102 @@ class Config(object):
         different_suggestions[name] = suggestion
     return active_values, different_suggestions, different_defaults
 
-  def show_docs(self, _):
-    """Show documentation and defaults for variables."""
+  def get_docs_index(self):
+    """Return DocEntry tuples grouped by category, loaded from the cache when current.
+
+    Returns:
+      A list of (category, [DocEntry]) pairs, 'main' first and the rest sorted,
+      with entries sorted by name and their text already wrapped.
+    """
+    if self._docs_index is not None:
+      return self._docs_index
+    defaults_by_name = self.get_defaults_by_name()
+    docs_by_name = self.get_docs_by_name()
+    names = sorted(docs_by_name)
+    sig = cache.signature(part for name in names
+                          for part in (name, docs_by_name[name].doc, defaults_by_name[name].value))
+
+    def build():
+      """Group and wrap every documented variable."""
+      entries_by_category = {}
+      for name in names:
+        category = name.split('.')[0]
+        doc = docs_by_name[name].doc
+        entries_by_category.setdefault(category, []).append(
+            DocEntry(name, category, doc, tuple(textwrap.wrap(doc)), defaults_by_name[name].value))
+      categories = sorted(entries_by_category, key=lambda category: (category != 'main', category))
+      return [(category, entries_by_category[category]) for category in categories]
+
+    self._docs_index = self.get_cache().get('docs_index', sig, build)
+    return self._docs_index
+
+  @staticmethod
+  def _format_doc_entry(entry, override):
+    """Format one documented variable for the console."""
+    lines = ['    {}'.format(entry.name)]
+    lines.extend('        {}'.format(line) for line in entry.lines)
+    lines.append('            Default: {}'.format(entry.default))
+    if override is not None:
+      lines.append('            Override: {}'.format(override))
+    return '\n'.join(lines) + '\n'
+
+  def get_typed_values(self, active_values):
+    """Parse the active values of defaults that carry a type.
+
+    Returns:
+      A tuple of a dictionary mapping names to parsed values and a dictionary
+      mapping names of malformed values to an error message. A malformed value
+      is replaced by its parsed default.
+
+    Raises:
+      Error: The default value itself is malformed.
+    """
+    typed_values = {}
+    invalid = {}
+    rendered_defaults = None
+    for name, default in self.get_defaults_by_name().iteritems():
+      if default.type is None:
+        continue
+      try:
+        typed_values[name] = default.type.parse(active_values[name], name)
+        continue
+      except proptypes.Error, err:
+        invalid[name] = str(err)
+      if rendered_defaults is None:
+        rendered_defaults = template.render_values_in_template_map(
+            dict((each.name, each.value) for each in self.defaults))
+      try:
+        typed_values[name] = default.type.parse(rendered_defaults[name], name)
+      except proptypes.Error, err:
+        raise Error('Bad default: {}'.format(err))
+    return typed_values, invalid
+
+  def show_docs(self, args):
+    """Show documentation, defaults and overrides for variables.
+
+    With a pattern, only variables whose name or documentation contains it are
+    shown, and they are written out as they are found instead of paged.
+    """
+    overrides = dict(self.get_layered_overrides()[0])
+    pattern = args.pattern.lower() if args.pattern is not None else None
+    entries = (entry for _, category_entries in self.get_docs_index() for entry in category_entries
+               if pattern is None or pattern in entry.name.lower() or pattern in entry.doc.lower())
+    if args.format == 'json':
+      sys.stdout.write(json.dumps(
+          [{'name': entry.name, 'category': entry.category, 'doc': entry.doc,
+            'default': entry.default, 'override': overrides.get(entry.name)}
+           for entry in entries], indent=2, sort_keys=True) + '\n')
+      return
+    if pattern is not None:
+      for entry in entries:
+        sys.stdout.write(self._format_doc_entry(entry, overrides.get(entry.name)) + '\n')
+      return
     output = []
-    defaults_by_name = validate_and_map_by_name(self.defaults)
-    docs_by_name = validate_and_map_by_name(self.docs)
-    names_by_category = {}
-    for name in docs_by_name:
-      category = name.split('.')[0]
-      names_by_category.setdefault(category, [])
-      names_by_category[category].append(name)
-    categories = sorted(names_by_category.keys())
-    categories.remove('main')
-    categories = ['main'] + categories
-    for category in categories:
+    for category, category_entries in self.get_docs_index():
       output.append(category.title())
       output.append('-' * len(category))
-      for name in sorted(names_by_category[category]):
-        output.append('    {}'.format(name))
-        output.extend('        {}'.format(line) for line in textwrap.wrap(docs_by_name[name].doc))
-        output.append('            Default: {}\n'.format(defaults_by_name[name].value))
+      output.extend(self._format_doc_entry(entry, overrides.get(entry.name))
+                    for entry in category_entries)
       output.append('\n')
     try:
       proc = subprocess.Popen(['less', '-K', '-'], stdin=subprocess.PIPE)
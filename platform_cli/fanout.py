@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Run one CLI operation across many platform installs on the same host.
+
+Each install is identified by its overrides file. Instances run in a pool of
+forked worker processes so a crash or sys.exit() in one cannot affect the
+others, and each worker's console output is captured at the file descriptor
+level so it can be reported per instance. Anything computed in the parent
+before the pool starts, such as a scan of the socket table, is shared with
+every worker through the fork.
+"""
+
+import collections
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import traceback
+
+# pylint: disable=invalid-name
+InstanceResult = collections.namedtuple(
+    'InstanceResult', ['target', 'exit_code', 'error', 'output', 'services'])
+
+# Set in the parent before forking the pool; read by workers.
+_CONTEXT = {}
+
+
+def resolve_targets(targets, overrides_basename):
+  """Turn install roots into overrides file paths, keeping order and dropping repeats."""
+  paths = []
+  for target in targets:
+    path = os.path.abspath(target)
+    if os.path.isdir(path):
+      path = os.path.join(path, overrides_basename)
+    if path not in paths:
+      paths.append(path)
+  return paths
+
+
+def _run_captured(target):
+  """Run the operation for one target with stdout and stderr captured."""
+  run_func = _CONTEXT['run_func']
+  exit_code = 0
+  error = None
+  services = None
+  capture = tempfile.TemporaryFile()
+  sys.stdout.flush()
+  sys.stderr.flush()
+  saved_fds = (os.dup(1), os.dup(2))
+  os.dup2(capture.fileno(), 1)
+  os.dup2(capture.fileno(), 2)
+  try:
+    services = run_func(target)
+  except SystemExit, err:
+    exit_code = err.code if isinstance(err.code, int) else 1
+  except Exception, err: # pylint: disable=broad-except
+    exit_code = 1
+    error = '{}: {}'.format(type(err).__name__, err)
+    traceback.print_exc()
+  finally:
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(saved_fds[0], 1)
+    os.dup2(saved_fds[1], 2)
+    os.close(saved_fds[0])
+    os.close(saved_fds[1])
+  capture.seek(0)
+  output = capture.read()
+  capture.close()
+  return InstanceResult(target, exit_code, error, output, services)
+
+
+def run(targets, run_func, processes=None):
+  """Call run_func(target) for every target in a pool of processes.
+
+  Args:
+    targets: Overrides file paths, one per install.
+    run_func: Function taking a target. It may print, call sys.exit() or
+      raise; it may return a list of service status dictionaries.
+    processes: Pool size. Defaults to one per CPU, capped at len(targets).
+
+  Returns:
+    A list of InstanceResult, in the order of targets.
+  """
+  if not targets:
+    return []
+  if processes is None:
+    processes = multiprocessing.cpu_count()
+  processes = max(1, min(processes, len(targets)))
+  _CONTEXT['run_func'] = run_func
+  pool = multiprocessing.Pool(processes)
+  try:
+    results = pool.map(_run_captured, targets, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+    _CONTEXT.clear()
+  return results
+
+
+def format_json(operation, results):
+  """Render results as a JSON document."""
+  return json.dumps({'operation': operation,
+                     'instances': [result._asdict() for result in results]},
+                    indent=2, sort_keys=True)
+
+
+def format_table(results):
+  """Render results as console lines."""
+  lines = []
+  for result in results:
+    state = 'ok' if result.exit_code == 0 else 'failed (exit {})'.format(result.exit_code)
+    lines.append('== {} [{}]'.format(result.target, state))
+    if result.services is not None:
+      for service in result.services:
+        lines.append('    ' + ''.join((
+            service['name'].ljust(20),
+            'running={}'.format(service['pid']).ljust(24) if service['pid'] else
+            'stopped'.ljust(24),
+            'enabled'.ljust(10) if service['enabled'] else 'disabled'.ljust(10),
+            ','.join(service['listening']))))
+        if service.get('orphans'):
+          lines.append('    {}orphans={}'.format(
+              ''.ljust(20), ','.join(str(pid) for pid in service['orphans'])))
+    else:
+      lines.extend('    ' + line for line in result.output.rstrip('\n').split('\n') if line)
+    if result.error:
+      lines.append('    error: {}'.format(result.error))
+  return '\n'.join(lines)
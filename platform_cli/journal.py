@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Append-only journal of override changes.
+
+Every change to the overrides file is recorded as one JSON line in
+'<config>.journal' with its time, user, key, and old and new values (None
+when the key was absent or is deleted). Callers hold the overrides file's
+lock while appending, so an append is a single small write. Once the journal
+grows past MAX_BYTES it is compacted in place to its newest entries, which
+keeps it bounded on hosts with years of changes.
+"""
+
+import collections
+import getpass
+import json
+import os
+import time
+
+MAX_BYTES = 1024 * 1024
+
+# pylint: disable=invalid-name
+JournalEntry = collections.namedtuple('JournalEntry', ['timestamp', 'user', 'key', 'old', 'new'])
+
+
+class Error(Exception):
+  """Base exception class for this module."""
+
+
+def journal_path(config_path):
+  """Return the path of the journal for an overrides file."""
+  return '{}.journal'.format(config_path)
+
+
+def current_user():
+  """Return the name of the user making a change, looking through sudo."""
+  return os.environ.get('SUDO_USER') or getpass.getuser()
+
+
+def new_entry(key, old, new):
+  """Return a JournalEntry for a change made now by the current user."""
+  return JournalEntry(time.time(), current_user(), key, old, new)
+
+
+def append(path, entry, max_bytes=MAX_BYTES):
+  """Append an entry, compacting the journal if it grew past max_bytes."""
+  try:
+    with open(path, 'a') as journal_file:
+      journal_file.write(json.dumps(entry._asdict()) + '\n')
+      size = journal_file.tell()
+  except IOError, err:
+    raise Error('Cannot append to journal at {}:\n{}'.format(path, err))
+  if size > max_bytes:
+    compact(path, max_bytes // 2)
+
+
+def read(path):
+  """Return all entries, oldest first. Unreadable lines are skipped."""
+  entries = []
+  try:
+    with open(path, 'r') as journal_file:
+      lines = journal_file.readlines()
+  except IOError:
+    return entries
+  for line in lines:
+    try:
+      entries.append(JournalEntry(**json.loads(line)))
+    except (TypeError, ValueError):
+      continue
+  return entries
+
+
+def compact(path, keep_bytes):
+  """Rewrite the journal keeping only its newest entries that fit in keep_bytes."""
+  try:
+    with open(path, 'r') as journal_file:
+      lines = journal_file.readlines()
+  except IOError, err:
+    raise Error('Cannot read journal at {}:\n{}'.format(path, err))
+  kept = []
+  size = 0
+  for line in reversed(lines):
+    size += len(line)
+    if size > keep_bytes:
+      break
+    kept.append(line)
+  temp_path = '{}.temp'.format(path)
+  try:
+    with open(temp_path, 'w') as temp_file:
+      temp_file.writelines(reversed(kept))
+    os.rename(temp_path, path)
+  except (IOError, OSError), err:
+    raise Error('Cannot compact journal at {}:\n{}'.format(path, err))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Index of variable names for membership, suggestions and search.
+
+Names are kept sorted, so prefix completion is a binary search, and every
+trigram of every name points at the positions of the names that contain it.
+Positions are packed into strings of machine integers so the index pickles
+and loads quickly. Suggestions and fuzzy searches only score the names that
+share trigrams with the query instead of the whole catalog.
+"""
+
+import array
+import bisect
+import difflib
+
+# Names sharing the most trigrams with a mistyped key that are compared in full.
+SUGGESTION_CANDIDATES = 50
+
+
+def _trigrams(text, padded=True):
+  """Return the set of trigrams in text, padded with spaces at both ends."""
+  if padded:
+    text = ' {} '.format(text)
+  return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class KeyIndex(object):
+  """Sorted names plus a trigram index over them."""
+
+  def __init__(self, names):
+    self.names = tuple(sorted(set(names)))
+    postings = {}
+    for position, name in enumerate(self.names):
+      for gram in _trigrams(name):
+        postings.setdefault(gram, []).append(position)
+    self.postings = dict((gram, array.array('I', positions).tostring())
+                         for gram, positions in postings.iteritems())
+    self._name_set = None
+
+  def __getstate__(self):
+    return {'names': self.names, 'postings': self.postings}
+
+  def __setstate__(self, state):
+    self.names = state['names']
+    self.postings = state['postings']
+    self._name_set = None
+
+  def __len__(self):
+    return len(self.names)
+
+  def __contains__(self, name):
+    if self._name_set is None:
+      self._name_set = frozenset(self.names)
+    return name in self._name_set
+
+  def _shared_counts(self, grams):
+    """Map name position to the number of grams it shares with the query."""
+    counts = {}
+    for gram in grams:
+      for position in array.array('I', self.postings.get(gram, '')):
+        counts[position] = counts.get(position, 0) + 1
+    return counts
+
+  def suggest(self, key, n=3, cutoff=0.6):
+    """Return close matches for key, like difflib.get_close_matches."""
+    if len(key) < 3:
+      return difflib.get_close_matches(key, self.names, n, cutoff)
+    counts = self._shared_counts(_trigrams(key))
+    candidates = sorted(counts, key=lambda position: -counts[position])
+    return difflib.get_close_matches(
+        key, [self.names[position] for position in candidates[:SUGGESTION_CANDIDATES]], n, cutoff)
+
+  def search(self, pattern, threshold=0.5):
+    """Return names fuzzily matching pattern, best match first.
+
+    A name matches if it contains pattern or at least threshold of the
+    pattern's trigrams.
+    """
+    if len(pattern) < 3:
+      return sorted((name for name in self.names if pattern in name), key=len)
+    grams = _trigrams(pattern, padded=False)
+    scored = []
+    for position, count in self._shared_counts(grams).iteritems():
+      name = self.names[position]
+      score = 1.0 if pattern in name else float(count) / len(grams)
+      if score >= threshold:
+        scored.append((-score, len(name), name))
+    return [name for _, _, name in sorted(scored)]
+
+  def complete(self, prefix):
+    """Return the names starting with prefix."""
+    start = bisect.bisect_left(self.names, prefix)
+    end = start
+    while end < len(self.names) and self.names[end].startswith(prefix):
+      end += 1
+    return list(self.names[start:end])
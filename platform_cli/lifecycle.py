@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Structured results and errors of service lifecycle operations.
+
+ServiceProfile.start(), stop() and capture_snapshot() never print to the
+console or exit. They return these results and raise these errors, and they
+report progress only through an optional callback that takes a string. Code
+that embeds platform_cli can therefore manage many services, or several
+installs, from one process. For example, it can pass ServiceProfile methods
+to scheduler.run() with a parallelism above 1. The CLI is a thin wrapper that
+prints the progress and the results.
+"""
+
+import collections
+import errno
+import os
+import signal
+import subprocess
+import tempfile
+import time
+import psutil
+from . import proctable, spawn
+
+# pylint: disable=invalid-name
+StartResult = collections.namedtuple('StartResult', ['name', 'pid', 'already_running', 'seconds'])
+StopResult = collections.namedtuple('StopResult', ['name', 'pid', 'stopped_by', 'seconds'])
+SnapResult = collections.namedtuple('SnapResult', ['name', 'pid', 'exit_code', 'output'])
+
+
+class Error(Exception):
+  """Base exception class for this module."""
+
+
+class LifecycleError(Error):
+  """A lifecycle operation on a service failed."""
+
+  def __init__(self, name, message, pid=None, log_path=None):
+    super(LifecycleError, self).__init__(message)
+    self.name = name
+    self.pid = pid
+    self.log_path = log_path
+
+
+class StartError(LifecycleError):
+  """The service process was not running after start."""
+
+
+class StopError(LifecycleError):
+  """The service process was still running after every stop method."""
+
+
+def wait_for_exit(proc, timeout, tick=None):
+  """Wait up to timeout seconds for proc to exit. Return True if it did.
+
+  Returns as soon as the process exits rather than polling on a fixed
+  schedule. tick, if given, is called after each full second of waiting.
+  """
+  deadline = time.time() + timeout
+  while True:
+    remaining = deadline - time.time()
+    if remaining <= 0:
+      return not proc.is_running()
+    try:
+      proc.wait(min(1, remaining))
+      return True
+    except psutil.TimeoutExpired:
+      if tick is not None and remaining >= 1:
+        tick()
+    except psutil.NoSuchProcess:
+      return True
+
+
+def wait_for_group_exit(pgid, timeout, tick=None):
+  """Wait up to timeout seconds for every member of process group pgid to exit.
+
+  Return True if they all did. Zombies count as exited. The wait blocks on one
+  live member at a time and rescans the group as members exit, so it returns
+  as soon as the last one is gone. tick, if given, is called after each full
+  second of waiting.
+  """
+  deadline = time.time() + timeout
+  last_tick = time.time()
+  while True:
+    pids = proctable.group_pids(pgid)
+    if not pids:
+      return True
+    remaining = deadline - time.time()
+    if remaining <= 0:
+      return False
+    try:
+      psutil.Process(pids[0]).wait(min(1, remaining))
+    except (psutil.TimeoutExpired, psutil.NoSuchProcess):
+      pass
+    if tick is not None and time.time() - last_tick >= 1:
+      last_tick = time.time()
+      tick()
+
+
+def signal_group(pgid, signum):
+  """Send signum to process group pgid, ignoring a group that is already gone.
+
+  Raises:
+    OSError: The group could not be signalled, e.g. with EPERM.
+  """
+  try:
+    os.killpg(pgid, signum)
+  except OSError, err:
+    if err.errno != errno.ESRCH:
+      raise
+
+
+def run_captured(cmd, env=None, timeout=None):
+  """Run a shell command in its own process group and capture its output.
+
+  If the command runs longer than timeout seconds, the whole process group
+  is killed, so children such as a hung jstack go with it.
+
+  Returns:
+    A tuple of the exit code, or None if the command timed out, and the
+    combined stdout and stderr.
+  """
+  with tempfile.TemporaryFile() as capture:
+    proc = spawn.popen(cmd, env=env, shell=True, stdout=capture, stderr=subprocess.STDOUT,
+                       preexec_fn=os.setsid)
+    try:
+      exit_code = proc.wait(timeout)
+    except psutil.TimeoutExpired:
+      try:
+        os.killpg(proc.pid, signal.SIGKILL)
+      except OSError:
+        pass
+      proc.wait()
+      exit_code = None
+    capture.seek(0)
+    return exit_code, capture.read()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Buffered, rotating writer for a service's stdout file.
+
+Services that opt in have their stdout and stderr piped into a small writer
+process running this module. A reader thread drains the pipe into a bounded
+queue and the main thread writes batches to the stdout file, rotating it by
+size or age and optionally gzipping rotated segments in the background. When
+the file system falls behind, the queue fills and the reader stops draining
+the pipe, which blocks the service's writes; those stalls are counted and
+reported in the log.
+
+The CLI adds its own lifecycle lines to the same file with append(). Those
+are written under an flock() that the writer also takes to rotate, so they
+always land in the live file, and the writer measures the file rather than
+counting only its own bytes, so they count toward the size limit. Output of
+stop and graceful commands is appended to the file directly; it counts
+toward the limit too, but may end up in a segment rotated while the command
+runs.
+
+The writer only depends on the standard library so it can be started with
+"python -m platform_cli.logwriter" independently of the CLI.
+"""
+
+import argparse
+import collections
+import fcntl
+import glob
+import gzip
+import os
+import Queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+READ_CHUNK_BYTES = 64 * 1024
+QUEUE_CHUNKS = 256
+FLUSH_SECONDS = 1.0
+BUFFER_BYTES = 256 * 1024
+
+_writers = []
+
+# pylint: disable=invalid-name
+WriterStats = collections.namedtuple(
+    'WriterStats', ['bytes_written', 'rotations', 'stalls', 'stall_seconds', 'peak_queue'])
+
+
+class Error(Exception):
+  """Base exception class for this module."""
+
+
+class RotatingWriter(object):
+  """Append to a file, rotating it by size or age."""
+
+  def __init__(self, path, max_bytes=0, max_seconds=0, backups=5, compress=False):
+    """Initialize the RotatingWriter.
+
+    Args:
+      path: The live file that is appended to.
+      max_bytes: Rotate once the live file reaches this size. 0 disables.
+      max_seconds: Rotate once the live file is this old. 0 disables.
+      backups: Number of rotated segments to keep.
+      compress: Gzip rotated segments.
+    """
+    self.path = path
+    self.max_bytes = max_bytes
+    self.max_seconds = max_seconds
+    self.backups = backups
+    self.compress = compress
+    self.rotations = 0
+    self.bytes_written = 0
+    self.file_obj = None
+    self.file_size = 0
+    self.opened_at = None
+    self.compressors = []
+    self._open()
+
+  def _open(self):
+    """Open the live file for appending."""
+    try:
+      self.file_obj = open(self.path, 'ab')
+    except IOError, err:
+      raise Error('Cannot open log file {}:\n{}'.format(self.path, err))
+    self.file_size = os.fstat(self.file_obj.fileno()).st_size
+    self.opened_at = time.time()
+
+  def _should_rotate(self):
+    """Return True if the live file has reached its size or age limit."""
+    # The CLI appends to the file too, so measure it instead of trusting our count.
+    self.file_obj.flush()
+    self.file_size = os.fstat(self.file_obj.fileno()).st_size
+    if self.max_bytes and self.file_size >= self.max_bytes:
+      return True
+    if self.max_seconds and self.file_size and time.time() - self.opened_at >= self.max_seconds:
+      return True
+    return False
+
+  def _segment_path(self):
+    """Return an unused path for the segment being rotated out."""
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    candidate = '{}.{}'.format(self.path, stamp)
+    suffix = 1
+    while os.path.exists(candidate) or os.path.exists(candidate + '.gz'):
+      candidate = '{}.{}-{}'.format(self.path, stamp, suffix)
+      suffix += 1
+    return candidate
+
+  def _prune(self):
+    """Delete the oldest rotated segments beyond the backup count."""
+    segments = sorted(glob.glob('{}.[0-9]*'.format(self.path)), key=os.path.getmtime)
+    for segment in segments[:max(0, len(segments) - self.backups)]:
+      try:
+        os.remove(segment)
+      except OSError:
+        pass
+
+  def rotate(self, summary=None):
+    """Close the live file, move it aside and start a new one."""
+    if summary:
+      self.file_obj.write(summary)
+    self.file_obj.flush()
+    # Held until close(), so append() never writes to the file once it is renamed.
+    fcntl.flock(self.file_obj.fileno(), fcntl.LOCK_EX)
+    segment = self._segment_path()
+    try:
+      os.rename(self.path, segment)
+    except OSError, err:
+      self.file_obj.close()
+      self._open()
+      self.file_obj.write('[{}] logwriter cannot rotate to {}: {}\n'.format(
+                          time.strftime('%Y-%m-%d %H:%M:%S'), segment, err))
+      return
+    self.file_obj.close()
+    self.rotations += 1
+    self._open()
+    if self.compress:
+      compressor = threading.Thread(target=_gzip_segment, args=(segment, self._prune))
+      compressor.daemon = True
+      compressor.start()
+      self.compressors.append(compressor)
+      self.compressors = [thread for thread in self.compressors if thread.is_alive()]
+    else:
+      self._prune()
+
+  def maybe_rotate(self, summary_func=None):
+    """Rotate if the live file is full, ending it with summary_func()."""
+    if self._should_rotate():
+      self.rotate(summary_func() if summary_func else None)
+
+  def write(self, data, summary_func=None):
+    """Write a batch of data, rotating first if the live file is full.
+
+    Batches are never split, so a segment may exceed max_bytes by up to one
+    batch.
+    """
+    self.maybe_rotate(summary_func)
+    self.file_obj.write(data)
+    self.file_size += len(data)
+    self.bytes_written += len(data)
+
+  def flush(self):
+    """Flush buffered data to the live file."""
+    self.file_obj.flush()
+
+  def close(self):
+    """Close the live file and wait for pending compression."""
+    self.file_obj.close()
+    for thread in self.compressors:
+      thread.join()
+
+
+def append(path, text):
+  """Append text to a stdout file that a writer may be rotating, in one write."""
+  while True:
+    with open(path, 'a') as log_file:
+      fcntl.flock(log_file.fileno(), fcntl.LOCK_EX)
+      opened = os.fstat(log_file.fileno())
+      try:
+        current = os.stat(path)
+      except OSError:
+        continue
+      if (opened.st_dev, opened.st_ino) != (current.st_dev, current.st_ino):
+        # Rotated while we waited for the lock; append to the new live file.
+        continue
+      log_file.write(text)
+      log_file.flush()
+      return
+
+
+def _gzip_segment(segment, on_done):
+  """Compress a rotated segment and remove the uncompressed copy."""
+  try:
+    with open(segment, 'rb') as source:
+      with gzip.open(segment + '.gz', 'wb') as target:
+        shutil.copyfileobj(source, target, READ_CHUNK_BYTES)
+    os.remove(segment)
+  except (IOError, OSError):
+    pass
+  on_done()
+
+
+class Pump(object):
+  """Move data from a pipe into a RotatingWriter with backpressure accounting."""
+
+  def __init__(self, source_fd, writer):
+    """Initialize the Pump."""
+    self.source_fd = source_fd
+    self.writer = writer
+    self.chunks = Queue.Queue(maxsize=QUEUE_CHUNKS)
+    self.stalls = 0
+    self.stall_seconds = 0.0
+    self.peak_queue = 0
+
+  def _read(self):
+    """Drain the pipe into the queue until EOF."""
+    while True:
+      try:
+        chunk = os.read(self.source_fd, READ_CHUNK_BYTES)
+      except OSError:
+        chunk = ''
+      try:
+        self.chunks.put_nowait(chunk)
+      except Queue.Full:
+        stalled_at = time.time()
+        self.chunks.put(chunk)
+        self.stalls += 1
+        self.stall_seconds += time.time() - stalled_at
+      self.peak_queue = max(self.peak_queue, self.chunks.qsize())
+      if not chunk:
+        return
+
+  def stats(self):
+    """Return a WriterStats snapshot."""
+    return WriterStats(self.writer.bytes_written, self.writer.rotations,
+                       self.stalls, self.stall_seconds, self.peak_queue)
+
+  def summary(self):
+    """Format the current stats as a log line."""
+    stats = self.stats()
+    return ('[{}] logwriter wrote {} bytes, {} rotations, producer stalled {} times '
+            'for {:.2f}s, peak queue {}/{} chunks\n').format(
+                time.strftime('%Y-%m-%d %H:%M:%S'), stats.bytes_written, stats.rotations,
+                stats.stalls, stats.stall_seconds, stats.peak_queue, QUEUE_CHUNKS)
+
+  def run(self):
+    """Copy until EOF, writing in batches of up to BUFFER_BYTES."""
+    reader = threading.Thread(target=self._read)
+    reader.daemon = True
+    reader.start()
+    eof = False
+    while not eof:
+      batch = []
+      batch_bytes = 0
+      try:
+        chunk = self.chunks.get(timeout=FLUSH_SECONDS)
+      except Queue.Empty:
+        # Age-based rotation must not wait for the next write from a quiet service.
+        self.writer.maybe_rotate(self.summary)
+        self.writer.flush()
+        continue
+      while True:
+        if not chunk:
+          eof = True
+          break
+        batch.append(chunk)
+        batch_bytes += len(chunk)
+        if batch_bytes >= BUFFER_BYTES:
+          break
+        try:
+          chunk = self.chunks.get_nowait()
+        except Queue.Empty:
+          break
+      if batch:
+        self.writer.write(''.join(batch), self.summary)
+      self.writer.flush()
+    self.writer.maybe_rotate(self.summary)
+    self.writer.write(self.summary())
+    self.writer.close()
+
+
+def reap():
+  """Collect writer processes started by spawn() that have exited. Return the number left."""
+  _writers[:] = [proc for proc in _writers if proc.poll() is None]
+  return len(_writers)
+
+
+def spawn(path, max_bytes=0, max_seconds=0, backups=5, compress=False):
+  """Start a writer process for path. Return it; its stdin is the pipe to write to.
+
+  The writer exits once every copy of the pipe is closed. Long-running
+  callers should call reap() now and then so exited writers do not linger as
+  zombies.
+  """
+  # Imported here so the writer process itself needs only the standard library.
+  from . import spawn as spawner
+  args = [sys.executable, '-m', 'platform_cli.logwriter', path,
+          '--max-bytes', str(max_bytes),
+          '--max-seconds', str(max_seconds),
+          '--backups', str(backups)]
+  if compress:
+    args.append('--compress')
+  env = os.environ.copy()
+  package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  if env.get('PYTHONPATH'):
+    env['PYTHONPATH'] = os.pathsep.join((package_root, env['PYTHONPATH']))
+  else:
+    env['PYTHONPATH'] = package_root
+  reap()
+  with open(os.devnull, 'w') as devnull:
+    proc = spawner.popen(args, stdin=subprocess.PIPE, stdout=devnull, stderr=devnull,
+                         env=env, cwd='/')
+  _writers.append(proc)
+  return proc
+
+
+def main(argv=None):
+  """Run the writer on stdin."""
+  parser = argparse.ArgumentParser(description='Rotating writer for service stdout.')
+  parser.add_argument('path')
+  parser.add_argument('--max-bytes', type=int, default=0)
+  parser.add_argument('--max-seconds', type=float, default=0)
+  parser.add_argument('--backups', type=int, default=5)
+  parser.add_argument('--compress', action='store_true')
+  args = parser.parse_args(argv)
+  writer = RotatingWriter(args.path, args.max_bytes, args.max_seconds, args.backups,
+                          args.compress)
+  Pump(sys.stdin.fileno(), writer).run()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Export service metrics in the Prometheus text format.
+
+The output is meant for the node exporter's textfile collector, which reads
+every *.prom file in a directory. Files are written to a temporary name and
+renamed into place so the collector never sees a partial file.
+"""
+
+import collections
+import os
+import psutil
+
+# pylint: disable=invalid-name
+MetricFamily = collections.namedtuple('MetricFamily', ['name', 'type', 'help', 'samples'])
+
+
+class Error(Exception):
+  """Base exception class for this module."""
+
+
+def add(families, name, metric_type, help_text, labels, value):
+  """Add one sample to the named family in an OrderedDict of MetricFamily."""
+  if name not in families:
+    families[name] = MetricFamily(name, metric_type, help_text, [])
+  families[name].samples.append((labels, value))
+
+
+def service_families(services, listening_by_pid, now):
+  """Collect per-service metrics with one inspection of each process tree.
+
+  Args:
+    services: ServiceProfiles to report on.
+    listening_by_pid: Result of proctable.listening_addresses_by_pid().
+    now: Collection timestamp, used for process age.
+
+  Returns:
+    An OrderedDict mapping metric name to MetricFamily.
+  """
+  families = collections.OrderedDict()
+  for service in services:
+    labels = {'service': service.name}
+    proc = service.get_process()
+    up = proc is not None and proc.status != psutil.STATUS_ZOMBIE
+    add(families, 'platform_service_up', 'gauge',
+        'Whether the service process is running.', labels, int(up))
+    add(families, 'platform_service_enabled', 'gauge',
+        'Whether the service is enabled.', labels, int(service.enabled))
+    if up:
+      sample = service.sample_process(proc, now)
+      ports = set(port for pid in service.get_pids(proc)
+                  for _, port in listening_by_pid.get(pid, []))
+      add(families, 'platform_service_process_age_seconds', 'gauge',
+          'Seconds since the service process started.', labels, now - proc.create_time)
+      add(families, 'platform_service_cpu_seconds_total', 'counter',
+          'User and system CPU seconds used by the service process tree.', labels,
+          sample.cpu_seconds)
+      add(families, 'platform_service_resident_memory_bytes', 'gauge',
+          'Resident memory of the service process tree.', labels, sample.rss)
+      add(families, 'platform_service_open_fds', 'gauge',
+          'Open file descriptors of the service process tree.', labels, sample.fds)
+      add(families, 'platform_service_threads', 'gauge',
+          'Threads in the service process tree.', labels, sample.threads)
+      add(families, 'platform_service_listening_ports', 'gauge',
+          'TCP ports the service process tree listens on.', labels, len(ports))
+    timings = service.get_timings()
+    for operation in ('start', 'stop'):
+      if operation in timings:
+        add(families, 'platform_service_last_{}_duration_seconds'.format(operation), 'gauge',
+            'Duration of the last successful {} of the service.'.format(operation), labels,
+            timings[operation])
+  return families
+
+
+def _escape(value):
+  """Escape a label value."""
+  return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render(families, common_labels=None):
+  """Render an OrderedDict of MetricFamily as Prometheus text."""
+  common_labels = common_labels if common_labels is not None else {}
+  lines = []
+  for family in families.values():
+    lines.append('# HELP {} {}'.format(family.name, family.help))
+    lines.append('# TYPE {} {}'.format(family.name, family.type))
+    for labels, value in family.samples:
+      merged = dict(common_labels)
+      merged.update(labels)
+      label_str = ','.join('{}="{}"'.format(key, _escape(merged[key])) for key in sorted(merged))
+      lines.append('{}{} {}'.format(family.name, '{' + label_str + '}' if label_str else '',
+                                    repr(float(value))))
+  return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path, text):
+  """Atomically replace the file at path with text."""
+  temp_path = '{}.{}.temp'.format(path, os.getpid())
+  try:
+    with open(temp_path, 'w') as temp_file:
+      temp_file.write(text)
+    os.rename(temp_path, path)
+  except (IOError, OSError), err:
+    raise Error('Cannot write metrics to {}:\n{}'.format(path, err))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Read and write pid files, and check liveness without a full process scan.
+
+A pid file written by the CLI holds the pid on its first line, followed by
+key=value lines recording the process start time (in clock ticks since boot,
+as found in /proc/<pid>/stat), a hash of the command line the process was
+started with and the process group the service runs in. Pid files managed by
+services themselves hold only the pid, and are read the same way.
+
+With a recorded start time, liveness is a stat of /proc/<pid> and a read of
+/proc/<pid>/stat: a different start time means the pid has been reused. When
+that cannot decide, callers fall back to inspecting the process with psutil.
+"""
+
+import collections
+import errno
+import hashlib
+import os
+
+# pylint: disable=invalid-name
+PidfileRecord = collections.namedtuple('PidfileRecord',
+                                       ['pid', 'start_time', 'cmdline_hash', 'pgid'])
+PidfileRecord.__new__.__defaults__ = (None,)
+
+
+def read(path):
+  """Read a pid file into a PidfileRecord.
+
+  Raises IOError if the file cannot be read and ValueError if the first line
+  is not a pid.
+  """
+  with open(path, 'r') as pid_file:
+    lines = pid_file.read().strip().splitlines()
+  if not lines:
+    raise ValueError('Empty pid file {}.'.format(path))
+  pid = int(lines[0].strip())
+  fields = {}
+  for line in lines[1:]:
+    key, _, value = line.partition('=')
+    fields[key.strip()] = value.strip()
+  start_time = fields.get('start_time')
+  pgid = fields.get('pgid')
+  return PidfileRecord(pid=pid,
+                       start_time=int(start_time) if start_time else None,
+                       cmdline_hash=fields.get('cmdline_hash') or None,
+                       pgid=int(pgid) if pgid else None)
+
+
+def write(path, pid, start_time=None, cmdline_hash=None, pgid=None):
+  """Write a pid file, with liveness and process group metadata when available."""
+  lines = [str(pid)]
+  if start_time is not None:
+    lines.append('start_time={}'.format(start_time))
+  if cmdline_hash is not None:
+    lines.append('cmdline_hash={}'.format(cmdline_hash))
+  if pgid is not None:
+    lines.append('pgid={}'.format(pgid))
+  with open(path, 'w') as pid_file:
+    pid_file.write('\n'.join(lines) + '\n')
+
+
+def cmdline_hash(args):
+  """Hash a command line given as a list of arguments."""
+  return hashlib.sha1('\0'.join(args)).hexdigest()[:16]
+
+
+def _read_stat_fields(pid):
+  """Return the fields of /proc/<pid>/stat after the command name, or None."""
+  try:
+    with open('/proc/{}/stat'.format(pid), 'r') as stat_file:
+      stat = stat_file.read()
+  except IOError:
+    return None
+  return stat[stat.rfind(')') + 2:].split()
+
+
+def proc_start_time(pid):
+  """Return the start time of pid in clock ticks since boot, or None."""
+  fields = _read_stat_fields(pid)
+  if fields is None or len(fields) < 20:
+    return None
+  return int(fields[19])
+
+
+def check_alive(record):
+  """Decide cheaply whether a pid file's process is still ours.
+
+  Returns:
+    True if the process is running with our effective uid and the recorded
+    start time, False if it is gone or the pid has been reused, and None if the
+    fast check is inconclusive, e.g. the record has no start time, the
+    process is a zombie or /proc is unavailable.
+  """
+  if record.start_time is None:
+    return None
+  try:
+    proc_stat = os.stat('/proc/{}'.format(record.pid))
+  except OSError, err:
+    if err.errno == errno.ENOENT and os.path.isdir('/proc/self'):
+      return False
+    return None
+  if proc_stat.st_uid != os.geteuid():
+    return False
+  fields = _read_stat_fields(record.pid)
+  if fields is None:
+    return False
+  if len(fields) < 20 or fields[0] == 'Z':
+    return None
+  return int(fields[19]) == record.start_time
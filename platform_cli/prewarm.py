@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Pull the files a service reads at startup into the OS page cache.
+
+Paths are given as globs; directories are walked recursively. Each file is
+handed to the kernel with posix_fadvise(POSIX_FADV_WILLNEED), which schedules
+asynchronous readahead, and its current page cache residency is measured with
+mincore() so we can report how much of the work was already done. Where libc
+cannot be loaded through ctypes we fall back to reading the files.
+"""
+
+import collections
+import ctypes
+import ctypes.util
+import glob
+import mmap
+import os
+import time
+from multiprocessing.pool import ThreadPool
+
+POSIX_FADV_WILLNEED = 3
+READ_CHUNK_BYTES = 1024 * 1024
+PAGE_SIZE = mmap.PAGESIZE
+
+# pylint: disable=invalid-name
+PrewarmReport = collections.namedtuple(
+    'PrewarmReport', ['files', 'bytes', 'resident_bytes', 'skipped_bytes', 'seconds'])
+
+
+def _load_libc():
+  """Return libc with posix_fadvise and mincore prototypes, or None."""
+  libc_name = ctypes.util.find_library('c')
+  if libc_name is None:
+    return None
+  try:
+    libc = ctypes.CDLL(libc_name, use_errno=True)
+  except OSError:
+    return None
+  fadvise = getattr(libc, 'posix_fadvise64', None) or getattr(libc, 'posix_fadvise', None)
+  if fadvise is None or not hasattr(libc, 'mincore'):
+    return None
+  fadvise.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int]
+  fadvise.restype = ctypes.c_int
+  libc.fadvise = fadvise
+  libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_ubyte)]
+  libc.mincore.restype = ctypes.c_int
+  return libc
+
+
+_LIBC = _load_libc()
+
+
+def expand_paths(patterns):
+  """Expand globs into an ordered, de-duplicated list of (path, size) tuples."""
+  seen = set()
+  files = []
+
+  def add(path):
+    """Record a regular file once."""
+    real = os.path.realpath(path)
+    if real in seen:
+      return
+    try:
+      size = os.path.getsize(real)
+    except OSError:
+      return
+    seen.add(real)
+    files.append((real, size))
+
+  for pattern in patterns:
+    for match in sorted(glob.glob(os.path.expanduser(pattern))):
+      if os.path.isdir(match):
+        for dirpath, dirnames, filenames in os.walk(match):
+          dirnames.sort()
+          for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            if os.path.isfile(path):
+              add(path)
+      elif os.path.isfile(match):
+        add(match)
+  return files
+
+
+def _resident_bytes(fileno, length):
+  """Return how many bytes of the first length bytes are in page cache."""
+  if _LIBC is None:
+    return None
+  if length <= 0:
+    return 0
+  try:
+    mapped = mmap.mmap(fileno, length, access=mmap.ACCESS_COPY)
+  except (mmap.error, ValueError, OverflowError):
+    return None
+  try:
+    pages = (length + PAGE_SIZE - 1) // PAGE_SIZE
+    vec = (ctypes.c_ubyte * pages)()
+    anchor = ctypes.c_char.from_buffer(mapped)
+    try:
+      result = _LIBC.mincore(ctypes.addressof(anchor), length, vec)
+    finally:
+      del anchor
+    if result != 0:
+      return None
+    resident_pages = sum(1 for page in vec if page & 1)
+    return min(resident_pages * PAGE_SIZE, length)
+  finally:
+    mapped.close()
+
+
+def _warm_file(job):
+  """Advise the kernel to read a file prefix. Return bytes already resident."""
+  path, length = job
+  try:
+    fileno = os.open(path, os.O_RDONLY)
+  except OSError:
+    return 0
+  try:
+    resident = _resident_bytes(fileno, length)
+    if _LIBC is not None and _LIBC.fadvise(fileno, 0, length, POSIX_FADV_WILLNEED) == 0:
+      return resident
+    remaining = length
+    while remaining > 0:
+      chunk = os.read(fileno, min(READ_CHUNK_BYTES, remaining))
+      if not chunk:
+        break
+      remaining -= len(chunk)
+    return resident
+  finally:
+    os.close(fileno)
+
+
+def _plan(files, max_bytes):
+  """Trim a file list to a byte budget. Return (jobs, skipped_bytes)."""
+  jobs = []
+  budget = max_bytes if max_bytes > 0 else None
+  skipped = 0
+  for path, size in files:
+    if budget is None:
+      jobs.append((path, size))
+    elif budget > 0:
+      length = min(size, budget)
+      jobs.append((path, length))
+      budget -= length
+      skipped += size - length
+    else:
+      skipped += size
+  return jobs, skipped
+
+
+def prewarm_many(plans, threads=4):
+  """Prewarm several path sets concurrently on one thread pool.
+
+  Args:
+    plans: List of (name, patterns, max_bytes) tuples. A max_bytes of 0 means
+      no byte budget.
+    threads: Number of worker threads shared by all plans.
+
+  Returns:
+    A dictionary mapping each name to a PrewarmReport. resident_bytes is None
+    when residency could not be measured.
+  """
+  started = time.time()
+  jobs_by_name = collections.OrderedDict()
+  skipped_by_name = {}
+  for name, patterns, max_bytes in plans:
+    jobs_by_name[name], skipped_by_name[name] = _plan(expand_paths(patterns), max_bytes)
+  all_jobs = [job for jobs in jobs_by_name.values() for job in jobs]
+  pool = ThreadPool(max(1, min(threads, len(all_jobs) or 1)))
+  try:
+    residency = pool.map(_warm_file, all_jobs)
+  finally:
+    pool.close()
+    pool.join()
+  elapsed = time.time() - started
+
+  reports = {}
+  offset = 0
+  for name, jobs in jobs_by_name.iteritems():
+    job_residency = residency[offset:offset + len(jobs)]
+    offset += len(jobs)
+    if any(resident is None for resident in job_residency):
+      resident_bytes = None
+    else:
+      resident_bytes = sum(job_residency)
+    reports[name] = PrewarmReport(files=len(jobs),
+                                  bytes=sum(length for _, length in jobs),
+                                  resident_bytes=resident_bytes,
+                                  skipped_bytes=skipped_by_name[name],
+                                  seconds=elapsed)
+  return reports
+
+
+def prewarm(patterns, max_bytes=0, threads=4):
+  """Prewarm a single path set. Return a PrewarmReport."""
+  return prewarm_many([(None, patterns, max_bytes)], threads)[None]
+
+
+def format_bytes(num_bytes):
+  """Format a byte count for console output."""
+  value = float(num_bytes)
+  for unit in ('B', 'KB', 'MB'):
+    if value < 1024:
+      return '{:.1f} {}'.format(value, unit)
+    value /= 1024
+  return '{:.1f} GB'.format(value)
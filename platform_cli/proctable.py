@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Single-pass views of the host's socket and process tables.
+
+On Linux the listening sockets are read straight from /proc/net/tcp and
+/proc/net/tcp6, and socket inodes are mapped back to their owning processes
+with one walk of /proc/<pid>/fd. Parents, process groups and sessions come
+from one read of /proc/<pid>/stat per process. Elsewhere we fall back to
+psutil and os.getpgid()/os.getsid().
+"""
+
+import collections
+import os
+import socket
+import struct
+import psutil
+
+PROC_NET_FILES = ('/proc/net/tcp', '/proc/net/tcp6')
+TCP_LISTEN_STATE = '0A'
+
+# pylint: disable=invalid-name
+PortOwner = collections.namedtuple('PortOwner', ['port', 'pid', 'name'])
+ProcEntry = collections.namedtuple('ProcEntry', ['pid', 'ppid', 'pgid', 'sid', 'zombie'])
+
+
+def _decode_address(hex_address):
+  """Decode an address from /proc/net/tcp{,6} into an (ip, port) tuple.
+
+  The kernel prints each 32-bit word of the address in network byte order as
+  a host-order integer, so the words are packed back in native byte order.
+  The port is printed as a plain number.
+  """
+  hex_ip, hex_port = hex_address.rsplit(':', 1)
+  if len(hex_ip) == 8:
+    ip = socket.inet_ntoa(struct.pack('=I', int(hex_ip, 16)))
+  else:
+    words = [int(hex_ip[i:i + 8], 16) for i in range(0, 32, 8)]
+    ip = socket.inet_ntop(socket.AF_INET6, struct.pack('=4I', *words))
+  return ip, int(hex_port, 16)
+
+
+def _proc_listening_sockets():
+  """Map socket inode to the (ip, port) it listens on."""
+  addresses_by_inode = {}
+  for path in PROC_NET_FILES:
+    try:
+      with open(path, 'r') as net_file:
+        lines = net_file.readlines()[1:]
+    except IOError:
+      continue
+    for line in lines:
+      fields = line.split()
+      if len(fields) < 10 or fields[3] != TCP_LISTEN_STATE:
+        continue
+      addresses_by_inode[fields[9]] = _decode_address(fields[1])
+  return addresses_by_inode
+
+
+def _proc_inode_owners(inodes, first_only=False):
+  """Map socket inodes to owning pids with one walk of /proc/<pid>/fd.
+
+  With first_only, only the first owner of each inode is found and the walk
+  stops once every inode has one.
+  """
+  wanted = set('socket:[{}]'.format(inode) for inode in inodes)
+  owners = {}
+  for entry in os.listdir('/proc'):
+    if not entry.isdigit():
+      continue
+    fd_dir = '/proc/{}/fd'.format(entry)
+    try:
+      fds = os.listdir(fd_dir)
+    except OSError:
+      continue
+    for fd in fds:
+      try:
+        link = os.readlink(os.path.join(fd_dir, fd))
+      except OSError:
+        continue
+      if link in wanted:
+        owners.setdefault(link[8:-1], set()).add(int(entry))
+    if first_only and len(owners) == len(wanted):
+      break
+  return owners
+
+
+def _process_name(pid):
+  """Return a process name, or None if it cannot be read."""
+  try:
+    return psutil.Process(pid).name
+  except (psutil.NoSuchProcess, psutil.AccessDenied):
+    return None
+
+
+def _psutil_listening_owners():
+  """Map listening port to PortOwner with one pass over all processes."""
+  owners = {}
+  for proc in psutil.process_iter():
+    try:
+      connections = proc.get_connections()
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+      continue
+    for conn in connections:
+      if conn.status == 'LISTEN':
+        port = conn.local_address[1]
+        owners.setdefault(port, PortOwner(port, proc.pid, proc.name))
+  return owners
+
+
+def find_port_owners(ports):
+  """Return a PortOwner for each of the given ports that is already listening.
+
+  The pid and name of an owner are None if the socket belongs to a process we
+  are not allowed to inspect.
+  """
+  ports = set(ports)
+  if not ports:
+    return {}
+  if not os.path.exists(PROC_NET_FILES[0]):
+    return dict((port, owner) for port, owner in _psutil_listening_owners().iteritems()
+                if port in ports)
+  inodes_by_port = {}
+  for inode, (_, port) in _proc_listening_sockets().iteritems():
+    if port in ports:
+      inodes_by_port.setdefault(port, set()).add(inode)
+  if not inodes_by_port:
+    return {}
+  pids_by_inode = _proc_inode_owners(
+      set(inode for inodes in inodes_by_port.values() for inode in inodes), first_only=True)
+  owners = {}
+  for port, inodes in inodes_by_port.iteritems():
+    pids = sorted(pid for inode in inodes for pid in pids_by_inode.get(inode, ()))
+    pid = pids[0] if pids else None
+    owners[port] = PortOwner(port, pid, _process_name(pid) if pid is not None else None)
+  return owners
+
+
+def listening_addresses_by_pid():
+  """Map pid to the (ip, port) tuples it listens on, from one socket table scan."""
+  addresses = {}
+  if not os.path.exists(PROC_NET_FILES[0]):
+    for proc in psutil.process_iter():
+      try:
+        connections = proc.get_connections()
+      except (psutil.NoSuchProcess, psutil.AccessDenied):
+        continue
+      listening = [conn.local_address for conn in connections if conn.status == 'LISTEN']
+      if listening:
+        addresses[proc.pid] = listening
+    return addresses
+  addresses_by_inode = _proc_listening_sockets()
+  for inode, pids in _proc_inode_owners(addresses_by_inode.keys()).iteritems():
+    for pid in pids:
+      addresses.setdefault(pid, []).append(addresses_by_inode[inode])
+  return addresses
+
+
+def _proc_process_table():
+  """Read ProcEntry tuples from /proc/<pid>/stat."""
+  table = {}
+  for entry in os.listdir('/proc'):
+    if not entry.isdigit():
+      continue
+    try:
+      with open('/proc/{}/stat'.format(entry), 'r') as stat_file:
+        stat = stat_file.read()
+    except IOError:
+      continue
+    fields = stat[stat.rfind(')') + 2:].split()
+    pid = int(entry)
+    table[pid] = ProcEntry(pid, int(fields[1]), int(fields[2]), int(fields[3]), fields[0] == 'Z')
+  return table
+
+
+def _psutil_process_table():
+  """Read ProcEntry tuples with psutil, os.getpgid() and os.getsid()."""
+  table = {}
+  for proc in psutil.process_iter():
+    try:
+      table[proc.pid] = ProcEntry(proc.pid, proc.ppid, os.getpgid(proc.pid),
+                                  os.getsid(proc.pid), proc.status == psutil.STATUS_ZOMBIE)
+    except (psutil.NoSuchProcess, psutil.AccessDenied, OSError):
+      continue
+  return table
+
+
+def read_process_table():
+  """Map pid to ProcEntry for every process we can see."""
+  if os.path.isdir('/proc/self'):
+    return _proc_process_table()
+  return _psutil_process_table()
+
+
+def group_pids(pgid, table=None):
+  """Return the sorted pids of live (non-zombie) members of process group pgid."""
+  if table is None:
+    table = read_process_table()
+  return sorted(entry.pid for entry in table.itervalues()
+                if entry.pgid == pgid and not entry.zombie)
+
+
+def escaped_pids(pgid, table=None):
+  """Return the sorted pids of live processes that left process group pgid.
+
+  These are descendants of the group's members, and members of the session
+  it leads, that have moved to another process group. Once a process that
+  left both has been reparented to init it can no longer be traced.
+  """
+  if table is None:
+    table = read_process_table()
+  children = collections.defaultdict(list)
+  for entry in table.itervalues():
+    children[entry.ppid].append(entry)
+  escaped = set(entry.pid for entry in table.itervalues()
+                if entry.sid == pgid and entry.pgid != pgid and not entry.zombie)
+  pending = [entry.pid for entry in table.itervalues() if entry.pgid == pgid]
+  seen = set(pending)
+  while pending:
+    for child in children[pending.pop()]:
+      if child.pid in seen:
+        continue
+      seen.add(child.pid)
+      pending.append(child.pid)
+      if child.pgid != pgid and not child.zombie:
+        escaped.add(child.pid)
+  return sorted(escaped)
@@ -59,9 +59,9 @@ def _open_props(file_path, create_new=False, allow_multiline_values=True):
 
 
 def _edit_props(file_path, mutation_func, create_new=False):
-  """Safe edit to a .properties config file."""
+  """Safe edit to a .properties config file. Return what mutation_func returns."""
   conf = _open_props(file_path, create_new)
-  mutation_func(conf)
+  result = mutation_func(conf)
   memoryfile = StringIO.StringIO()
   conf.write(memoryfile)
   temp_path = file_path + '.temp'
@@ -77,6 +77,14 @@ def _edit_props(file_path, mutation_func, create_new=False):
   except OSError, err:
     raise Error('Cannot rename file {} to {}:\n{}'.format(
                 temp_path, file_path, err))
+  return result
+
+
+def _get_raw(conf, key):
+  """Return the uninterpolated value of key in a parsed .properties file, or None."""
+  if not conf.has_option(FAKE_SECTION_NAME, key):
+    return None
+  return conf.get(FAKE_SECTION_NAME, key, raw=True)
 
 
 def get_items(file_path, create_new=False, allow_multiline_values=True):
@@ -85,14 +93,31 @@ def get_items(file_path, create_new=False, allow_multiline_values=True):
   return conf.items(FAKE_SECTION_NAME)
 
 
-def set_key(file_path, key, value, create_new=False):
-  """Set key to value in a .properties file."""
-  _edit_props(file_path,
-              lambda x: x.set(FAKE_SECTION_NAME, key, value),
-              create_new)
+def set_key(file_path, key, value, create_new=False, before_write=None):
+  """Set key to value in a .properties file. Return the previous value, or None.
 
-def delete_key(file_path, key, create_new=False):
-  """Delete a key from a .properties file."""
-  _edit_props(file_path,
-              lambda x: x.remove_option(FAKE_SECTION_NAME, key),
-              create_new)
+  before_write, if given, is called with the previous value before the file
+  is rewritten. If it raises, the file is left unchanged.
+  """
+  def mutate(conf):
+    """Set the key and keep its old value."""
+    old_value = _get_raw(conf, key)
+    if before_write is not None:
+      before_write(old_value)
+    conf.set(FAKE_SECTION_NAME, key, value)
+    return old_value
+  return _edit_props(file_path, mutate, create_new)
+
+def delete_key(file_path, key, create_new=False, before_write=None):
+  """Delete a key from a .properties file. Return the deleted value, or None.
+
+  before_write is called as for set_key().
+  """
+  def mutate(conf):
+    """Remove the key and keep its old value."""
+    old_value = _get_raw(conf, key)
+    if before_write is not None:
+      before_write(old_value)
+    conf.remove_option(FAKE_SECTION_NAME, key)
+    return old_value
+  return _edit_props(file_path, mutate, create_new)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Types for startup property values.
+
+A config.Default may carry one of these types. Its active value is then
+parsed once while the configuration is resolved, and 'set' rejects values
+that do not parse. Properties without a type stay plain strings and are
+parsed where they are used, with get_value().
+"""
+
+import os
+import re
+
+TRUE_STRINGS = ('true', '1', 'on', 'yes')
+FALSE_STRINGS = ('false', '0', 'off', 'no', '')
+
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+SIZE_UNITS = {'': 1, 'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+class Error(Exception):
+  """Base exception class for this module."""
+
+
+class PropertyType(object):
+  """Parse property strings into values of one type."""
+
+  name = 'string'
+  description = 'a string'
+
+  def convert(self, text):
+    """Return the value for text. Raise ValueError if it is malformed."""
+    return text
+
+  def parse(self, text, property_name=None):
+    """Return the value for text, raising Error if it is malformed."""
+    try:
+      return self.convert(text)
+    except ValueError:
+      raise Error('Invalid value "{}"{}: expected {}.'.format(
+                  text, ' for {}'.format(property_name) if property_name else '',
+                  self.description))
+
+
+class IntType(PropertyType):
+  """Whole numbers."""
+  name = 'int'
+  description = 'an integer'
+
+  def convert(self, text):
+    return int(text.strip())
+
+
+class FloatType(PropertyType):
+  """Decimal numbers."""
+  name = 'float'
+  description = 'a number'
+
+  def convert(self, text):
+    return float(text.strip())
+
+
+class BoolType(PropertyType):
+  """true/false, 1/0, on/off or yes/no, in any case.
+
+  Unless strict, anything that is not a true string is False.
+  """
+  name = 'bool'
+  description = 'one of true, false, 1, 0, on, off, yes, no'
+
+  def __init__(self, strict=True):
+    self.strict = strict
+
+  def convert(self, text):
+    lowered = text.strip().lower()
+    if lowered in TRUE_STRINGS:
+      return True
+    if lowered in FALSE_STRINGS or not self.strict:
+      return False
+    raise ValueError(text)
+
+
+class DurationType(PropertyType):
+  """Seconds, optionally with a unit: 250ms, 30s, 5m, 2h, 1d."""
+  name = 'duration'
+  description = 'a number of seconds, optionally with a unit (ms, s, m, h, d)'
+
+  def convert(self, text):
+    match = re.match(r'^\s*(\d+(?:\.\d*)?)\s*(ms|s|m|h|d)?\s*$', text.lower())
+    if match is None:
+      raise ValueError(text)
+    return float(match.group(1)) * DURATION_UNITS[match.group(2) or 's']
+
+
+class SizeType(PropertyType):
+  """Bytes, optionally with a binary unit: 512k, 64m, 2g (also kb, mib, ...)."""
+  name = 'size'
+  description = 'a number of bytes, optionally with a unit (k, m, g, t)'
+
+  def convert(self, text):
+    match = re.match(r'^\s*(\d+)\s*([bkmgt]?)(?:i?b)?\s*$', text.lower())
+    if match is None:
+      raise ValueError(text)
+    return int(match.group(1)) * SIZE_UNITS[match.group(2)]
+
+
+class PathType(PropertyType):
+  """Absolute file system paths."""
+  name = 'path'
+  description = 'an absolute path'
+
+  def convert(self, text):
+    path = os.path.expanduser(text.strip())
+    if not os.path.isabs(path):
+      raise ValueError(text)
+    return os.path.normpath(path)
+
+
+class EnumType(PropertyType):
+  """One of a fixed set of strings."""
+  name = 'enum'
+
+  def __init__(self, *choices):
+    self.choices = choices
+    self.description = 'one of {}'.format(', '.join(choices))
+
+  def convert(self, text):
+    if text.strip() not in self.choices:
+      raise ValueError(text)
+    return text.strip()
+
+
+# pylint: disable=invalid-name
+INT = IntType()
+FLOAT = FloatType()
+BOOL = BoolType()
+FLAG = BoolType(strict=False)
+DURATION = DurationType()
+SIZE = SizeType()
+PATH = PathType()
+
+
+def get_value(values, typed_values, key, default, fallback_type):
+  """Return the value of a property, parsed once if its Default has a type.
+
+  Args:
+    values: Active string values.
+    typed_values: Parsed values of typed properties.
+    key: Property name.
+    default: String used if key has no value; if None, key must exist.
+    fallback_type: PropertyType used to parse the string of an untyped key.
+  """
+  if key in typed_values:
+    return typed_values[key]
+  text = values[key] if default is None else values.get(key, default)
+  return fallback_type.parse(text, key)
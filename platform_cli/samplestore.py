@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Fixed-size, memory-mapped ring buffer of per-service resource samples.
+
+Each store file holds a small header followed by a fixed number of binary
+records. Appending overwrites the oldest record once the ring is full, so a
+store never grows and writing costs the same at sample ten or ten million.
+Records are in time order modulo the ring, which lets queries binary search
+for the start of a window and read only the records inside it.
+"""
+
+import collections
+import errno
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import psutil
+from . import cgroup
+
+MAGIC = 'PCLIRING'
+VERSION = 1
+DEFAULT_CAPACITY = 10080
+HEADER = struct.Struct('<8sIIQ')
+RECORD = struct.Struct('<dIddQIIQQ')
+STAT_FIELDS = ('cpu_percent', 'rss', 'threads', 'fds', 'read_bytes', 'write_bytes')
+
+# pylint: disable=invalid-name
+Sample = collections.namedtuple('Sample', ['timestamp', 'pid', 'cpu_seconds', 'cpu_percent',
+                                           'rss', 'threads', 'fds', 'read_bytes',
+                                           'write_bytes'])
+FieldStats = collections.namedtuple('FieldStats', ['field', 'min', 'avg', 'p95', 'max'])
+
+
+class Error(Exception):
+  """Base exception class for this module."""
+
+
+class RingStore(object):
+  """A ring buffer of Sample records backed by an mmapped file."""
+
+  def __init__(self, path, capacity=DEFAULT_CAPACITY, readonly=False):
+    """Open the store at path, creating it with the given capacity if needed.
+
+    An existing store keeps the capacity it was created with.
+    """
+    self.path = path
+    self.readonly = readonly
+    if not os.path.exists(path):
+      if readonly:
+        raise Error('No sample store at {}.'.format(path))
+      self._create(capacity)
+    try:
+      self.file_obj = open(path, 'rb' if readonly else 'r+b')
+    except IOError, err:
+      raise Error('Cannot open sample store at {}:\n{}'.format(path, err))
+    try:
+      self.map = mmap.mmap(self.file_obj.fileno(), 0,
+                           access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+    except (mmap.error, ValueError), err:
+      self.file_obj.close()
+      raise Error('Cannot map sample store at {}:\n{}'.format(path, err))
+    magic, version, self.capacity, _ = HEADER.unpack_from(self.map, 0)
+    if magic != MAGIC or version != VERSION:
+      self.close()
+      raise Error('{} is not a version {} sample store.'.format(path, VERSION))
+    if len(self.map) != HEADER.size + self.capacity * RECORD.size:
+      self.close()
+      raise Error('Sample store at {} is truncated.'.format(path))
+
+  def _create(self, capacity):
+    """Write an empty store of the given capacity.
+
+    The store is written to a temporary file of its own and then linked into
+    place, so a store that another process created meanwhile is kept.
+    """
+    store_dir = os.path.dirname(self.path) or '.'
+    try:
+      if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+    except OSError, err:
+      if err.errno != errno.EEXIST:
+        raise Error('Cannot create sample store at {}:\n{}'.format(self.path, err))
+    try:
+      temp_fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.',
+                                            suffix='.temp', dir=store_dir)
+    except (IOError, OSError), err:
+      raise Error('Cannot create sample store at {}:\n{}'.format(self.path, err))
+    try:
+      with os.fdopen(temp_fd, 'wb') as file_obj:
+        file_obj.write(HEADER.pack(MAGIC, VERSION, capacity, 0))
+        file_obj.truncate(HEADER.size + capacity * RECORD.size)
+      os.chmod(temp_path, 0644)
+      os.link(temp_path, self.path)
+    except (IOError, OSError), err:
+      if getattr(err, 'errno', None) != errno.EEXIST:
+        raise Error('Cannot create sample store at {}:\n{}'.format(self.path, err))
+    finally:
+      os.remove(temp_path)
+
+  def close(self):
+    """Unmap and close the store."""
+    self.map.close()
+    self.file_obj.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exception_type, exception_value, traceback):
+    self.close()
+
+  def _count(self):
+    """Return the number of samples ever appended."""
+    return HEADER.unpack_from(self.map, 0)[3]
+
+  def __len__(self):
+    return min(self._count(), self.capacity)
+
+  def _read(self, logical_index):
+    """Return the sample at a logical index (0 is the oldest retained)."""
+    first = max(0, self._count() - self.capacity)
+    slot = (first + logical_index) % self.capacity
+    return Sample(*RECORD.unpack_from(self.map, HEADER.size + slot * RECORD.size))
+
+  def latest(self):
+    """Return the most recent sample, or None if the store is empty."""
+    if not len(self):
+      return None
+    return self._read(len(self) - 1)
+
+  def append(self, sample):
+    """Append a sample, overwriting the oldest one if the ring is full.
+
+    If cpu_percent is None it is derived from the previous sample of the same
+    process.
+    """
+    if self.readonly:
+      raise Error('Sample store at {} is open read-only.'.format(self.path))
+    fcntl.flock(self.file_obj.fileno(), fcntl.LOCK_EX)
+    try:
+      if sample.cpu_percent is None:
+        previous = self.latest()
+        cpu_percent = 0.0
+        if (previous is not None and previous.pid == sample.pid and
+            sample.timestamp > previous.timestamp):
+          cpu_percent = (100.0 * (sample.cpu_seconds - previous.cpu_seconds) /
+                         (sample.timestamp - previous.timestamp))
+        sample = sample._replace(cpu_percent=max(0.0, cpu_percent))
+      count = self._count()
+      RECORD.pack_into(self.map, HEADER.size + (count % self.capacity) * RECORD.size, *sample)
+      HEADER.pack_into(self.map, 0, MAGIC, VERSION, self.capacity, count + 1)
+    finally:
+      fcntl.flock(self.file_obj.fileno(), fcntl.LOCK_UN)
+
+  def _bisect(self, timestamp):
+    """Return the logical index of the first sample at or after timestamp."""
+    low, high = 0, len(self)
+    while low < high:
+      middle = (low + high) // 2
+      if self._read(middle).timestamp < timestamp:
+        low = middle + 1
+      else:
+        high = middle
+    return low
+
+  def iter_window(self, start=None, end=None):
+    """Yield samples with start <= timestamp <= end, oldest first."""
+    index = 0 if start is None else self._bisect(start)
+    while index < len(self):
+      sample = self._read(index)
+      if end is not None and sample.timestamp > end:
+        return
+      yield sample
+      index += 1
+
+
+def sample_process(main_proc, timestamp):
+  """Build a Sample summed over a process and its children.
+
+  cpu_percent is left as None for RingStore.append to fill in.
+  """
+  totals = dict((field, 0) for field in ('cpu_seconds', 'rss', 'threads', 'fds',
+                                         'read_bytes', 'write_bytes'))
+  for proc in [main_proc] + main_proc.get_children():
+    try:
+      cpu_times = proc.get_cpu_times()
+      totals['cpu_seconds'] += cpu_times.user + cpu_times.system
+      totals['rss'] += proc.get_memory_info().rss
+      totals['threads'] += proc.get_num_threads()
+      totals['fds'] += proc.get_num_fds()
+    except psutil.NoSuchProcess:
+      continue
+    except psutil.AccessDenied:
+      pass
+    try:
+      io_counters = proc.get_io_counters()
+      totals['read_bytes'] += io_counters.read_bytes
+      totals['write_bytes'] += io_counters.write_bytes
+    except (psutil.NoSuchProcess, psutil.AccessDenied, NotImplementedError):
+      pass
+  return Sample(timestamp=timestamp, pid=main_proc.pid, cpu_percent=None, **totals)
+
+
+def sample_cgroup(path, main_pid, timestamp):
+  """Build a Sample from a cgroup's accounting files.
+
+  rss is the cgroup's memory.current, which includes page cache charged to
+  it. Only the open file descriptors are counted per process, over the pids
+  in cgroup.procs. cpu_percent is left as None for RingStore.append to fill in.
+  """
+  fds = 0
+  for pid in cgroup.procs(path) or []:
+    try:
+      fds += len(os.listdir('/proc/{}/fd'.format(pid)))
+    except OSError:
+      continue
+  read_bytes, write_bytes = cgroup.io_bytes(path)
+  return Sample(timestamp=timestamp, pid=main_pid, cpu_seconds=cgroup.cpu_seconds(path),
+                cpu_percent=None, rss=cgroup.memory_current(path),
+                threads=cgroup.thread_count(path), fds=fds, read_bytes=read_bytes,
+                write_bytes=write_bytes)
+
+
+def summarize(samples, fields=STAT_FIELDS):
+  """Compute min/avg/p95/max of each field over an iterable of samples."""
+  values = dict((field, []) for field in fields)
+  for sample in samples:
+    for field in fields:
+      values[field].append(getattr(sample, field))
+  stats = []
+  for field in fields:
+    field_values = sorted(values[field])
+    if not field_values:
+      continue
+    p95_index = max(0, int(-(-len(field_values) * 95 // 100)) - 1)
+    stats.append(FieldStats(field, field_values[0],
+                            float(sum(field_values)) / len(field_values),
+                            field_values[p95_index], field_values[-1]))
+  return stats
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Run service operations in dependency order with bounded parallelism.
+
+A dependency graph maps each service name to the names it depends on.
+Services that declare no dependencies depend on every service in the
+nearest lower priority tier, so profiles that only set priorities keep
+their tier-by-tier ordering. Starting runs each service as soon as all its
+dependencies have finished; stopping runs the same graph in reverse.
+"""
+
+import collections
+import Queue
+import sys
+import threading
+
+
+class Error(Exception):
+  """Base exception class for this module."""
+
+
+def build_graph(services):
+  """Build a dependency graph from ServiceProfiles with priority and depends_on.
+
+  Returns:
+    An OrderedDict mapping service name to a frozenset of dependency names,
+    in the order the services were given.
+
+  Raises:
+    Error: A dependency names an unknown service or the graph has a cycle.
+  """
+  names = set(service.name for service in services)
+  priorities = sorted(set(service.priority for service in services))
+  tiers = dict((priority, [srv.name for srv in services if srv.priority == priority])
+               for priority in priorities)
+  graph = collections.OrderedDict()
+  for service in services:
+    if service.depends_on:
+      unknown = [name for name in service.depends_on if name not in names]
+      if unknown:
+        raise Error('Service {} depends on unknown service(s): {}.'.format(
+                    service.name, ', '.join(unknown)))
+      graph[service.name] = frozenset(service.depends_on)
+    else:
+      lower = [priority for priority in priorities if priority < service.priority]
+      graph[service.name] = frozenset(tiers[lower[-1]]) if lower else frozenset()
+  topological_order(graph)
+  return graph
+
+
+def topological_order(graph):
+  """Return the names in graph with every name after its dependencies.
+
+  Ties keep the graph's own order. Raises Error if the graph has a cycle.
+  """
+  remaining = collections.OrderedDict((name, set(deps) & set(graph))
+                                      for name, deps in graph.iteritems())
+  order = []
+  while remaining:
+    ready = [name for name, deps in remaining.iteritems() if not deps]
+    if not ready:
+      raise Error('Service dependencies form a cycle: {}.'.format(_find_cycle(remaining)))
+    for name in ready:
+      del remaining[name]
+      order.append(name)
+    for deps in remaining.values():
+      deps.difference_update(ready)
+  return order
+
+
+def _find_cycle(graph):
+  """Format one cycle in a graph in which every node has a dependency."""
+  path = [next(iter(graph))]
+  while path.count(path[-1]) < 2:
+    path.append(sorted(graph[path[-1]])[0])
+  return ' -> '.join(path[path.index(path[-1]):])
+
+
+def subgraph(graph, names):
+  """Restrict a graph to names.
+
+  A kept service depends on every kept service it reaches through services
+  that were left out, so leaving out a middle tier keeps the outer tiers
+  ordered.
+  """
+  names = set(names)
+
+  def kept_deps(name, seen):
+    """Return the kept services name depends on, looking through left-out ones."""
+    deps = set()
+    for dep in graph[name]:
+      if dep in names:
+        deps.add(dep)
+      elif dep not in seen:
+        seen.add(dep)
+        deps.update(kept_deps(dep, seen))
+    return deps
+
+  return collections.OrderedDict((name, frozenset(kept_deps(name, set())))
+                                 for name in graph if name in names)
+
+
+def reverse(graph):
+  """Return the graph with every dependency edge flipped."""
+  reversed_graph = collections.OrderedDict((name, set()) for name in reversed(graph.keys()))
+  for name, deps in graph.iteritems():
+    for dep in deps:
+      reversed_graph[dep].add(name)
+  return collections.OrderedDict((name, frozenset(deps))
+                                 for name, deps in reversed_graph.iteritems())
+
+
+def _call(func, name):
+  """Call func(name). Return (succeeded, exc_info)."""
+  try:
+    return func(name) is not False, None
+  except SystemExit:
+    return False, None
+  except Exception: # pylint: disable=broad-except
+    return False, sys.exc_info()
+
+
+def run(graph, func, parallelism=1, before_batch=None):
+  """Call func(name) for every name once its dependencies have succeeded.
+
+  Args:
+    graph: Dependency graph, as returned by build_graph() or subgraph().
+    func: Called with a service name. A return value of False or a
+      SystemExit counts as failure; anything else as success.
+    parallelism: Maximum number of concurrent calls. With 1, calls run in
+      the calling thread.
+    before_batch: Optional function called with the list of names that
+      became ready together, before any of them is dispatched.
+
+  Returns:
+    An OrderedDict mapping each name, in completion order, to True if it
+    succeeded, False if it failed, or None if it was skipped because a
+    dependency failed. The first unexpected exception raised by func is
+    re-raised once all running calls have finished.
+  """
+  order = topological_order(graph)
+  waiting = dict((name, set(graph[name])) for name in order)
+  dependents = dict((name, []) for name in order)
+  for name in order:
+    for dep in graph[name]:
+      dependents[dep].append(name)
+  results = collections.OrderedDict()
+  completed = Queue.Queue()
+  ready = [name for name in order if not waiting[name]]
+  new_batch = list(ready)
+  running = 0
+  first_error = None
+
+  def worker(name):
+    """Run one call on a thread and report back."""
+    completed.put((name,) + _call(func, name))
+
+  def skip_dependents(name):
+    """Mark everything downstream of a failed name as skipped."""
+    for dependent in dependents[name]:
+      if dependent not in results:
+        results[dependent] = None
+        skip_dependents(dependent)
+
+  while ready or running:
+    if new_batch and before_batch is not None:
+      before_batch(new_batch)
+    new_batch = []
+    while ready and running < max(1, parallelism):
+      name = ready.pop(0)
+      if parallelism <= 1:
+        completed.put((name,) + _call(func, name))
+      else:
+        thread = threading.Thread(target=worker, args=(name,))
+        thread.daemon = True
+        thread.start()
+      running += 1
+    name, succeeded, exc_info = completed.get(True, 365 * 24 * 3600)
+    running -= 1
+    results[name] = succeeded
+    if exc_info is not None and first_error is None:
+      first_error = exc_info
+    if not succeeded:
+      skip_dependents(name)
+      continue
+    for dependent in dependents[name]:
+      waiting[dependent].discard(name)
+      if not waiting[dependent] and dependent not in results:
+        ready.append(dependent)
+        new_batch.append(dependent)
+  if first_error is not None:
+    raise first_error[0], first_error[1], first_error[2]
+  return results
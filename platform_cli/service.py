@@ -3,13 +3,15 @@
 
 """Define commands for managing processes.
 """
-import getpass
+import collections
 import os
 import shlex
+import signal
 import sys
 import psutil
 import time
-from . import template, protected_file_path
+from . import (cgroup, lifecycle, logwriter, pidfile, proctable, proptypes, samplestore, template,
+               protected_file_path, spawn, trigger)
 from clint.textui import colored, puts
 
 
@@ -29,15 +31,27 @@ class SubstitutePropertyValue(str):
   """Wrapper to signify that we should use the property value of the given keyname."""
 
 
-def wait_dots(wait_secs, proc):
-  """Wait for wait_secs and print dots. Return True if proc stops running."""
-  for _ in range(wait_secs):
-    if not proc.is_running():
-      return True
-    sys.stdout.write('.')
-    sys.stdout.flush()
-    time.sleep(1)
-  return False
+# pylint: disable=invalid-name
+ServiceStatus = collections.namedtuple('ServiceStatus',
+                                       ['name', 'pid', 'enabled', 'listening', 'orphans'])
+
+
+def _ignore_progress(_):
+  """Default progress callback."""
+
+
+def _make_preexec(new_session, cgroup_path):
+  """Return a function run in the child before exec, or None if there is nothing to do."""
+  if not new_session and cgroup_path is None:
+    return None
+
+  def preexec():
+    """Start a new session and join the service's cgroup."""
+    if new_session:
+      os.setsid()
+    if cgroup_path is not None:
+      cgroup.join(cgroup_path)
+  return preexec
 
 
 class ServiceProfile(object):
@@ -64,6 +78,10 @@ class ServiceProfile(object):
                after_sigkill_seconds=5,
                external_pidfile_key=None,
                external_procname_key=None,
+               ports_tmpl=None,
+               depends_on=None,
+               readiness_functions=None,
+               tags=None,
                ):
     """Initialize a ServiceProfile.
 
@@ -99,6 +117,17 @@ class ServiceProfile(object):
         services which manage their own pidfiles.
       external_procname_key: Template property pointing to a process name, for
         services which manage their own pidfiles.
+      ports_tmpl: List of templatized TCP ports the service listens on. Setup
+        checks fail if any of them is already taken when the service is stopped.
+      depends_on: List of names of services that must be started before this
+        one and stopped after it. More can be added with the <name>.depends_on
+        property. Without any, the service depends on the next lower priority.
+      readiness_functions: List of functions which take the template dictionary
+        as a single argument, and return True once the service is ready to take
+        traffic. They are checked after the process is running and all of its
+        ports are listening.
+      tags: List of tags used to select groups of services at the command line.
+        More can be added with the <name>.tags property.
     """
     if not run_sigterm and not stop_cmd_tmpl:
       raise Error('Need to specify either run_sigterm or stop_cmd_tmpl.')
@@ -126,11 +155,20 @@ class ServiceProfile(object):
     self.after_sigkill_seconds = after_sigkill_seconds
     self.external_pidfile_key = external_pidfile_key
     self.external_procname_key = external_procname_key
+    self.ports_tmpl = ports_tmpl if ports_tmpl is not None else []
+    self.declared_depends_on = depends_on if depends_on is not None else []
+    self.readiness_functions = (readiness_functions
+                                if readiness_functions is not None else [])
+    self.declared_tags = tags if tags is not None else []
     self.external_pidfile = None
     self.external_procname = None
     self.start_cmd = []
     self.stop_cmd = []
     self.graceful_cmd = []
+    self.ports = []
+    self.invalid_ports = []
+    self.depends_on = []
+    self.tags = []
     self.env = {}
     self.cwd = None
     self.values = {}
@@ -139,11 +177,26 @@ class ServiceProfile(object):
     self.pid_file = None
     self.priority = None
     self.snap_cmd = None
+    self.snap_timeout_seconds = None
     self.start_wait_seconds = None
+    self.ready_timeout_seconds = None
+    self.graceful_timeout_seconds = None
+    self.prewarm_paths = []
+    self.prewarm_max_bytes = 0
+    self.stdout_max_bytes = 0
+    self.stdout_rotate_seconds = 0
+    self.stdout_backups = 5
+    self.stdout_compress = False
+    self.cgroup_path = None
+    self.cgroup_limits = {}
+    self.trigger_thresholds = None
 
   # pylint: disable=too-many-branches
-  def assign_template_values(self, template_values):
+  def assign_template_values(self, template_values, typed_values=None):
     """Apply template values including custom runtime values.
+
+    typed_values maps the names of typed properties to their parsed values,
+    from config.Config.get_typed_values().
     """
     def render_cmd_from_tmpl(rend, tmpl):
       """Render template strings in a list.
@@ -162,6 +215,7 @@ class ServiceProfile(object):
       return cmd
 
     self.values = template_values.copy()
+    self.typed_values = typed_values if typed_values is not None else {}
     for key, func in self.runtime_template_key_functions.iteritems():
       if key not in self.values and not '___' in key and not ' ' in key:
         self.values[key] = func(self.values.copy())
@@ -169,28 +223,135 @@ class ServiceProfile(object):
     self.start_cmd = render_cmd_from_tmpl(renderer, self.start_cmd_tmpl)
     self.stop_cmd = render_cmd_from_tmpl(renderer, self.stop_cmd_tmpl)
     self.graceful_cmd = render_cmd_from_tmpl(renderer, self.graceful_cmd_tmpl)
+    self.ports = []
+    self.invalid_ports = []
+    for port_tmpl in self.ports_tmpl:
+      for port in render_cmd_from_tmpl(renderer, [port_tmpl]):
+        if port.isdigit() and 0 < int(port) < 65536:
+          self.ports.append(int(port))
+        else:
+          self.invalid_ports.append('{} port "{}" from {} is not a TCP port number.'.format(
+                                    self.name, port, port_tmpl))
     self.env = dict([(key, renderer.render(val))
                     for key, val in self.env_tmpl.iteritems()])
     if self.cwd_key is not None:
       self.cwd = self.values[self.cwd_key]
     self.stdout = self.values['{}.stdout'.format(self.name)]
-    self.priority = int(self.values['{}.priority'.format(self.name)])
+    self.priority = self._get_value('{}.priority'.format(self.name), None, proptypes.INT)
+    self.depends_on = list(self.declared_depends_on)
+    for name in shlex.split(self.values.get('{}.depends_on'.format(self.name), '')):
+      if name not in self.depends_on:
+        self.depends_on.append(name)
+    self.tags = list(self.declared_tags)
+    for tag in shlex.split(self.values.get('{}.tags'.format(self.name), '')):
+      if tag not in self.tags:
+        self.tags.append(tag)
     self.pid_file = os.path.join(self.values['main.pidfile_dir'],
                                  '{}.pid'.format(self.name))
-    self.enabled = self.values['{}.enabled'.format(self.name)] in (
-        'True', 'true', '1', 'on', 'yes')
+    self.enabled = self._get_value('{}.enabled'.format(self.name), None, proptypes.FLAG)
     self.snap_cmd = self.values.get('{}.snap_cmd'.format(self.name))
-    self.start_wait_seconds = int(self.values['main.start_wait_seconds'])
+    self.snap_timeout_seconds = self._get_service_or_main_value(
+        'snap_timeout_seconds', '30', proptypes.DURATION)
+    self.start_wait_seconds = self._get_value('main.start_wait_seconds', None, proptypes.DURATION)
+    self.ready_timeout_seconds = self._get_service_or_main_value(
+        'ready_timeout_seconds', '60', proptypes.DURATION)
+    self.graceful_timeout_seconds = self._get_service_or_main_value(
+        'graceful_timeout_seconds', '60', proptypes.DURATION)
+    self.prewarm_paths = shlex.split(self.values.get('{}.prewarm_paths'.format(self.name), ''))
+    self.prewarm_max_bytes = self._get_value(
+        '{}.prewarm_max_bytes'.format(self.name), '0', proptypes.SIZE)
+    self.stdout_max_bytes = self._get_value(
+        '{}.stdout_max_bytes'.format(self.name), '0', proptypes.SIZE)
+    self.stdout_rotate_seconds = self._get_value(
+        '{}.stdout_rotate_seconds'.format(self.name), '0', proptypes.DURATION)
+    self.stdout_backups = self._get_value(
+        '{}.stdout_backups'.format(self.name), '5', proptypes.INT)
+    self.stdout_compress = self._get_value(
+        '{}.stdout_compress'.format(self.name), 'false', proptypes.FLAG)
+    cgroup_parent = self.values.get('main.cgroup_parent', '')
+    self.cgroup_path = cgroup.service_path(cgroup_parent, self.name) if cgroup_parent else None
+    self.cgroup_limits = cgroup.limit_files(
+        self._get_optional_value('{}.cgroup_memory_max'.format(self.name), proptypes.SIZE),
+        self._get_optional_value('{}.cgroup_cpu_max'.format(self.name), proptypes.FLOAT),
+        self._get_optional_value('{}.cgroup_io_weight'.format(self.name), proptypes.INT))
+    self.trigger_thresholds = trigger.Thresholds(
+        self._get_optional_service_or_main_value('trigger_cpu_percent', proptypes.FLOAT),
+        self._get_optional_service_or_main_value('trigger_rss_growth_per_second', proptypes.SIZE),
+        self._get_optional_service_or_main_value('trigger_threads', proptypes.INT),
+        self._get_optional_service_or_main_value('trigger_fds', proptypes.INT),
+        self._get_service_or_main_value('trigger_window_seconds', '30', proptypes.DURATION))
     if self.external_pidfile_key is not None:
       self.external_pidfile = self.values[self.external_pidfile_key]
     if self.external_procname_key is not None:
       self.external_procname = self.values[self.external_procname_key]
     if isinstance(self.after_stop_cmd_seconds, SubstitutePropertyValue):
-      self.after_stop_cmd_seconds = int(self.values[self.after_stop_cmd_seconds])
+      self.after_stop_cmd_seconds = self._get_value(self.after_stop_cmd_seconds, None,
+                                                    proptypes.DURATION)
     if isinstance(self.after_sigterm_seconds, SubstitutePropertyValue):
-      self.after_sigterm_seconds = int(self.values[self.after_sigterm_seconds])
+      self.after_sigterm_seconds = self._get_value(self.after_sigterm_seconds, None,
+                                                   proptypes.DURATION)
     if isinstance(self.after_sigkill_seconds, SubstitutePropertyValue):
-      self.after_sigkill_seconds = int(self.values[self.after_sigkill_seconds])
+      self.after_sigkill_seconds = self._get_value(self.after_sigkill_seconds, None,
+                                                   proptypes.DURATION)
+
+  def _get_value(self, key, default, fallback_type):
+    """Return a property value, parsed with fallback_type unless it is typed."""
+    try:
+      return proptypes.get_value(self.values, self.typed_values, key, default, fallback_type)
+    except proptypes.Error, err:
+      raise Error(str(err))
+
+  def _get_optional_value(self, key, fallback_type):
+    """Return a property value, or None if it is missing or empty."""
+    if not self.values.get(key, '').strip():
+      return None
+    return self._get_value(key, None, fallback_type)
+
+  def _get_optional_service_or_main_value(self, suffix, fallback_type):
+    """Return <service>.<suffix>, falling back to main.<suffix>, or None if neither is set."""
+    service_value = self._get_optional_value('{}.{}'.format(self.name, suffix), fallback_type)
+    if service_value is not None:
+      return service_value
+    return self._get_optional_value('main.{}'.format(suffix), fallback_type)
+
+  def _get_service_or_main_value(self, suffix, default, fallback_type):
+    """Return <service>.<suffix>, falling back to main.<suffix> and then default."""
+    key = '{}.{}'.format(self.name, suffix)
+    if key not in self.values:
+      key = 'main.{}'.format(suffix)
+    return self._get_value(key, default, fallback_type)
+
+  def _get_timings_path(self):
+    """Get the path of the file recording the last start and stop durations."""
+    return os.path.join(self.values['main.pidfile_dir'], '{}.timings'.format(self.name))
+
+  def get_timings(self):
+    """Return a dictionary mapping 'start' and 'stop' to their last duration in seconds."""
+    timings = {}
+    try:
+      with open(self._get_timings_path(), 'r') as timings_file:
+        for line in timings_file:
+          operation, _, seconds = line.partition('=')
+          try:
+            timings[operation.strip()] = float(seconds)
+          except ValueError:
+            continue
+    except IOError:
+      pass
+    return timings
+
+  def _record_timing(self, operation, seconds):
+    """Record how long the last start or stop took."""
+    timings = self.get_timings()
+    timings[operation] = seconds
+    timings_path = self._get_timings_path()
+    try:
+      with open(timings_path + '.temp', 'w') as timings_file:
+        for name in sorted(timings):
+          timings_file.write('{}={:.3f}\n'.format(name, timings[name]))
+      os.rename(timings_path + '.temp', timings_path)
+    except (IOError, OSError):
+      pass
 
   def _ensure_stdout_dirs_exist(self):
     """Make sure the directories under our stdout file exist."""
@@ -218,15 +379,18 @@ class ServiceProfile(object):
       return True
     return False
 
-  def _get_running_process_if_exists(self, delete_stale_pidfiles=False):
-    """Find running proc based on pid file. Remove pid file if stale.
+  def _get_running_pid(self, delete_stale_pidfiles=False):
+    """Find the running pid based on pid file. Remove pid file if stale.
 
     Stale pid is if:
       * there's no process
 
       * there's a process but is neither a zombie nor does it match the
-        username and command-line signature we expect.
+        user and command-line signature we expect.
 
+    Pid files written by start() record the process start time, which lets
+    pidfile.check_alive() decide most cases without inspecting the process.
+    Either way, a process is ours only if it runs with our effective uid.
     """
     pidfile_name = self._get_pidfile()
     process_name = self._get_process_name()
@@ -238,95 +402,238 @@ class ServiceProfile(object):
 
     with protected_file_path.ProtectedFilePath(pidfile_name, noop=noop):
       try:
-        with open(pidfile_name, 'r') as pidfile:
-          pid = int(pidfile.read().strip())
+        record = pidfile.read(pidfile_name)
       except IOError:
-        pid = None
+        record = None
       except ValueError:
-        pid = None
+        record = None
         for proc in psutil.process_iter():
           if proc.name == os.path.basename(process_name):
             proc.kill()
         os.remove(pidfile_name)
-      if pid is not None:
+      if record is None:
+        return None
+      alive = pidfile.check_alive(record)
+      if alive:
+        return record.pid
+      if alive is None:
         try:
-          proc = psutil.Process(pid)
-        except psutil.error.NoSuchProcess:
-          if delete_stale_pidfiles:
-            os.remove(pidfile_name)
-          return None
-        if ((proc.username == getpass.getuser() and
-             proc.cmdline and
-             proc.cmdline[0] == process_name) or
-            proc.status == psutil.STATUS_ZOMBIE):
-          return proc
-        else:
-          if delete_stale_pidfiles:
-            os.remove(pidfile_name)
-          return None
+          proc = psutil.Process(record.pid)
+          if ((proc.uids.effective == os.geteuid() and
+               proc.cmdline and
+               (proc.cmdline[0] == process_name or
+                pidfile.cmdline_hash(proc.cmdline) == record.cmdline_hash)) or
+              proc.status == psutil.STATUS_ZOMBIE):
+            return record.pid
+        except psutil.NoSuchProcess:
+          pass
+      if delete_stale_pidfiles:
+        os.remove(pidfile_name)
+      return None
 
-  #pylint: disable=superfluous-parens
-  def start(self):
-    """Start the service."""
+  def _get_running_process_if_exists(self, delete_stale_pidfiles=False):
+    """Return the psutil.Process of the running pid from _get_running_pid(), or None."""
+    pid = self._get_running_pid(delete_stale_pidfiles)
+    if pid is None:
+      return None
+    try:
+      return psutil.Process(pid)
+    except psutil.NoSuchProcess:
+      return None
+
+  def _get_process_group(self):
+    """Return the process group recorded in our pid file, or None.
+
+    Externally managed pid files and pid files written before services were
+    started in their own process group record none.
+    """
+    if self._is_externally_managed_process():
+      return None
+    try:
+      pgid = pidfile.read(self.pid_file).pgid
+    except (IOError, ValueError):
+      return None
+    if pgid is None or pgid == os.getpgrp():
+      return None
+    return pgid
+
+  def _prepare_cgroup(self, progress):
+    """Create and limit the service's cgroup. Return its path, or None to start without it."""
+    if self.cgroup_path is None:
+      return None
+    try:
+      cgroup.prepare(self.cgroup_path, self.cgroup_limits)
+    except cgroup.Error, err:
+      progress(' (without cgroup)')
+      logwriter.append(self.stdout, '[{}] {} starting {} without a cgroup: {}\n'.format(
+          time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name, self.name, err))
+      return None
+    return self.cgroup_path
+
+  def _get_cgroup_pids(self, proc):
+    """Return the pids in the service's cgroup if proc runs in it, else None."""
+    if self.cgroup_path is None:
+      return None
+    pids = cgroup.procs(self.cgroup_path)
+    if pids is None or proc.pid not in pids:
+      return None
+    return pids
+
+  def get_pids(self, proc):
+    """Return the pids of the service: its cgroup's processes, or proc and its children."""
+    pids = self._get_cgroup_pids(proc)
+    if pids is None:
+      pids = [proc.pid] + [child.pid for child in proc.get_children()]
+    return pids
+
+  def get_pidfile_record(self, wait_for_lock=False):
+    """Return the PidfileRecord of the service's pid file, or None if there is none.
+
+    With wait_for_lock, a start or stop in progress is given a few seconds to
+    finish first, so that the pid file has been written or removed.
+    """
+    pidfile_name = self._get_pidfile()
+    try:
+      with protected_file_path.ProtectedFilePath(pidfile_name, noop=not wait_for_lock):
+        return pidfile.read(pidfile_name)
+    except protected_file_path.Error:
+      return self.get_pidfile_record()
+    except (IOError, ValueError):
+      return None
+
+  def get_process(self):
+    """Return the psutil.Process the pid file points at if it is ours, else None."""
+    return self._get_running_process_if_exists()
+
+  def is_running(self):
+    """Return True if the pid file points at our running process."""
+    return self._get_running_pid() is not None
+
+  def start(self, progress=None):
+    """Start the service and check that it is still running after main.start_wait_seconds.
+
+    Unless the pid file is externally managed, the wait ends early if the
+    started process exits.
+
+    Args:
+      progress: Optional function called with progress text.
+
+    Returns:
+      A lifecycle.StartResult.
+
+    Raises:
+      lifecycle.StartError: No process was running after the wait.
+    """
+    progress = progress if progress is not None else _ignore_progress
     proc = self._get_running_process_if_exists(delete_stale_pidfiles=True)
     pidfile_name = self._get_pidfile()
     if proc is not None:
-      print('{} is already running.'.format(self.name))
-    else:
-      self._ensure_stdout_dirs_exist()
-      with open(self.stdout, 'a') as stdout:
-        with protected_file_path.ProtectedFilePath(pidfile_name):
-          sys.stdout.write('Starting {}'.format(self.name))
-          sys.stdout.flush()
-          for func in self.pre_start_functions:
-            func(self.values)
-          stdout.write('[{}] {} starting {}:\n{}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S'),
-                                                           self.cli_name, self.name,
-                                                           ' '.join(self.start_cmd)))
-          stdout.flush()
-          proc = psutil.Popen(args=([self.process_name] + self.start_cmd[1:]),
-                              executable=self.start_cmd[0],
-                              stdout=stdout,
-                              stderr=stdout,
-                              env=self.env,
-                              cwd=self.cwd)
-          if not self._is_externally_managed_process():
-            with open(pidfile_name, 'w') as pid_file:
-              pid_file.write(str(proc.pid))
-
-        for _ in range(self.start_wait_seconds):
-          sys.stdout.write('.')
-          sys.stdout.flush()
-          time.sleep(1)
-        post_start_proc = self._get_running_process_if_exists(delete_stale_pidfiles=True)
-        if post_start_proc is not None and post_start_proc.status != psutil.STATUS_ZOMBIE:
-          puts(colored.green('process started.'))
-          stdout.write('[{}] {} started process ({})\n'.format(time.strftime('%Y-%m-%d %H:%M:%S'),
-                                                               self.cli_name, proc.pid))
-          stdout.flush()
-        else:
-          puts(colored.red('no process found. See logs: {}'.format(self.stdout)))
-          stdout.write('[{}] {} no process found after startup\n'.format(
-                       time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name))
-          stdout.flush()
-          sys.exit(1)
+      return lifecycle.StartResult(self.name, proc.pid, True, 0.0)
+    self._ensure_stdout_dirs_exist()
+    started = time.time()
+    with open(self.stdout, 'a') as stdout:
+      with protected_file_path.ProtectedFilePath(pidfile_name):
+        progress('Starting {}'.format(self.name))
+        for func in self.pre_start_functions:
+          func(self.values)
+        logwriter.append(self.stdout, '[{}] {} starting {}:\n{}\n'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name, self.name,
+            ' '.join(self.start_cmd)))
+        cgroup_path = self._prepare_cgroup(progress)
+        log_proc = None
+        child_stdout = stdout
+        if self.stdout_max_bytes or self.stdout_rotate_seconds:
+          log_proc = logwriter.spawn(self.stdout, self.stdout_max_bytes,
+                                     self.stdout_rotate_seconds, self.stdout_backups,
+                                     self.stdout_compress)
+          child_stdout = log_proc.stdin
+        try:
+          # Our own services lead a new session, so stop() can signal the
+          # whole process tree as one process group.
+          proc = spawn.popen(args=([self.process_name] + self.start_cmd[1:]),
+                             executable=self.start_cmd[0],
+                             stdout=child_stdout,
+                             stderr=child_stdout,
+                             env=self.env,
+                             cwd=self.cwd,
+                             preexec_fn=_make_preexec(
+                                 not self._is_externally_managed_process(), cgroup_path))
+        finally:
+          if log_proc is not None:
+            log_proc.stdin.close()
+        if not self._is_externally_managed_process():
+          pidfile.write(pidfile_name, proc.pid, pidfile.proc_start_time(proc.pid),
+                        pidfile.cmdline_hash([self.process_name] + self.start_cmd[1:]),
+                        proc.pid)
+
+      if self._is_externally_managed_process():
+        # The started command may exit once the real process has daemonized.
+        remaining = self.start_wait_seconds
+        while remaining > 0:
+          progress('.')
+          time.sleep(min(1, remaining))
+          remaining -= 1
+      else:
+        lifecycle.wait_for_exit(proc, self.start_wait_seconds, lambda: progress('.'))
+      post_start_proc = self._get_running_process_if_exists(delete_stale_pidfiles=True)
+      if post_start_proc is None or post_start_proc.status == psutil.STATUS_ZOMBIE:
+        logwriter.append(self.stdout, '[{}] {} no process found after startup\n'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name))
+        raise lifecycle.StartError(self.name, 'no process found. See logs: {}'.format(self.stdout),
+                                   proc.pid, self.stdout)
+      logwriter.append(self.stdout, '[{}] {} started process ({})\n'.format(
+          time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name, proc.pid))
+    seconds = time.time() - started
+    self._record_timing('start', seconds)
+    return lifecycle.StartResult(self.name, post_start_proc.pid, False, seconds)
+
+  def get_status(self, verbose=False, listening_by_pid=None, process_table=None):
+    """Get a ServiceStatus. Listening addresses and orphans are only gathered if verbose.
 
-  def status(self, verbose=False):
-    """Print process status."""
+    Args:
+      verbose: Include the listening addresses of the process and its children,
+        and the orphaned processes of its process group.
+      listening_by_pid: Optional result of proctable.listening_addresses_by_pid()
+        to use instead of inspecting each process's connections.
+      process_table: Optional result of proctable.read_process_table().
+    """
     main_proc = self._get_running_process_if_exists()
-    listening_str = ''
-    running_pid = ''
+    listening = []
+    orphans = []
+    running_pid = None
+    pgid = self._get_process_group() if verbose else None
+    if pgid is not None:
+      if process_table is None:
+        process_table = proctable.read_process_table()
+      orphans = proctable.escaped_pids(pgid, process_table)
+      if main_proc is None:
+        orphans = sorted(set(orphans) | set(proctable.group_pids(pgid, process_table)))
     if main_proc is not None:
       running_pid = main_proc.pid
       if verbose:
-        listening = []
-        for proc in [main_proc] + main_proc.get_children():
-          listening.extend([conn.local_address
-                            for conn in proc.get_connections()
-                            if conn.status == 'LISTEN'])
-
-        listening_str = [':'.join([ip, str(port)]) for ip, port in listening]
-        listening_str = 'listening={}'.format(','.join(list(set(listening_str))))
+        for pid in self.get_pids(main_proc):
+          if listening_by_pid is not None:
+            listening.extend(listening_by_pid.get(pid, []))
+            continue
+          try:
+            listening.extend([conn.local_address
+                              for conn in psutil.Process(pid).get_connections()
+                              if conn.status == 'LISTEN'])
+          except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    listening = sorted(set(':'.join([ip, str(port)]) for ip, port in listening))
+    return ServiceStatus(self.name, running_pid, self.enabled, listening, orphans)
+
+  def status(self, verbose=False, listening_by_pid=None):
+    """Print process status."""
+    self.print_status(self.get_status(verbose, listening_by_pid), verbose)
+
+  def print_status(self, service_status, verbose=False):
+    """Print a ServiceStatus obtained from get_status()."""
+    running_pid = service_status.pid
+    listening_str = ''
+    if running_pid and verbose:
+      listening_str = 'listening={}'.format(','.join(service_status.listening))
     output = ''.join((self.name.ljust(20),
                       'running' if running_pid else 'stopped',
                       '={}'.format(running_pid).ljust(17) if running_pid else ''.ljust(17),
@@ -336,111 +643,229 @@ class ServiceProfile(object):
       puts(colored.green(output))
     else:
       puts(output)
+    if verbose and service_status.orphans:
+      puts(colored.yellow('{}orphans={}'.format(
+          ''.ljust(20), ','.join(str(pid) for pid in service_status.orphans))))
+
+  def is_ready(self):
+    """Return True if the process runs, listens on its ports and passes readiness checks."""
+    service_status = self.get_status(verbose=bool(self.ports))
+    if not service_status.pid:
+      return False
+    listening_ports = set(int(address.rsplit(':', 1)[1])
+                          for address in service_status.listening)
+    if not set(self.ports) <= listening_ports:
+      return False
+    return all(func(self.values) for func in self.readiness_functions)
+
+  def wait_until_ready(self, timeout=None, interval=0.5):
+    """Poll is_ready() until it passes or timeout seconds pass. Return the last result."""
+    if timeout is None:
+      timeout = self.ready_timeout_seconds
+    deadline = time.time() + timeout
+    while True:
+      if self.is_ready():
+        return True
+      if time.time() >= deadline:
+        return False
+      time.sleep(interval)
+
+  def _listening_ports(self):
+    """Return the set of ports the running process tree listens on."""
+    return set(int(address.rsplit(':', 1)[1])
+               for address in self.get_status(verbose=True).listening)
 
   #pylint: disable=superfluous-parens
   def graceful(self):
-    """If the service supports it, run graceful restart.
+    """If the service supports it, run graceful restart and wait for it.
 
     Currently this assumes that the pid file is externally managed, for example
-    by apachectl.
+    by apachectl. The graceful command must exit successfully within
+    graceful_timeout_seconds, after which the process in the pid file must be
+    listening again on its ports (the declared ports, or else those it listened
+    on beforehand) within the same time budget. Returns False otherwise.
     """
     if not self.graceful_cmd:
       print('{} does not support graceful restart, skipping.'.format(self.name))
-    else:
-      proc = self._get_running_process_if_exists(delete_stale_pidfiles=True)
-      pidfile_name = self._get_pidfile()
-      if proc is not None:
-        self._ensure_stdout_dirs_exist()
-        with protected_file_path.ProtectedFilePath(pidfile_name):
-          print('Gracefully restarting {} with:\n{}'.format(
-                self.name, self.graceful_cmd))
-          for func in self.pre_graceful_functions:
-            func(self.values)
-          with open(self.stdout, 'a') as stdout:
-            # pylint: disable=unused-variable
-            graceful_proc = psutil.Popen(args=self.graceful_cmd,
-                                         stdout=stdout,
-                                         stderr=stdout,
-                                         env=self.env,
-                                         cwd=self.cwd)
-
-  def snap(self, iteration, output=None):
-    """Create a performance snapshot of the service and dump to stdout."""
-    proc = self._get_running_process_if_exists()
+      return True
+    proc = self._get_running_process_if_exists(delete_stale_pidfiles=True)
     pidfile_name = self._get_pidfile()
-    if output is not None:
-      out = open(output, 'a+')
-    else:
-      out = sys.stdout
-    if self.snap_cmd and proc is not None and proc.status != psutil.STATUS_ZOMBIE:
+    if proc is None:
+      return True
+    expected_ports = set(self.ports) or self._listening_ports()
+    self._ensure_stdout_dirs_exist()
+    started = time.time()
+    deadline = started + self.graceful_timeout_seconds
+    with open(self.stdout, 'a') as stdout:
       with protected_file_path.ProtectedFilePath(pidfile_name):
-        snap_env = {'PID': str(proc.pid)}
-        out.write('[{}] Snapshot #{} for {}. Running: {}. Environment: {}\n'.format(
-                  time.strftime('%Y-%m-%d %H:%M:%S'), iteration,
-                  self.name, self.snap_cmd, snap_env))
-        out.flush()
-        snap_proc = psutil.Popen(self.snap_cmd, env=snap_env, shell=True, stdout=out, stderr=out)
-        if snap_proc.wait() != 0:
-          out.write('Snapshot #{} for {} failed. Process {} may be hung.'.format(
+        print('Gracefully restarting {} with:\n{}'.format(
+              self.name, self.graceful_cmd))
+        for func in self.pre_graceful_functions:
+          func(self.values)
+        logwriter.append(self.stdout, '[{}] {} gracefully restarting {}:\n{}\n'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name, self.name,
+            ' '.join(self.graceful_cmd)))
+        graceful_proc = spawn.popen(args=self.graceful_cmd,
+                                    stdout=stdout,
+                                    stderr=stdout,
+                                    env=self.env,
+                                    cwd=self.cwd)
+        try:
+          exit_code = graceful_proc.wait(self.graceful_timeout_seconds)
+        except psutil.TimeoutExpired:
+          graceful_proc.kill()
+          graceful_proc.wait()
+          exit_code = None
+      if exit_code is None:
+        failure = 'graceful command did not finish within {:g}s'.format(
+            self.graceful_timeout_seconds)
+      elif exit_code != 0:
+        failure = 'graceful command exited with {}'.format(exit_code)
+      else:
+        failure = None
+        while not (self.is_running() and expected_ports <= self._listening_ports()):
+          if time.time() >= deadline:
+            failure = 'not listening on {} within {:g}s'.format(
+                ','.join(str(port) for port in sorted(expected_ports)),
+                self.graceful_timeout_seconds)
+            break
+          time.sleep(0.2)
+      elapsed = time.time() - started
+      if failure is None:
+        puts(colored.green('{} gracefully restarted in {:.1f}s.'.format(self.name, elapsed)))
+        logwriter.append(self.stdout, '[{}] {} gracefully restarted {} in {:.1f}s\n'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name, self.name, elapsed))
+        return True
+      puts(colored.red('{} graceful restart failed after {:.1f}s: {}. See logs: {}'.format(
+                       self.name, elapsed, failure, self.stdout)))
+      logwriter.append(self.stdout, '[{}] {} graceful restart of {} failed: {}\n'.format(
+          time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name, self.name, failure))
+      return False
+
+  def capture_snapshot(self, iteration, timeout=None):
+    """Run the snap command for the service and capture its output.
+
+    The command is killed, with any children, after timeout seconds, which
+    defaults to snap_timeout_seconds.
+
+    Returns:
+      A lifecycle.SnapResult whose output includes a header line, or None if
+      there is no snap command or the service is not running.
+    """
+    proc = self._get_running_process_if_exists()
+    if not self.snap_cmd or proc is None or proc.status == psutil.STATUS_ZOMBIE:
+      return None
+    if timeout is None:
+      timeout = self.snap_timeout_seconds
+    with protected_file_path.ProtectedFilePath(self._get_pidfile()):
+      snap_env = {'PID': str(proc.pid)}
+      output = ['[{}] Snapshot #{} for {}. Running: {}. Environment: {}\n'.format(
+                time.strftime('%Y-%m-%d %H:%M:%S'), iteration, self.name, self.snap_cmd, snap_env)]
+      exit_code, captured = lifecycle.run_captured(self.snap_cmd, snap_env, timeout)
+    output.append(captured)
+    if exit_code is None:
+      output.append('Snapshot #{} for {} killed after {}s. Process {} may be hung.\n'.format(
+                    iteration, self.name, timeout, proc.pid))
+    elif exit_code != 0:
+      output.append('Snapshot #{} for {} failed. Process {} may be hung.\n'.format(
                     iteration, self.name, proc.pid))
-    if output is not None:
-      out.close()
+    return lifecycle.SnapResult(self.name, proc.pid, exit_code, ''.join(output))
+
+  def sample(self):
+    """Return a samplestore.Sample of the running service, or None."""
+    proc = self._get_running_process_if_exists()
+    if proc is None or proc.status == psutil.STATUS_ZOMBIE:
+      return None
+    return self.sample_process(proc, time.time())
+
+  def sample_process(self, proc, timestamp):
+    """Return a samplestore.Sample read from the service's cgroup, or summed over proc's tree."""
+    if self._get_cgroup_pids(proc) is not None:
+      return samplestore.sample_cgroup(self.cgroup_path, proc.pid, timestamp)
+    return samplestore.sample_process(proc, timestamp)
+
+  def stop(self, progress=None):
+    """Stop the service with its stop command, then SIGTERM, then SIGKILL, as configured.
+
+    Services started in their own process group are signalled as a group, and
+    each wait lasts until every member of the group has exited. Otherwise only
+    the process in the pid file is signalled and waited for. Each wait ends as
+    soon as the processes exit.
+
+    Args:
+      progress: Optional function called with progress text.
 
-  def stop(self):
-    """Stop the service."""
+    Returns:
+      A lifecycle.StopResult. Its stopped_by is 'stop command', 'SIGTERM' or
+      'SIGKILL', or None if the service was not running.
+
+    Raises:
+      lifecycle.StopError: The process was still running after every method.
+    """
+    progress = progress if progress is not None else _ignore_progress
     proc = self._get_running_process_if_exists(delete_stale_pidfiles=True)
     pidfile_name = self._get_pidfile()
-    proc_stopped = False
-    if proc is not None:
-      self._ensure_stdout_dirs_exist()
-      sys.stdout.write('Stopping {}: '.format(self.name))
-      sys.stdout.flush()
-      with protected_file_path.ProtectedFilePath(pidfile_name):
-        with open(self.stdout, 'a') as stdout:
-          if self.stop_cmd:
-            sys.stdout.write('running stop command')
-            stdout.write('[{}] {} stopping {}:\n{}\n'.format(
-                         time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name,
-                         self.name, ' '.join(self.stop_cmd)))
-            stdout.flush()
-            # pylint: disable=unused-variable
-            stop_proc = psutil.Popen(args=self.stop_cmd,
-                                     stdout=stdout,
-                                     stderr=stdout,
-                                     env=self.env,
-                                     cwd=self.cwd)
-            proc_stopped = wait_dots(self.after_stop_cmd_seconds, proc)
-          if self.run_sigterm and not proc_stopped:
-            sys.stdout.write('sending SIGTERM')
-            sys.stdout.flush()
-            stdout.write('[{}] {} sending SIGTERM to {}\n'.format(
-                         time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name, self.name))
-            stdout.flush()
-            try:
-              proc.terminate()
-            except psutil.error.NoSuchProcess:
-              pass
-            proc_stopped = wait_dots(self.after_sigterm_seconds, proc)
-          if self.run_sigkill and not proc_stopped:
-            sys.stdout.write('sending SIGKILL')
-            sys.stdout.flush()
-            stdout.write('[{}] {} sending SIGKILL to {}\n'.format(
-                         time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name, self.name))
-            stdout.flush()
-            try:
-              proc.kill()
-            except psutil.error.NoSuchProcess:
-              pass
-            proc_stopped = wait_dots(self.after_sigkill_seconds, proc)
-          if not proc_stopped:
-            puts(colored.red('process still running ({}).'.format(proc.pid)))
-            stdout.write('[{}] {} process still running({})\n'.format(
-                         time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name, proc.pid))
-            stdout.flush()
-            sys.exit(1)
-          else:
-            if not self._is_externally_managed_process():
-              os.remove(self.pid_file)
-            puts(colored.green('stopped'))
-            stdout.write('[{}] {} stopped process ({})\n'.format(
-                         time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name, proc.pid))
+    if proc is None:
+      return lifecycle.StopResult(self.name, None, None, 0.0)
+    tick = lambda: progress('.')
+    pgid = self._get_process_group()
+    if pgid is not None:
+      wait = lambda seconds: lifecycle.wait_for_group_exit(pgid, seconds, tick)
+      terminate = lambda: lifecycle.signal_group(pgid, signal.SIGTERM)
+      kill = lambda: lifecycle.signal_group(pgid, signal.SIGKILL)
+      target = 'process group {}'.format(pgid)
+    else:
+      wait = lambda seconds: lifecycle.wait_for_exit(proc, seconds, tick)
+      terminate, kill = proc.terminate, proc.kill
+      target = 'process {}'.format(proc.pid)
+    stopped_by = None
+    started = time.time()
+    self._ensure_stdout_dirs_exist()
+    progress('Stopping {}: '.format(self.name))
+    with protected_file_path.ProtectedFilePath(pidfile_name):
+      with open(self.stdout, 'a') as stdout:
+        if self.stop_cmd:
+          progress('running stop command')
+          logwriter.append(self.stdout, '[{}] {} stopping {}:\n{}\n'.format(
+              time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name, self.name,
+              ' '.join(self.stop_cmd)))
+          # pylint: disable=unused-variable
+          stop_proc = spawn.popen(args=self.stop_cmd,
+                                  stdout=stdout,
+                                  stderr=stdout,
+                                  env=self.env,
+                                  cwd=self.cwd)
+          if wait(self.after_stop_cmd_seconds):
+            stopped_by = 'stop command'
+        for signal_name, enabled, send, wait_seconds in (
+            ('SIGTERM', self.run_sigterm, terminate, self.after_sigterm_seconds),
+            ('SIGKILL', self.run_sigkill, kill, self.after_sigkill_seconds)):
+          if not enabled or stopped_by is not None:
+            continue
+          progress('sending {}'.format(signal_name))
+          logwriter.append(self.stdout, '[{}] {} sending {} to {}\n'.format(
+              time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name, signal_name, self.name))
+          try:
+            send()
+          except psutil.NoSuchProcess:
+            pass
+          except (OSError, psutil.AccessDenied), err:
+            message = 'cannot send {} to {}: {}'.format(signal_name, target,
+                                                        getattr(err, 'strerror', None) or err)
+            logwriter.append(self.stdout, '[{}] {} {}\n'.format(
+                time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name, message))
+            raise lifecycle.StopError(self.name, message + '.', proc.pid, self.stdout)
+          if wait(wait_seconds):
+            stopped_by = signal_name
+        if stopped_by is None:
+          logwriter.append(self.stdout, '[{}] {} process still running({})\n'.format(
+              time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name, proc.pid))
+          raise lifecycle.StopError(self.name, 'process still running ({}).'.format(proc.pid),
+                                    proc.pid, self.stdout)
+        if not self._is_externally_managed_process():
+          os.remove(self.pid_file)
+        logwriter.append(self.stdout, '[{}] {} stopped process ({})\n'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S'), self.cli_name, proc.pid))
+    seconds = time.time() - started
+    self._record_timing('stop', seconds)
+    return lifecycle.StopResult(self.name, proc.pid, stopped_by, seconds)
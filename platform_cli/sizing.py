@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Suggest memory and CPU sizing properties from the host's resources.
+
+Packagers declare a ServiceSizing per service: relative memory and CPU
+weights, plus the properties derived from the service's share, such as heap
+size, thread pools or GC threads. The host's memory and CPUs are read once,
+taking cgroup limits and CPU affinity into account, and divided across the
+enabled services by weight. The results are config.Suggestion tuples, which
+setup displays like any other suggestion.
+"""
+
+import collections
+import math
+import os
+import psutil
+from . import cgroup, config, proptypes
+
+MIB = 1024 * 1024
+
+# pylint: disable=invalid-name
+HostResources = collections.namedtuple('HostResources', ['memory_bytes', 'cpus'])
+SizedProperty = collections.namedtuple('SizedProperty',
+                                       ['name', 'fraction', 'minimum', 'maximum', 'fmt'])
+
+
+class Error(Exception):
+  """Base exception class for this module."""
+
+
+class ServiceSizing(object):
+  """Declare how a service's share of the host sizes its properties."""
+
+  def __init__(self, service_name, memory_weight=1, cpu_weight=1,
+               memory_properties=None, cpu_properties=None):
+    """Initialize a ServiceSizing.
+
+    Args:
+      service_name: Name of the ServiceProfile; only enabled services get a share.
+      memory_weight: Relative weight of the service's share of memory.
+      cpu_weight: Relative weight of the service's share of CPUs.
+      memory_properties: SizedProperty tuples whose value is the given
+        fraction of the memory share in MiB, e.g. ('foo.max_heap_size', 0.75,
+        256, None, '{}m').
+      cpu_properties: SizedProperty tuples whose value is the given fraction
+        of the CPU share, rounded to whole CPUs.
+    """
+    self.service_name = service_name
+    self.memory_weight = memory_weight
+    self.cpu_weight = cpu_weight
+    self.memory_properties = memory_properties if memory_properties is not None else []
+    self.cpu_properties = cpu_properties if cpu_properties is not None else []
+
+
+def read_host_resources():
+  """Return the HostResources available to this process."""
+  memory_bytes = psutil.virtual_memory().total
+  memory_limit = cgroup.memory_limit()
+  if memory_limit is not None:
+    memory_bytes = min(memory_bytes, memory_limit)
+  cpus = float(psutil.NUM_CPUS)
+  try:
+    cpus = min(cpus, len(psutil.Process(os.getpid()).get_cpu_affinity()))
+  except (AttributeError, psutil.AccessDenied):
+    pass
+  cpu_limit = cgroup.cpu_limit()
+  if cpu_limit is not None:
+    cpus = min(cpus, cpu_limit)
+  return HostResources(memory_bytes, cpus)
+
+
+def _clamp(value, prop):
+  """Apply a SizedProperty's minimum and maximum."""
+  if prop.minimum is not None:
+    value = max(prop.minimum, value)
+  if prop.maximum is not None:
+    value = min(prop.maximum, value)
+  return value
+
+
+def suggest(sizings, template_values, host, reserved_memory_bytes=0):
+  """Divide host resources across the enabled services and size their properties.
+
+  Args:
+    sizings: ServiceSizing declarations.
+    template_values: Active property values, used to find enabled services.
+    host: HostResources, from read_host_resources().
+    reserved_memory_bytes: Memory left out of the division for the OS.
+
+  Returns:
+    A list of config.Suggestion.
+  """
+  enabled = [sizing for sizing in sizings
+             if proptypes.FLAG.parse(
+                 template_values.get('{}.enabled'.format(sizing.service_name), 'false'))]
+  memory_weights = sum(sizing.memory_weight for sizing in enabled)
+  cpu_weights = sum(sizing.cpu_weight for sizing in enabled)
+  memory_mib = max(0, host.memory_bytes - reserved_memory_bytes) // MIB
+  why = ('Sized for this host: {} MiB of memory (after {} MiB reserved) and {:g} CPUs, '
+         'shared by {} enabled service(s).'.format(memory_mib, reserved_memory_bytes // MIB,
+                                                   host.cpus, len(enabled)))
+  suggestions = []
+  for sizing in enabled:
+    memory_share = memory_mib * sizing.memory_weight / float(memory_weights or 1)
+    cpu_share = host.cpus * sizing.cpu_weight / float(cpu_weights or 1)
+    for props, share, round_func in ((sizing.memory_properties, memory_share, math.floor),
+                                     (sizing.cpu_properties, cpu_share, round)):
+      for prop in props:
+        if prop.name not in template_values:
+          raise Error('Sized property {} has no default.'.format(prop.name))
+        value = _clamp(int(round_func(share * prop.fraction)), prop)
+        suggestions.append(config.Suggestion(prop.name, prop.fmt.format(value), why))
+  return suggestions
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Start child processes without paying for the size of the fd table.
+
+subprocess with close_fds=True closes every descriptor number up to the
+nofile limit in the child, one close() each, so spawning costs time
+proportional to the limit: with a limit of 1M that is a million system calls.
+Without close_fds the child inherits whatever the CLI has open, such as
+pid file locks.
+
+popen() instead marks the descriptors the child would inherit close-on-exec
+in the parent, just before forking, in one close_range(CLOSE_RANGE_CLOEXEC)
+call where the kernel supports it (Linux 5.11), or else for just the
+descriptors listed in /proc/self/fd. Nothing extra runs in the child between
+fork and exec. Standard streams given as files are dup2()ed straight onto 0-2,
+which clears the flag on the copies.
+
+Snap commands run on a thread pool and starts can run on scheduler threads,
+so the marking and the fork happen under one module lock. A descriptor that
+another popen() call creates, such as the parent's end of a pipe, is marked
+by the next caller before it forks. Only a descriptor that another thread
+opens outside popen() during that short window can still reach the child.
+"""
+
+import ctypes
+import ctypes.util
+import fcntl
+import os
+import sys
+import threading
+import psutil
+
+SYS_CLOSE_RANGE = 436
+CLOSE_RANGE_CLOEXEC = 1 << 2
+MAX_FD = 0xffffffff
+FIRST_INHERITED_FD = 3
+
+
+def _load_syscall():
+  """Return libc's syscall(), or None off Linux or where it is unavailable."""
+  if not sys.platform.startswith('linux'):
+    return None
+  try:
+    func = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).syscall
+  except (OSError, AttributeError):
+    return None
+  func.restype = ctypes.c_long
+  return func
+
+
+_SYSCALL = _load_syscall()
+_CLOSE_RANGE_WORKS = None
+_SPAWN_LOCK = threading.Lock()
+
+
+def _close_range_cloexec(first_fd):
+  """Mark fds from first_fd up close-on-exec with close_range(). Return True on success."""
+  if _SYSCALL is None:
+    return False
+  return _SYSCALL(ctypes.c_long(SYS_CLOSE_RANGE), ctypes.c_uint(first_fd),
+                  ctypes.c_uint(MAX_FD), ctypes.c_uint(CLOSE_RANGE_CLOEXEC)) == 0
+
+
+def close_range_works():
+  """Return True if close_range(CLOSE_RANGE_CLOEXEC) works here. Probed once."""
+  global _CLOSE_RANGE_WORKS # pylint: disable=global-statement
+  if _CLOSE_RANGE_WORKS is None:
+    # No descriptor is open this high, so the probe changes nothing.
+    _CLOSE_RANGE_WORKS = _close_range_cloexec(MAX_FD - 1)
+  return _CLOSE_RANGE_WORKS
+
+
+def _cloexec_listed(first_fd):
+  """Mark the open fds from first_fd up close-on-exec, listing them in /proc/self/fd."""
+  for name in os.listdir('/proc/self/fd'):
+    fd = int(name)
+    if fd < first_fd:
+      continue
+    try:
+      fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+    except (IOError, OSError):
+      # The descriptor listdir() itself used is already closed.
+      continue
+
+
+def cloexec_method():
+  """Return how popen() keeps descriptors from leaking: 'close_range', 'proc' or 'close_fds'."""
+  if close_range_works():
+    return 'close_range'
+  if os.path.isdir('/proc/self/fd'):
+    return 'proc'
+  return 'close_fds'
+
+
+def popen(args, **kwargs):
+  """Start a psutil.Popen whose child inherits only its standard streams.
+
+  Takes the arguments of subprocess.Popen except close_fds. A preexec_fn is
+  passed through unchanged.
+  """
+  method = cloexec_method()
+  if method == 'close_fds':
+    return psutil.Popen(args, close_fds=True, **kwargs)
+  with _SPAWN_LOCK:
+    if method == 'close_range':
+      _close_range_cloexec(FIRST_INHERITED_FD)
+    else:
+      _cloexec_listed(FIRST_INHERITED_FD)
+    return psutil.Popen(args, close_fds=False, **kwargs)
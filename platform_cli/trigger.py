@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Threshold detection and capture pacing for snap --trigger.
+
+Each service is sampled at a short interval and its recent samples are kept
+for one window. A service crosses its thresholds when its CPU use averaged
+over the window, or its resident memory growth rate over the window, is too
+high, or when its current thread or file descriptor count is. Captures are
+then paced by a per-service cooldown and a cap on captures per hour across
+all services.
+"""
+
+import collections
+
+# pylint: disable=invalid-name
+Thresholds = collections.namedtuple('Thresholds', ['cpu_percent', 'rss_growth_per_second',
+                                                   'threads', 'fds', 'window_seconds'])
+
+
+def is_enabled(thresholds):
+  """Return True if any threshold is set."""
+  return any((thresholds.cpu_percent, thresholds.rss_growth_per_second, thresholds.threads,
+              thresholds.fds))
+
+
+class Detector(object):
+  """Check one service's samples against its Thresholds."""
+
+  def __init__(self, thresholds):
+    self.thresholds = thresholds
+    self.history = collections.deque()
+
+  def reset(self):
+    """Forget the samples seen so far, e.g. because the service stopped."""
+    self.history.clear()
+
+  def check(self, sample, now):
+    """Record a samplestore.Sample taken at monotonic time now.
+
+    Returns:
+      A list of descriptions of the thresholds crossed, empty if none.
+    """
+    thresholds = self.thresholds
+    if self.history and self.history[-1][1].pid != sample.pid:
+      self.reset()
+    self.history.append((now, sample))
+    while len(self.history) > 1 and self.history[1][0] <= now - thresholds.window_seconds:
+      self.history.popleft()
+    reasons = []
+    oldest_time, oldest = self.history[0]
+    elapsed = now - oldest_time
+    # Rates are only judged once the samples span a whole window.
+    if elapsed >= thresholds.window_seconds and elapsed > 0:
+      cpu_percent = 100.0 * (sample.cpu_seconds - oldest.cpu_seconds) / elapsed
+      if thresholds.cpu_percent and cpu_percent >= thresholds.cpu_percent:
+        reasons.append('CPU {:.0f}% over {:g}s'.format(cpu_percent, elapsed))
+      rss_growth = (sample.rss - oldest.rss) / elapsed
+      if thresholds.rss_growth_per_second and rss_growth >= thresholds.rss_growth_per_second:
+        reasons.append('RSS growing {:.0f} bytes/s over {:g}s'.format(rss_growth, elapsed))
+    if thresholds.threads and sample.threads >= thresholds.threads:
+      reasons.append('{} threads'.format(sample.threads))
+    if thresholds.fds and sample.fds >= thresholds.fds:
+      reasons.append('{} open fds'.format(sample.fds))
+    return reasons
+
+
+class CaptureLimiter(object):
+  """Allow captures after a per-service cooldown, up to a cap per hour overall."""
+
+  def __init__(self, cooldown_seconds, max_per_hour):
+    self.cooldown_seconds = cooldown_seconds
+    self.max_per_hour = max_per_hour
+    self.last_capture = {}
+    self.captures = collections.deque()
+
+  def allow(self, name, now):
+    """Return True, and count a capture, if name may be captured at monotonic time now."""
+    while self.captures and self.captures[0] <= now - 3600:
+      self.captures.popleft()
+    last = self.last_capture.get(name)
+    if last is not None and now - last < self.cooldown_seconds:
+      return False
+    if len(self.captures) >= self.max_per_hour:
+      return False
+    self.last_capture[name] = now
+    self.captures.append(now)
+    return True
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+"""Crash detection and restart pacing for the watch subcommand.
+
+Services started by the watcher are its children, so their exits are
+collected with waitpid() along with the exit status. Services that were
+already running are checked against one listing of the process table per
+scan, and count as exited while they wait as zombies to be reaped by init.
+Restarts of a crashing service back off exponentially, and a service that
+crashes more often than its restart budget allows is given up on.
+"""
+
+import collections
+import errno
+import os
+import psutil
+
+TAIL_LINES = 20
+TAIL_MAX_BYTES = 64 * 1024
+
+
+class RestartBudget(object):
+  """Track crashes per service within a sliding window and pace restarts."""
+
+  def __init__(self, budget, window_seconds, base_seconds, max_seconds):
+    self.budget = budget
+    self.window_seconds = window_seconds
+    self.base_seconds = base_seconds
+    self.max_seconds = max_seconds
+    self.crashes = collections.defaultdict(collections.deque)
+
+  def record_crash(self, name, now):
+    """Record a crash at time now. Return the restart delay, or None if over budget.
+
+    The delay doubles with every crash still in the window, from base_seconds
+    up to max_seconds.
+    """
+    crashes = self.crashes[name]
+    crashes.append(now)
+    while crashes and crashes[0] <= now - self.window_seconds:
+      crashes.popleft()
+    if len(crashes) > self.budget:
+      return None
+    return min(self.max_seconds, self.base_seconds * 2 ** (len(crashes) - 1))
+
+
+def reap_children():
+  """Collect every exited child without blocking. Return a dict of pid to wait status."""
+  statuses = {}
+  while True:
+    try:
+      pid, status = os.waitpid(-1, os.WNOHANG)
+    except OSError, err:
+      if err.errno == errno.EINTR:
+        continue
+      break
+    if pid == 0:
+      break
+    statuses[pid] = status
+  return statuses
+
+
+def live_pids():
+  """Return the set of pids in the process table."""
+  return set(psutil.get_pid_list())
+
+
+def is_zombie(pid):
+  """Return True if pid has exited but has not been reaped by its parent yet."""
+  try:
+    return psutil.Process(pid).status == psutil.STATUS_ZOMBIE
+  except (psutil.NoSuchProcess, psutil.AccessDenied):
+    return False
+
+
+def describe_exit(status):
+  """Describe a wait status, or an exit whose status is unknown if status is None."""
+  if status is None:
+    return 'exited (not started by this watcher, so its status is unknown)'
+  if os.WIFSIGNALED(status):
+    return 'was killed by signal {}'.format(os.WTERMSIG(status))
+  return 'exited with status {}'.format(os.WEXITSTATUS(status))
+
+
+def tail(path, lines=TAIL_LINES, max_bytes=TAIL_MAX_BYTES):
+  """Return up to the last lines lines of a file, reading at most max_bytes."""
+  try:
+    with open(path, 'rb') as tail_file:
+      tail_file.seek(0, os.SEEK_END)
+      size = tail_file.tell()
+      tail_file.seek(max(0, size - max_bytes))
+      data = tail_file.read()
+  except IOError:
+    return ''
+  return ''.join(data.splitlines(True)[-lines:])
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from platform_cli import cgroup, samplestore
+
+
+class TestCgroup(unittest.TestCase):
+
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.parent = os.path.join(self.root, 'platform')
+    self.path = cgroup.service_path('/platform/', 'fooservice', self.root)
+    os.makedirs(self.path)
+    self.write('cgroup.controllers', 'cpuset cpu io memory pids\n', self.root)
+    self.write('cgroup.subtree_control', 'memory\n', self.parent)
+    self.write('cgroup.procs', '')
+
+  def tearDown(self):
+    shutil.rmtree(self.root)
+
+  def write(self, name, contents, directory=None):
+    with open(os.path.join(directory or self.path, name), 'w') as cgroup_file:
+      cgroup_file.write(contents)
+
+  def read(self, name, directory=None):
+    with open(os.path.join(directory or self.path, name), 'r') as cgroup_file:
+      return cgroup_file.read()
+
+  def testLimitFiles(self):
+    self.assertEqual(cgroup.limit_files(512 * 1024 * 1024, 1.5, 200),
+                     {'memory.max': '536870912', 'cpu.max': '150000 100000',
+                      'io.weight': 'default 200'})
+    self.assertEqual(cgroup.limit_files(), cgroup.UNLIMITED)
+
+  def testPrepare(self):
+    cgroup.prepare(self.path, cgroup.limit_files(1024, 2), self.root)
+    self.assertEqual(self.read('memory.max'), '1024')
+    self.assertEqual(self.read('cpu.max'), '200000 100000')
+    self.assertEqual(self.read('cgroup.subtree_control', self.parent), '+cpu')
+    self.assertFalse(os.path.exists(os.path.join(self.path, 'io.weight')))
+
+  def testPrepareResetsRemovedLimits(self):
+    cgroup.prepare(self.path, cgroup.limit_files(1024, 2, 200), self.root)
+    cgroup.prepare(self.path, cgroup.limit_files(cpu_max=1), self.root)
+    self.assertEqual(self.read('memory.max'), 'max')
+    self.assertEqual(self.read('cpu.max'), '100000 100000')
+    self.assertEqual(self.read('io.weight'), 'default 100')
+
+  def testPrepareRequiresCgroupV2(self):
+    os.remove(os.path.join(self.root, 'cgroup.controllers'))
+    self.assertRaises(cgroup.Error, cgroup.prepare, self.path, {}, self.root)
+    self.assertRaises(cgroup.Error, cgroup.prepare,
+                      cgroup.service_path('missing', 'fooservice', self.root), {}, self.root)
+
+  def testReadAccounting(self):
+    self.write('cgroup.procs', '{}\n'.format(os.getpid()))
+    self.write('cgroup.threads', '{}\n12345\n'.format(os.getpid()))
+    self.write('memory.current', '4096\n')
+    self.write('cpu.stat', 'usage_usec 2500000\nuser_usec 2000000\nsystem_usec 500000\n')
+    self.write('io.stat', '8:0 rbytes=100 wbytes=20 rios=1 wios=1\n8:16 rbytes=1 wbytes=2\n')
+    self.assertEqual(cgroup.procs(self.path), [os.getpid()])
+    self.assertEqual(cgroup.thread_count(self.path), 2)
+    self.assertEqual(cgroup.memory_current(self.path), 4096)
+    self.assertEqual(cgroup.cpu_seconds(self.path), 2.5)
+    self.assertEqual(cgroup.io_bytes(self.path), (101, 22))
+    sample = samplestore.sample_cgroup(self.path, os.getpid(), 10.0)
+    self.assertEqual((sample.pid, sample.cpu_seconds, sample.rss, sample.threads,
+                      sample.read_bytes, sample.write_bytes),
+                     (os.getpid(), 2.5, 4096, 2, 101, 22))
+    self.assertTrue(sample.fds > 0)
+
+  def testJoinFailsQuietly(self):
+    self.assertFalse(cgroup.join(os.path.join(self.root, 'missing')))
+
+
+if __name__ == '__main__':
+  unittest.main()
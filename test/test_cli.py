@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import argparse
+import collections
+import mock
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from platform_cli import cli, config, lifecycle, service, sizing
+
+
+def make_cli(services):
+  """Build a CLI around stub services without reading any config."""
+  platform_cli = cli.CLI.__new__(cli.CLI)
+  platform_cli.progname = 'test'
+  platform_cli.template_values = {}
+  platform_cli.typed_values = {}
+  platform_cli.services_by_name = collections.OrderedDict((srv.name, srv) for srv in services)
+  return platform_cli
+
+
+def make_service(name, priority=0, calls=None, stop_fails=False, start_fails=False,
+                 ready=True):
+  """Build a stub ServiceProfile that records its lifecycle calls."""
+  calls = calls if calls is not None else []
+  service = mock.MagicMock(priority=priority, tags=[], enabled=True, ready_timeout_seconds=1)
+  service.name = name
+
+  def stop(_):
+    calls.append(('stop', name))
+    if stop_fails:
+      raise lifecycle.StopError(name, '{} did not stop.'.format(name))
+    return lifecycle.StopResult(name, 1, 'SIGTERM', 0)
+
+  def start(_):
+    calls.append(('start', name))
+    if start_fails:
+      raise lifecycle.StartError(name, '{} did not start.'.format(name))
+    return lifecycle.StartResult(name, 1, False, 0)
+
+  def wait_until_ready():
+    calls.append(('ready', name))
+    return ready
+
+  service.stop.side_effect = stop
+  service.start.side_effect = start
+  service.wait_until_ready.side_effect = wait_until_ready
+  return service
+
+
+def rolling_args(continue_on_failure=False, max_unavailable=1):
+  return argparse.Namespace(service_names=[], tags=[], skip_setup=True, group_by='priority',
+                            max_unavailable=max_unavailable,
+                            continue_on_failure=continue_on_failure)
+
+
+class TestRollingRestart(unittest.TestCase):
+
+  def setUp(self):
+    patcher = mock.patch('platform_cli.cli.puts')
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    patcher = mock.patch('sys.stdout')
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def testBatchesAreStoppedStartedAndWaitedOnTogether(self):
+    calls = []
+    services = [make_service(name, calls=calls) for name in ('a', 'b', 'c')]
+    make_cli(services).rolling_restart(rolling_args(max_unavailable=2))
+    self.assertEqual(calls, [('stop', 'a'), ('stop', 'b'), ('start', 'a'), ('start', 'b'),
+                             ('ready', 'a'), ('ready', 'b'),
+                             ('stop', 'c'), ('start', 'c'), ('ready', 'c')])
+
+  def testFailedStopSkipsStartAndAborts(self):
+    calls = []
+    services = [make_service('a', calls=calls, stop_fails=True), make_service('b', calls=calls)]
+    self.assertRaises(SystemExit, make_cli(services).rolling_restart, rolling_args())
+    self.assertEqual(calls, [('stop', 'a')])
+
+  def testFailedStartAborts(self):
+    calls = []
+    services = [make_service('a', calls=calls, start_fails=True), make_service('b', calls=calls)]
+    self.assertRaises(SystemExit, make_cli(services).rolling_restart, rolling_args())
+    self.assertEqual(calls, [('stop', 'a'), ('start', 'a')])
+
+  def testContinueOnFailureRestartsTheRestThenFails(self):
+    calls = []
+    services = [make_service('a', calls=calls, stop_fails=True),
+                make_service('b', calls=calls, ready=False),
+                make_service('c', calls=calls)]
+    self.assertRaises(SystemExit, make_cli(services).rolling_restart,
+                      rolling_args(continue_on_failure=True))
+    self.assertEqual(calls, [('stop', 'a'),
+                             ('stop', 'b'), ('start', 'b'), ('ready', 'b'),
+                             ('stop', 'c'), ('start', 'c'), ('ready', 'c')])
+
+
+class TestSelectServices(unittest.TestCase):
+
+  def setUp(self):
+    services = [make_service(name) for name in ('web1', 'web2', 'db', 'cache')]
+    services[0].tags = ['frontend']
+    services[1].tags = ['frontend']
+    services[1].enabled = False
+    services[2].tags = ['storage']
+    services[3].enabled = False
+    self.platform_cli = make_cli(services)
+
+  def select(self, names=(), tags=(), enabled_only=False):
+    args = argparse.Namespace(service_names=list(names), tags=list(tags))
+    return [srv.name for srv in self.platform_cli._select_services(args, enabled_only)]
+
+  def testWithoutSelectors(self):
+    self.assertEqual(self.select(), ['web1', 'web2', 'db', 'cache'])
+    self.assertEqual(self.select(enabled_only=True), ['web1', 'db'])
+
+  def testExactNamesIncludeDisabledServices(self):
+    self.assertEqual(self.select(['cache', 'web1'], enabled_only=True), ['web1', 'cache'])
+
+  def testGlobs(self):
+    self.assertEqual(self.select(['web*']), ['web1', 'web2'])
+    self.assertEqual(self.select(['web*', 'd?'], enabled_only=True), ['web1', 'db'])
+    self.assertEqual(self.select(['cach[e]'], enabled_only=True), [])
+
+  def testTags(self):
+    self.assertEqual(self.select(tags=['frontend']), ['web1', 'web2'])
+    self.assertEqual(self.select(['cache'], ['frontend'], enabled_only=True), ['web1', 'cache'])
+
+  def testUnknownSelectorsExit(self):
+    self.assertRaises(SystemExit, self.select, ['nosuch'])
+    self.assertRaises(SystemExit, self.select, ['x*'])
+    self.assertRaises(SystemExit, self.select, tags=['nosuch'])
+
+
+class TestFanout(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.overrides_path = os.path.join(self.tmpdir, 'overrides.properties')
+    defaults = [config.Default('main.home', self.tmpdir, None)]
+    docs = [config.Doc('main.home', 'Home directory.')]
+    self.cli = cli.CLI('test', self.overrides_path, defaults, [], docs, [], {})
+    self.parser = argparse.ArgumentParser()
+    self.cli.add_subcommands(self.parser.add_subparsers())
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def testFanoutPassesEverySnapOption(self):
+    args = self.parser.parse_args(['fanout', 'snap', self.overrides_path])
+    run_inline = lambda targets, func, processes: [func(target) for target in targets] and []
+    with mock.patch.object(cli.CLI, 'snap') as snap_mock, \
+        mock.patch('platform_cli.fanout.run', side_effect=run_inline), \
+        mock.patch('platform_cli.cli.puts'):
+      args.func(args)
+    op_args = snap_mock.call_args[0][0]
+    self.assertEqual((op_args.service_names, op_args.prom, op_args.trigger), ([], None, False))
+    self.assertEqual((op_args.count, op_args.timeout), (None, None))
+
+
+class TestSetupSteps(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.overrides_path = os.path.join(self.tmpdir, 'overrides.properties')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def make_cli(self, defaults, service_sizings=None, service_profiles=None):
+    defaults = [config.Default('main.home', self.tmpdir, None),
+                config.Default('main.pidfile_dir', self.tmpdir, None),
+                config.Default('main.start_wait_seconds', '1', None)] + defaults
+    docs = [config.Doc(default.name, 'Documented.') for default in defaults]
+    return cli.CLI('test', self.overrides_path, defaults, [], docs, service_profiles or [], {},
+                   service_sizings)
+
+  def make_service_cli(self, port):
+    profile = service.ServiceProfile('test', 'fooservice', 'fooservice', ['/bin/true'],
+                                     ports_tmpl=['{{fooservice.port}}'])
+    defaults = [config.Default('fooservice.enabled', 'True', None),
+                config.Default('fooservice.priority', '0', None),
+                config.Default('fooservice.stdout', os.path.join(self.tmpdir, 'foo.out'), None),
+                config.Default('fooservice.port', port, None)]
+    platform_cli = self.make_cli(defaults, service_profiles=[profile])
+    return platform_cli, platform_cli.services_by_name.values()
+
+  def testMalformedPortIsASetupStep(self):
+    platform_cli, services = self.make_service_cli('80x')
+    self.assertEqual(services[0].ports, [])
+    steps = platform_cli._get_setup_steps(services)
+    self.assertEqual(steps['Fix the properties that set these service ports:'],
+                     ['fooservice port "80x" from {{fooservice.port}} is not a TCP port number.'])
+
+  def testTakenPortIsASetupStep(self):
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    try:
+      port = listener.getsockname()[1]
+      platform_cli, services = self.make_service_cli(str(port))
+      steps = platform_cli._get_setup_steps(services)
+    finally:
+      listener.close()
+    conflicts = steps['Stop the processes holding ports needed by services that are not running:']
+    self.assertEqual(len(conflicts), 1)
+    self.assertTrue(conflicts[0].startswith('port {} for fooservice is held by '.format(port)))
+    self.assertTrue(conflicts[0].endswith('(pid {})'.format(os.getpid())))
+
+  def testBadSizingDeclarationIsASetupStep(self):
+    sizings = [sizing.ServiceSizing('fooservice', memory_properties=[
+        sizing.SizedProperty('fooservice.max_heap_size', 0.5, 256, None, '{}m')])]
+    platform_cli = self.make_cli([config.Default('fooservice.enabled', 'True', None)], sizings)
+    steps = platform_cli._get_setup_steps([])
+    self.assertTrue(any('fooservice.max_heap_size has no default' in title for title in steps))
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from platform_cli import completion
+
+
+class TestCompletion(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.path = completion.index_path(os.path.join(self.tempdir, 'overrides.properties'))
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def testBuildIndex(self):
+    body = completion.build_index([('start', 'service'), ('doc', None)], ['fooservice'],
+                                  ['search'], ['main.home'])
+    self.assertEqual(body, 'command start service\ncommand doc -\nservice fooservice\n'
+                           'tag search\nproperty main.home\n')
+
+  def testRefreshIndexOnlyWritesChanges(self):
+    self.assertTrue(completion.refresh_index(self.path, 'service fooservice\n'))
+    self.assertFalse(completion.refresh_index(self.path, 'service fooservice\n'))
+    self.assertTrue(completion.refresh_index(self.path, 'service barservice\n'))
+    with open(self.path) as index_file:
+      self.assertEqual(index_file.readlines()[1:], ['service barservice\n'])
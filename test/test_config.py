@@ -4,11 +4,13 @@
 import logging
 import mock
 import os
+import shutil
 import StringIO
 import sys
+import tempfile
 import unittest
 
-from platform_cli import config, protected_file_path
+from platform_cli import config, journal, props, proptypes, protected_file_path
 
 
 def get_mock_open_func(file_contents_map=None, exceptions_map=None):
@@ -40,7 +42,7 @@ class TestConfig(unittest.TestCase):
     self.logger.setLevel(logging.DEBUG)
 
   def testGetActiveValuesAndMetadata(self):
-    """Mock the get_overrides func and just test logic."""
+    """Mock the get_layered_overrides func and just test logic."""
     defaults = [
         config.Default('main.home', '/opt/myplatform'),
         config.Default('fooservice.home', '{{main.home}}/fooservice'),
@@ -80,8 +82,8 @@ class TestConfig(unittest.TestCase):
     overrides_mock = mock.MagicMock()
     config_cli = config.Config('test.properties',
                                defaults=defaults, suggestions=suggestions)
-    config_cli.get_overrides = mock.MagicMock()
-    config_cli.get_overrides.return_value = overrides
+    config_cli.get_layered_overrides = mock.MagicMock()
+    config_cli.get_layered_overrides.return_value = (overrides, {})
     active_values, diff_suggestions, diff_defaults = config_cli.get_active_values_and_metadata()
 
 
@@ -123,3 +125,113 @@ class TestConfig(unittest.TestCase):
       self.logger.debug('{} == {}'.format(config_items, properties_expected))
       self.assertTrue(set(config_items) == set(properties_expected))
       
+
+  def testGetDocsIndex(self):
+    defaults = [
+        config.Default('fooservice.home', '/opt/fooservice'),
+        config.Default('main.home', '/opt/myplatform'),
+        config.Default('barservice.max_heap_size', '1024'),
+    ]
+    docs = [config.Doc(default.name, 'Doc for {}.'.format(default.name)) for default in defaults]
+    tempdir = tempfile.mkdtemp()
+    try:
+      conf = config.Config(os.path.join(tempdir, 'test.properties'), defaults=defaults, docs=docs)
+      docs_index = conf.get_docs_index()
+      self.assertEqual([category for category, _ in docs_index],
+                       ['main', 'barservice', 'fooservice'])
+      self.assertEqual(docs_index[0][1], [
+          config.DocEntry('main.home', 'main', 'Doc for main.home.', ('Doc for main.home.',),
+                          '/opt/myplatform')])
+      with mock.patch('platform_cli.config.validate_and_map_by_name') as validate_mock:
+        self.assertEqual(conf.get_docs_index(), docs_index)
+        self.assertFalse(validate_mock.called)
+      cached = config.Config(os.path.join(tempdir, 'test.properties'), defaults=defaults, docs=docs)
+      with mock.patch('textwrap.wrap') as wrap_mock:
+        self.assertEqual(cached.get_docs_index(), docs_index)
+        self.assertFalse(wrap_mock.called)
+    finally:
+      shutil.rmtree(tempdir)
+
+  def testGetTypedValues(self):
+    defaults = [
+        config.Default('main.home', '/opt/myplatform', proptypes.PATH),
+        config.Default('fooservice.threads', '4', proptypes.INT),
+        config.Default('fooservice.timeout', '30s', proptypes.DURATION),
+        config.Default('fooservice.name', 'foo'),
+    ]
+    conf = config.Config('test.properties', defaults=defaults)
+    typed_values, invalid = conf.get_typed_values({'main.home': '/opt/apps/myplatform/',
+                                                   'fooservice.threads': 'four',
+                                                   'fooservice.timeout': '2m',
+                                                   'fooservice.name': 'foo'})
+    self.assertEqual(typed_values, {'main.home': '/opt/apps/myplatform',
+                                    'fooservice.threads': 4,
+                                    'fooservice.timeout': 120.0})
+    self.assertEqual(invalid.keys(), ['fooservice.threads'])
+
+  def testSetVarRejectsMalformedValue(self):
+    defaults = [config.Default('fooservice.threads', '4', proptypes.INT)]
+    conf = config.Config('test.properties', defaults=defaults)
+    conf.set_override = mock.MagicMock()
+    conf.get_layered_overrides = mock.MagicMock(return_value=([], {}))
+    args = mock.MagicMock(property_name='fooservice.threads', property_value='four')
+    with mock.patch('platform_cli.config.puts'):
+      self.assertRaises(SystemExit, conf.set_var, args)
+    self.assertFalse(conf.set_override.called)
+    args.property_value = '8'
+    conf.set_var(args)
+    conf.set_override.assert_called_once_with('fooservice.threads', '8')
+
+  def testGetLayeredOverrides(self):
+    tempdir = tempfile.mkdtemp()
+    try:
+      config_path = os.path.join(tempdir, 'test.properties')
+      with open(config_path, 'w') as main_file:
+        main_file.write('foo.first = main\nfoo.second = main\nfoo.third = main\n')
+      os.mkdir(config_path + '.d')
+      for name, contents in (('20-b.properties', 'foo.second = b\n'),
+                             ('10-a.properties', 'foo.first = a\nfoo.second = a\n'),
+                             ('ignored.txt', 'foo.third = ignored\n')):
+        with open(os.path.join(config_path + '.d', name), 'w') as fragment:
+          fragment.write(contents)
+      conf = config.Config(config_path)
+      overrides, sources = conf.get_layered_overrides()
+      self.assertEqual(overrides, [config.Override('foo.first', 'a'),
+                                   config.Override('foo.second', 'b'),
+                                   config.Override('foo.third', 'main')])
+      self.assertEqual(sources['foo.second'], os.path.join(config_path + '.d', '20-b.properties'))
+      self.assertEqual(sources['foo.third'], config_path)
+
+      with mock.patch('platform_cli.props.get_items') as get_items_mock:
+        self.assertEqual(config.Config(config_path).get_layered_overrides(), (overrides, sources))
+        self.assertFalse(get_items_mock.called)
+      os.remove(os.path.join(config_path + '.d', '20-b.properties'))
+      overrides, _ = config.Config(config_path).get_layered_overrides()
+      self.assertEqual(overrides[1], config.Override('foo.second', 'a'))
+    finally:
+      shutil.rmtree(tempdir)
+
+  def testOverrideChangesAreJournaledFirst(self):
+    tempdir = tempfile.mkdtemp()
+    try:
+      config_path = os.path.join(tempdir, 'test.properties')
+      defaults = [config.Default('foo.threads', '4', None)]
+      conf = config.Config(config_path, defaults=defaults)
+      conf.set_override('foo.threads', '8')
+      conf.set_override('foo.threads', '8')
+      self.assertEqual([(entry.key, entry.old, entry.new)
+                        for entry in journal.read(journal.journal_path(config_path))],
+                       [('foo.threads', None, '8')])
+
+      os.remove(journal.journal_path(config_path))
+      os.mkdir(journal.journal_path(config_path))
+      self.assertRaises(journal.Error, conf.set_override, 'foo.threads', '16')
+      self.assertRaises(journal.Error, conf.delete_override, 'foo.threads')
+      self.assertEqual(props.get_items(config_path), [('foo.threads', '8')])
+      args = mock.MagicMock(property_name='foo.threads', property_value='16')
+      with mock.patch('platform_cli.config.puts'):
+        self.assertRaises(SystemExit, conf.set_var, args)
+        self.assertRaises(SystemExit, conf.delete_var, args)
+      self.assertEqual(props.get_items(config_path), [('foo.threads', '8')])
+    finally:
+      shutil.rmtree(tempdir)
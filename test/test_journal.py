@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from platform_cli import journal
+
+
+class TestJournal(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.path = journal.journal_path(os.path.join(self.tempdir, 'overrides.properties'))
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def testAppendAndRead(self):
+    journal.append(self.path, journal.JournalEntry(1.5, 'alice', 'main.home', None, '/opt'))
+    journal.append(self.path, journal.JournalEntry(2.5, 'bob', 'main.home', '/opt', None))
+    with open(self.path, 'a') as journal_file:
+      journal_file.write('{"truncated\n')
+    self.assertEqual(journal.read(self.path),
+                     [journal.JournalEntry(1.5, 'alice', 'main.home', None, '/opt'),
+                      journal.JournalEntry(2.5, 'bob', 'main.home', '/opt', None)])
+
+  def testCompactionKeepsNewestEntries(self):
+    for number in range(100):
+      journal.append(self.path, journal.JournalEntry(number, 'alice', 'key', None, str(number)),
+                     max_bytes=2000)
+    self.assertTrue(os.path.getsize(self.path) <= 2000)
+    entries = journal.read(self.path)
+    self.assertEqual(entries[-1].new, '99')
+    self.assertEqual([entry.timestamp for entry in entries], range(100 - len(entries), 100))
+
+  def testReadMissingJournal(self):
+    self.assertEqual(journal.read(self.path), [])
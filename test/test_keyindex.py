@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import cPickle
+import difflib
+import unittest
+
+from platform_cli import keyindex
+
+NAMES = [
+    'main.home',
+    'fooservice.home',
+    'fooservice.max_heap_size',
+    'barservice.max_heap_size',
+    'barservice.foo.endpoint',
+    'barservice.enabled',
+]
+
+
+class TestKeyIndex(unittest.TestCase):
+
+  def setUp(self):
+    self.index = cPickle.loads(cPickle.dumps(keyindex.KeyIndex(NAMES), cPickle.HIGHEST_PROTOCOL))
+
+  def testMembership(self):
+    self.assertTrue('barservice.enabled' in self.index)
+    self.assertFalse('barservice.enable' in self.index)
+    self.assertEqual(len(self.index), len(NAMES))
+
+  def testSuggestMatchesDifflib(self):
+    for key in ('fooservice.max_heap_sise', 'barservice.enabeld', 'main.hom', 'xx'):
+      self.assertEqual(self.index.suggest(key), difflib.get_close_matches(key, NAMES))
+
+  def testSearch(self):
+    self.assertEqual(self.index.search('max_heap'),
+                     ['barservice.max_heap_size', 'fooservice.max_heap_size'])
+    self.assertEqual(self.index.search('barservice.max_haep')[0], 'barservice.max_heap_size')
+
+  def testComplete(self):
+    self.assertEqual(self.index.complete('barservice.'),
+                     ['barservice.enabled', 'barservice.foo.endpoint', 'barservice.max_heap_size'])
+    self.assertEqual(self.index.complete('nothing'), [])
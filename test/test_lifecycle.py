@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import os
+import signal
+import time
+import unittest
+import psutil
+
+from platform_cli import lifecycle, proctable
+
+
+class TestLifecycle(unittest.TestCase):
+
+  def testWaitForExitReturnsWhenProcessExits(self):
+    proc = psutil.Popen(['sleep', '0.1'])
+    started = time.time()
+    self.assertTrue(lifecycle.wait_for_exit(proc, 5))
+    self.assertTrue(time.time() - started < 2)
+
+  def testWaitForExitTimesOut(self):
+    proc = psutil.Popen(['sleep', '5'])
+    ticks = []
+    try:
+      self.assertFalse(lifecycle.wait_for_exit(proc, 1.2, lambda: ticks.append(1)))
+      self.assertEqual(ticks, [1])
+    finally:
+      proc.kill()
+      proc.wait()
+
+  def testLifecycleErrorCarriesDetails(self):
+    err = lifecycle.StartError('fooservice', 'no process found.', 1234, '/var/log/foo.out')
+    self.assertTrue(isinstance(err, lifecycle.Error))
+    self.assertEqual((err.name, err.pid, err.log_path, str(err)),
+                     ('fooservice', 1234, '/var/log/foo.out', 'no process found.'))
+
+  def testRunCapturedKillsProcessGroupOnTimeout(self):
+    started = time.time()
+    exit_code, output = lifecycle.run_captured('echo before; sleep 30; echo after', timeout=0.5)
+    self.assertEqual((exit_code, output), (None, 'before\n'))
+    self.assertTrue(time.time() - started < 5)
+    self.assertEqual(lifecycle.run_captured('echo out; echo err >&2; exit 3'), (3, 'out\nerr\n'))
+
+  @unittest.skipUnless(os.path.isdir('/proc/self'), 'requires /proc')
+  def testSignalAndWaitForWholeGroup(self):
+    proc = psutil.Popen(['sh', '-c', 'sleep 30 & sleep 30 & wait'], preexec_fn=os.setsid)
+    try:
+      deadline = time.time() + 5
+      while len(proctable.group_pids(proc.pid)) < 3 and time.time() < deadline:
+        time.sleep(0.05)
+      self.assertEqual(len(proctable.group_pids(proc.pid)), 3)
+      self.assertFalse(lifecycle.wait_for_group_exit(proc.pid, 0.2))
+      started = time.time()
+      lifecycle.signal_group(proc.pid, signal.SIGTERM)
+      self.assertTrue(lifecycle.wait_for_group_exit(proc.pid, 5))
+      self.assertTrue(time.time() - started < 3)
+      self.assertEqual(proctable.group_pids(proc.pid), [])
+      lifecycle.signal_group(proc.pid, signal.SIGTERM)
+    finally:
+      if proc.is_running():
+        os.killpg(proc.pid, signal.SIGKILL)
+      proc.wait()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import fcntl
+import glob
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from platform_cli import logwriter
+
+
+class TestLogWriter(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmpdir, 'service.out')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def segments(self):
+    return sorted(glob.glob(self.path + '.[0-9]*'))
+
+  def testRotatesBySize(self):
+    writer = logwriter.RotatingWriter(self.path, max_bytes=10, backups=5)
+    writer.write('0123456789')
+    writer.write('abc')
+    writer.close()
+    self.assertEqual(len(self.segments()), 1)
+    with open(self.segments()[0]) as segment:
+      self.assertEqual(segment.read(), '0123456789')
+    with open(self.path) as live:
+      self.assertEqual(live.read(), 'abc')
+    self.assertEqual(writer.rotations, 1)
+
+  def testRotatesByAgeOnlyWhenNotEmpty(self):
+    writer = logwriter.RotatingWriter(self.path, max_seconds=60)
+    with mock.patch('time.time', return_value=writer.opened_at + 61):
+      writer.maybe_rotate()
+      self.assertEqual(writer.rotations, 0)
+      writer.write('old')
+    writer.opened_at -= 61
+    writer.write('new')
+    writer.close()
+    self.assertEqual(writer.rotations, 1)
+    with open(self.path) as live:
+      self.assertEqual(live.read(), 'new')
+
+  def testPrunesOldestSegmentsBeyondBackups(self):
+    for age, name in enumerate(('c', 'b', 'a')):
+      segment = '{}.2013010{}-000000'.format(self.path, age)
+      with open(segment, 'w') as segment_file:
+        segment_file.write(name)
+      os.utime(segment, (1000 - age * 100, 1000 - age * 100))
+    writer = logwriter.RotatingWriter(self.path, max_bytes=1, backups=2)
+    writer.write('x')
+    writer.write('y')
+    writer.close()
+    segments = self.segments()
+    self.assertEqual(len(segments), 2)
+    self.assertFalse(any(segment.endswith('20130102-000000') for segment in segments))
+    self.assertFalse(any(segment.endswith('20130101-000000') for segment in segments))
+
+  def testCompressesRotatedSegments(self):
+    writer = logwriter.RotatingWriter(self.path, max_bytes=1, compress=True)
+    writer.write('x')
+    writer.write('y')
+    writer.close()
+    self.assertEqual([os.path.splitext(segment)[1] for segment in self.segments()], ['.gz'])
+
+  def testAppendedLinesCountTowardMaxBytes(self):
+    writer = logwriter.RotatingWriter(self.path, max_bytes=10)
+    writer.write('01234')
+    writer.flush()
+    logwriter.append(self.path, '56789')
+    writer.write('abc')
+    writer.close()
+    with open(self.segments()[0]) as segment:
+      self.assertEqual(segment.read(), '0123456789')
+    with open(self.path) as live:
+      self.assertEqual(live.read(), 'abc')
+
+  def testAppendWaitingOnRotationLandsInNewFile(self):
+    writer = logwriter.RotatingWriter(self.path, max_bytes=1)
+    writer.write('x')
+    writer.flush()
+    fcntl.flock(writer.file_obj.fileno(), fcntl.LOCK_EX)
+    appender = threading.Thread(target=logwriter.append, args=(self.path, 'cli line\n'))
+    appender.start()
+    time.sleep(0.1)
+    writer.rotate()
+    appender.join()
+    writer.close()
+    with open(self.segments()[0]) as segment:
+      self.assertEqual(segment.read(), 'x')
+    with open(self.path) as live:
+      self.assertEqual(live.read(), 'cli line\n')
+
+  def testQuietServiceRotatesWithoutWrites(self):
+    read_fd, write_fd = os.pipe()
+    writer = logwriter.RotatingWriter(self.path, max_seconds=0.2)
+    pump = logwriter.Pump(read_fd, writer)
+    with mock.patch('platform_cli.logwriter.FLUSH_SECONDS', 0.05):
+      thread = threading.Thread(target=pump.run)
+      thread.start()
+      os.write(write_fd, 'hello\n')
+      deadline = time.time() + 5
+      while not writer.rotations and time.time() < deadline:
+        time.sleep(0.05)
+      rotations = writer.rotations
+      os.close(write_fd)
+      thread.join()
+    os.close(read_fd)
+    self.assertEqual(rotations, 1)
+    with open(self.segments()[0]) as segment:
+      self.assertTrue(segment.read().startswith('hello\n'))
+
+
+if __name__ == '__main__':
+  unittest.main()
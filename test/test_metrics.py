@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import collections
+import unittest
+
+from platform_cli import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+  def testRender(self):
+    families = collections.OrderedDict()
+    metrics.add(families, 'platform_service_up', 'gauge', 'Up.', {'service': 'foo'}, 1)
+    metrics.add(families, 'platform_service_up', 'gauge', 'Up.', {'service': 'b"ar'}, 0)
+    metrics.add(families, 'platform_setup_check_failures', 'gauge', 'Failures.', {}, 2)
+    self.assertEqual(metrics.render(families, {'cli': 'jive'}), '\n'.join([
+        '# HELP platform_service_up Up.',
+        '# TYPE platform_service_up gauge',
+        'platform_service_up{cli="jive",service="foo"} 1.0',
+        'platform_service_up{cli="jive",service="b\\"ar"} 0.0',
+        '# HELP platform_setup_check_failures Failures.',
+        '# TYPE platform_setup_check_failures gauge',
+        'platform_setup_check_failures{cli="jive"} 2.0',
+        '']))
+
+  def testRenderWithoutLabels(self):
+    families = collections.OrderedDict()
+    metrics.add(families, 'platform_cli_metrics_collection_seconds', 'gauge', 'Time.', {}, 0.5)
+    self.assertTrue(metrics.render(families).endswith(
+        '\nplatform_cli_metrics_collection_seconds 0.5\n'))
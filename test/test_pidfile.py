@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from platform_cli import pidfile
+
+
+class TestPidfile(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tempdir, 'fooservice.pid')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def testRoundTrip(self):
+    pidfile.write(self.path, 1234, 5678, 'abcdef')
+    self.assertEqual(pidfile.read(self.path), pidfile.PidfileRecord(1234, 5678, 'abcdef'))
+
+  def testRoundTripWithProcessGroup(self):
+    pidfile.write(self.path, 1234, 5678, 'abcdef', 1234)
+    self.assertEqual(pidfile.read(self.path), pidfile.PidfileRecord(1234, 5678, 'abcdef', 1234))
+
+  def testReadsExternallyManagedPidfile(self):
+    with open(self.path, 'w') as pid_file:
+      pid_file.write('4321\n')
+    record = pidfile.read(self.path)
+    self.assertEqual(record, pidfile.PidfileRecord(4321, None, None))
+    self.assertEqual(pidfile.check_alive(record), None)
+
+  def testGarbageRaisesValueError(self):
+    with open(self.path, 'w') as pid_file:
+      pid_file.write('not a pid\n')
+    self.assertRaises(ValueError, pidfile.read, self.path)
+
+  @unittest.skipUnless(os.path.isdir('/proc/self'), 'requires /proc')
+  def testCheckAlive(self):
+    start_time = pidfile.proc_start_time(os.getpid())
+    self.assertTrue(pidfile.check_alive(pidfile.PidfileRecord(os.getpid(), start_time, None)))
+    self.assertFalse(
+        pidfile.check_alive(pidfile.PidfileRecord(os.getpid(), start_time + 1, None)))
+    self.assertFalse(pidfile.check_alive(pidfile.PidfileRecord(2 ** 22 + 1, start_time, None)))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from platform_cli import prewarm
+
+
+class TestPrewarm(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(self.tmpdir, 'lib', 'sub'))
+    self.files = {}
+    for name, size in (('lib/a.jar', 100), ('lib/sub/b.jar', 50), ('conf.xml', 10)):
+      path = os.path.join(self.tmpdir, name)
+      with open(path, 'wb') as data_file:
+        data_file.write('x' * size)
+      self.files[name] = os.path.realpath(path)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def testExpandPathsWalksDirectoriesOnce(self):
+    files = prewarm.expand_paths([os.path.join(self.tmpdir, 'lib'),
+                                  os.path.join(self.tmpdir, 'lib', '*.jar'),
+                                  os.path.join(self.tmpdir, '*.xml'),
+                                  os.path.join(self.tmpdir, 'missing*')])
+    self.assertEqual(files, [(self.files['lib/a.jar'], 100), (self.files['lib/sub/b.jar'], 50),
+                             (self.files['conf.xml'], 10)])
+
+  def testPlanTrimsToBudget(self):
+    files = [('a', 100), ('b', 50), ('c', 10)]
+    self.assertEqual(prewarm._plan(files, 0), (files, 0))
+    self.assertEqual(prewarm._plan(files, 120), ([('a', 100), ('b', 20)], 40))
+
+  def testPrewarmManyReportsPerPlan(self):
+    reports = prewarm.prewarm_many([('foo', [os.path.join(self.tmpdir, 'lib')], 0),
+                                    ('bar', [os.path.join(self.tmpdir, '*.xml')], 5)], threads=2)
+    self.assertEqual((reports['foo'].files, reports['foo'].bytes, reports['foo'].skipped_bytes),
+                     (2, 150, 0))
+    self.assertEqual((reports['bar'].files, reports['bar'].bytes, reports['bar'].skipped_bytes),
+                     (1, 5, 5))
+    if reports['foo'].resident_bytes is not None:
+      self.assertTrue(0 <= reports['foo'].resident_bytes <= 150)
+
+  def testReadFallbackWithoutLibc(self):
+    with mock.patch('platform_cli.prewarm._LIBC', None):
+      report = prewarm.prewarm([os.path.join(self.tmpdir, 'lib')])
+    self.assertEqual((report.files, report.bytes, report.resident_bytes), (2, 150, None))
+
+  def testFormatBytes(self):
+    self.assertEqual(prewarm.format_bytes(512), '512.0 B')
+    self.assertEqual(prewarm.format_bytes(3 * 1024 * 1024), '3.0 MB')
+    self.assertEqual(prewarm.format_bytes(5 * 1024 ** 3), '5.0 GB')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import mock
+import os
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import unittest
+
+from platform_cli import proctable
+
+TCP_HEADER = ('  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  '
+              'timeout inode\n')
+TCP_LINE = ('   {}: {}:{:04X} 00000000:0000 {} 00000000:00000000 00:00000000 00000000  1000  '
+            '      0 {} 1 0000000000000000 100 0 0 10 0\n')
+
+
+def proc_net_address(ip):
+  """Format an address the way the kernel does: each word of it as a host-order integer."""
+  family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+  packed = socket.inet_pton(family, ip)
+  words = struct.unpack('={}I'.format(len(packed) // 4), packed)
+  return ''.join('{:08X}'.format(word) for word in words)
+
+
+class TestProctable(unittest.TestCase):
+
+  def setUp(self):
+    entry = proctable.ProcEntry
+    self.table = dict((proc.pid, proc) for proc in (
+        entry(1, 0, 1, 1, False),
+        entry(100, 1, 100, 100, False),    # group leader
+        entry(101, 100, 100, 100, False),  # member
+        entry(102, 100, 100, 100, True),   # zombie member
+        entry(103, 101, 103, 103, False),  # child that called setsid()
+        entry(104, 103, 103, 103, False),  # its child
+        entry(105, 1, 105, 100, False),    # reparented after setpgid()
+        entry(200, 1, 200, 200, False),    # unrelated
+    ))
+
+  def testGroupPids(self):
+    self.assertEqual(proctable.group_pids(100, self.table), [100, 101])
+
+  def testEscapedPids(self):
+    self.assertEqual(proctable.escaped_pids(100, self.table), [103, 104, 105])
+    self.assertEqual(proctable.escaped_pids(200, self.table), [])
+
+  def testFindPortOwners(self):
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    try:
+      port = listener.getsockname()[1]
+      owners = proctable.find_port_owners([port, 1])
+    finally:
+      listener.close()
+    self.assertEqual(owners.keys(), [port])
+    self.assertEqual(owners[port].pid, os.getpid())
+    self.assertEqual(proctable.find_port_owners([]), {})
+
+  def testListeningSocketsFromProcNetFiles(self):
+    tempdir = tempfile.mkdtemp()
+    paths = (os.path.join(tempdir, 'tcp'), os.path.join(tempdir, 'tcp6'))
+    with open(paths[0], 'w') as tcp_file:
+      tcp_file.write(TCP_HEADER)
+      tcp_file.write(TCP_LINE.format(0, proc_net_address('127.0.0.1'), 8080, '0A', 1001))
+      tcp_file.write(TCP_LINE.format(1, proc_net_address('10.1.2.3'), 22, '01', 1002))
+      tcp_file.write(TCP_LINE.format(2, proc_net_address('0.0.0.0'), 5432, '0A', 1003))
+    with open(paths[1], 'w') as tcp6_file:
+      tcp6_file.write(TCP_HEADER)
+      tcp6_file.write(TCP_LINE.format(0, proc_net_address('::1'), 9090, '0A', 1004))
+      tcp6_file.write(TCP_LINE.format(1, proc_net_address('fe80::1:2'), 443, '0A', 1005))
+    try:
+      with mock.patch('platform_cli.proctable.PROC_NET_FILES', paths):
+        sockets = proctable._proc_listening_sockets()
+    finally:
+      shutil.rmtree(tempdir)
+    self.assertEqual(sockets, {'1001': ('127.0.0.1', 8080), '1003': ('0.0.0.0', 5432),
+                               '1004': ('::1', 9090), '1005': ('fe80::1:2', 443)})
+
+  def testListeningAddressesByPid(self):
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    try:
+      address = listener.getsockname()
+      addresses = proctable.listening_addresses_by_pid()
+    finally:
+      listener.close()
+    self.assertTrue(address in addresses.get(os.getpid(), []))
+
+  @unittest.skipUnless(sys.byteorder == 'little', 'fixture is from a little-endian host')
+  def testDecodeLittleEndianFixture(self):
+    self.assertEqual(proctable._decode_address('0100007F:1F90'), ('127.0.0.1', 8080))
+    self.assertEqual(proctable._decode_address('00000000000000000000000001000000:2382'),
+                     ('::1', 9090))
+
+  @unittest.skipUnless(os.path.isdir('/proc/self'), 'requires /proc')
+  def testReadProcessTable(self):
+    entry = proctable.read_process_table()[os.getpid()]
+    self.assertEqual((entry.ppid, entry.pgid, entry.sid, entry.zombie),
+                     (os.getppid(), os.getpgrp(), os.getsid(0), False))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import unittest
+
+from platform_cli import proptypes
+
+
+class TestPropTypes(unittest.TestCase):
+
+  def testParse(self):
+    self.assertEqual(proptypes.INT.parse(' 42 '), 42)
+    self.assertEqual(proptypes.BOOL.parse('On'), True)
+    self.assertEqual(proptypes.BOOL.parse('False'), False)
+    self.assertEqual(proptypes.FLAG.parse('enabled'), False)
+    self.assertEqual(proptypes.DURATION.parse('250ms'), 0.25)
+    self.assertEqual(proptypes.DURATION.parse('5m'), 300)
+    self.assertEqual(proptypes.DURATION.parse('30'), 30)
+    self.assertEqual(proptypes.SIZE.parse('64m'), 64 * 1024 * 1024)
+    self.assertEqual(proptypes.SIZE.parse('2GiB'), 2 * 1024 ** 3)
+    self.assertEqual(proptypes.SIZE.parse('512'), 512)
+    self.assertEqual(proptypes.PATH.parse('/opt//app/'), '/opt/app')
+    self.assertEqual(proptypes.EnumType('G1', 'CMS').parse('CMS'), 'CMS')
+
+  def testParseRejectsMalformedValues(self):
+    for prop_type, text in ((proptypes.INT, '4x'), (proptypes.BOOL, 'maybe'),
+                            (proptypes.DURATION, '5 minutes'), (proptypes.SIZE, '1.5g'),
+                            (proptypes.PATH, 'relative/path'),
+                            (proptypes.EnumType('G1', 'CMS'), 'Serial')):
+      with self.assertRaises(proptypes.Error):
+        prop_type.parse(text, 'foo.bar')
+    try:
+      proptypes.INT.parse('4x', 'foo.threads')
+    except proptypes.Error, err:
+      self.assertEqual(str(err), 'Invalid value "4x" for foo.threads: expected an integer.')
+
+  def testGetValue(self):
+    values = {'foo.threads': '8', 'foo.timeout': '1m'}
+    typed_values = {'foo.timeout': 60.0}
+    self.assertEqual(proptypes.get_value(values, typed_values, 'foo.timeout', None,
+                                         proptypes.INT), 60.0)
+    self.assertEqual(proptypes.get_value(values, typed_values, 'foo.threads', None,
+                                         proptypes.INT), 8)
+    self.assertEqual(proptypes.get_value(values, typed_values, 'foo.missing', '3',
+                                         proptypes.INT), 3)
+    with self.assertRaises(KeyError):
+      proptypes.get_value(values, typed_values, 'foo.missing', None, proptypes.INT)
+
+
+if __name__ == '__main__':
+  unittest.main()
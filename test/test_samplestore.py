@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from platform_cli import samplestore
+
+
+def make_sample(timestamp, cpu_seconds=0.0, rss=0, pid=100):
+  return samplestore.Sample(timestamp=timestamp, pid=pid, cpu_seconds=cpu_seconds,
+                            cpu_percent=None, rss=rss, threads=1, fds=1,
+                            read_bytes=0, write_bytes=0)
+
+
+class TestRingStore(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tempdir, 'fooservice.ring')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def testWrapKeepsNewestSamplesInOrder(self):
+    with samplestore.RingStore(self.path, capacity=4) as store:
+      for timestamp in range(10):
+        store.append(make_sample(float(timestamp)))
+      self.assertEqual(len(store), 4)
+      self.assertEqual([s.timestamp for s in store.iter_window()], [6.0, 7.0, 8.0, 9.0])
+      self.assertEqual([s.timestamp for s in store.iter_window(7.0, 8.0)], [7.0, 8.0])
+    self.assertEqual(os.path.getsize(self.path),
+                     samplestore.HEADER.size + 4 * samplestore.RECORD.size)
+
+  def testCpuPercentDerivedFromPreviousSampleOfSamePid(self):
+    with samplestore.RingStore(self.path, capacity=8) as store:
+      store.append(make_sample(10.0, cpu_seconds=1.0))
+      store.append(make_sample(12.0, cpu_seconds=2.0))
+      store.append(make_sample(14.0, cpu_seconds=0.5, pid=200))
+      percents = [s.cpu_percent for s in store.iter_window()]
+    self.assertEqual(percents, [0.0, 50.0, 0.0])
+
+  def testReopenKeepsCapacityAndSamples(self):
+    with samplestore.RingStore(self.path, capacity=3) as store:
+      store.append(make_sample(1.0))
+    with samplestore.RingStore(self.path, capacity=50, readonly=True) as store:
+      self.assertEqual(store.capacity, 3)
+      self.assertEqual(store.latest().timestamp, 1.0)
+
+  def testCreateKeepsStoreCreatedConcurrently(self):
+    with samplestore.RingStore(self.path, capacity=3) as store:
+      store.append(make_sample(1.0))
+    real_exists = os.path.exists
+    # Another process creates the store after this one found it missing.
+    with mock.patch('os.path.exists', side_effect=lambda path: path != self.path and
+                    real_exists(path)):
+      with samplestore.RingStore(self.path, capacity=50) as store:
+        self.assertEqual((store.capacity, store.latest().timestamp), (3, 1.0))
+    self.assertEqual(os.listdir(self.tempdir), ['fooservice.ring'])
+
+  def testSummarize(self):
+    samples = [make_sample(float(t), rss=rss) for t, rss in enumerate(range(1, 21))]
+    stats = dict((s.field, s) for s in samplestore.summarize(samples, fields=('rss',)))
+    self.assertEqual(stats['rss'], samplestore.FieldStats('rss', 1, 10.5, 19, 20))
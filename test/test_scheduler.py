@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import collections
+import threading
+import unittest
+
+from platform_cli import scheduler
+
+FakeService = collections.namedtuple('FakeService', ['name', 'priority', 'depends_on'])
+
+
+class TestScheduler(unittest.TestCase):
+
+  def testImplicitTiersFromPriority(self):
+    graph = scheduler.build_graph([FakeService('db', 0, []),
+                                   FakeService('cache', 0, []),
+                                   FakeService('app', 1, []),
+                                   FakeService('web', 2, [])])
+    self.assertEqual(graph['db'], frozenset())
+    self.assertEqual(graph['app'], frozenset(['db', 'cache']))
+    self.assertEqual(graph['web'], frozenset(['app']))
+
+  def testExplicitDependenciesReplaceTier(self):
+    graph = scheduler.build_graph([FakeService('db', 0, []),
+                                   FakeService('cache', 0, []),
+                                   FakeService('app', 1, ['cache'])])
+    self.assertEqual(graph['app'], frozenset(['cache']))
+
+  def testUnknownAndCyclicDependenciesRejected(self):
+    self.assertRaises(scheduler.Error, scheduler.build_graph,
+                      [FakeService('app', 0, ['nope'])])
+    self.assertRaises(scheduler.Error, scheduler.build_graph,
+                      [FakeService('a', 0, ['b']), FakeService('b', 0, ['a'])])
+
+  def testRunOrderAndSkipOnFailure(self):
+    graph = collections.OrderedDict([('db', frozenset()),
+                                     ('app', frozenset(['db'])),
+                                     ('web', frozenset(['app'])),
+                                     ('batch', frozenset())])
+    calls = []
+    lock = threading.Lock()
+
+    def func(name):
+      with lock:
+        calls.append(name)
+      return name != 'app'
+
+    results = scheduler.run(graph, func, parallelism=3)
+    self.assertTrue(calls.index('db') < calls.index('app'))
+    self.assertEqual(results['app'], False)
+    self.assertEqual(results['web'], None)
+    self.assertEqual(results['batch'], True)
+    self.assertFalse('web' in calls)
+
+  def testReverseStopsDependentsFirst(self):
+    graph = collections.OrderedDict([('db', frozenset()), ('app', frozenset(['db']))])
+    calls = []
+    batches = []
+    scheduler.run(scheduler.reverse(graph), calls.append, before_batch=batches.append)
+    self.assertEqual(calls, ['app', 'db'])
+    self.assertEqual(batches, [['app'], ['db']])
+
+  def testSubgraphKeepsOrderThroughLeftOutServices(self):
+    graph = scheduler.build_graph([FakeService('a', 0, []),
+                                   FakeService('b', 1, []),
+                                   FakeService('c', 2, [])])
+    restricted = scheduler.subgraph(graph, ['a', 'c'])
+    self.assertEqual(restricted.keys(), ['a', 'c'])
+    self.assertEqual(restricted['c'], frozenset(['a']))
+    results = scheduler.run(restricted, lambda name: name != 'a', parallelism=2)
+    self.assertEqual(results['a'], False)
+    self.assertEqual(results['c'], None)
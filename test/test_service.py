@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from platform_cli import service
+
+
+class TestGraceful(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.profile = service.ServiceProfile('test', 'fooservice', 'fooservice', ['/bin/true'],
+                                          graceful_cmd_tmpl=['/bin/true'])
+    self.profile.graceful_cmd = ['/bin/true']
+    self.profile.graceful_timeout_seconds = 2
+    self.profile.stdout = os.path.join(self.tmpdir, 'logs', 'foo.out')
+    self.profile.pid_file = os.path.join(self.tmpdir, 'foo.pid')
+    self.listening = [set([8080])]
+    mock.patch.object(self.profile, '_get_running_process_if_exists',
+                      return_value=mock.MagicMock()).start()
+    mock.patch.object(self.profile, 'is_running', return_value=True).start()
+    mock.patch.object(self.profile, '_listening_ports',
+                      side_effect=lambda: self.listening.pop(0) if len(self.listening) > 1
+                      else self.listening[0]).start()
+
+  def tearDown(self):
+    mock.patch.stopall()
+    shutil.rmtree(self.tmpdir)
+
+  def log(self):
+    with open(self.profile.stdout) as stdout:
+      return stdout.read()
+
+  def testWithoutGracefulCommand(self):
+    self.profile.graceful_cmd = []
+    self.assertTrue(self.profile.graceful())
+
+  def testNotRunning(self):
+    self.profile._get_running_process_if_exists.return_value = None
+    self.assertTrue(self.profile.graceful())
+    self.assertFalse(os.path.exists(self.profile.stdout))
+
+  def testListeningOnDeclaredPorts(self):
+    self.profile.ports = [8080]
+    self.assertTrue(self.profile.graceful())
+    self.assertTrue('gracefully restarted fooservice' in self.log())
+
+  def testWaitsForPortsListenedOnBefore(self):
+    self.listening = [set([8080]), set(), set(), set([8080])]
+    self.assertTrue(self.profile.graceful())
+    self.assertEqual(self.listening, [set([8080])])
+
+  def testCommandFailure(self):
+    self.profile.graceful_cmd = ['/bin/false']
+    self.assertFalse(self.profile.graceful())
+    self.assertTrue('graceful command exited with 1' in self.log())
+
+  def testCommandTimeout(self):
+    self.profile.graceful_cmd = ['/bin/sleep', '30']
+    self.profile.graceful_timeout_seconds = 0.2
+    self.assertFalse(self.profile.graceful())
+    self.assertTrue('graceful command did not finish within 0.2s' in self.log())
+
+  def testNotListeningInTime(self):
+    self.profile.ports = [8080, 8443]
+    self.profile.graceful_timeout_seconds = 0.5
+    self.assertFalse(self.profile.graceful())
+    self.assertTrue('not listening on 8080,8443 within 0.5s' in self.log())
+
+
+if __name__ == '__main__':
+  unittest.main()
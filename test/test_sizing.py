@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import unittest
+
+from platform_cli import config, sizing
+
+
+class TestSizing(unittest.TestCase):
+
+  def setUp(self):
+    self.sizings = [
+        sizing.ServiceSizing(
+            'fooservice', memory_weight=3, cpu_weight=1,
+            memory_properties=[sizing.SizedProperty('fooservice.max_heap_size', 0.5, 256, None,
+                                                    '{}m')],
+            cpu_properties=[sizing.SizedProperty('fooservice.gc_threads', 1, 1, 4, '{}')]),
+        sizing.ServiceSizing(
+            'barservice', memory_weight=1, cpu_weight=1,
+            memory_properties=[sizing.SizedProperty('barservice.max_heap_size', 0.5, 256, None,
+                                                    '{}m')]),
+    ]
+    self.values = {'fooservice.enabled': 'True', 'fooservice.max_heap_size': '1024m',
+                   'fooservice.gc_threads': '2', 'barservice.enabled': 'True',
+                   'barservice.max_heap_size': '1024m'}
+
+  def testSuggestDividesByWeight(self):
+    host = sizing.HostResources(9 * 1024 * sizing.MIB, 12)
+    suggestions = sizing.suggest(self.sizings, self.values, host, 1024 * sizing.MIB)
+    self.assertEqual([(suggestion.name, suggestion.value) for suggestion in suggestions],
+                     [('fooservice.max_heap_size', '3072m'), ('fooservice.gc_threads', '4'),
+                      ('barservice.max_heap_size', '1024m')])
+    self.assertTrue(all(isinstance(suggestion, config.Suggestion) for suggestion in suggestions))
+
+  def testDisabledServicesGetNoShare(self):
+    self.values['barservice.enabled'] = 'False'
+    host = sizing.HostResources(1024 * sizing.MIB, 1)
+    suggestions = sizing.suggest(self.sizings, self.values, host)
+    self.assertEqual([(suggestion.name, suggestion.value) for suggestion in suggestions],
+                     [('fooservice.max_heap_size', '512m'), ('fooservice.gc_threads', '1')])
+
+  def testUnknownPropertyRaises(self):
+    del self.values['barservice.max_heap_size']
+    self.assertRaises(sizing.Error, sizing.suggest, self.sizings, self.values,
+                      sizing.HostResources(1024 * sizing.MIB, 1))
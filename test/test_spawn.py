@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import os
+import subprocess
+import unittest
+import mock
+from multiprocessing.pool import ThreadPool
+
+from platform_cli import spawn
+
+
+@unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'requires /proc')
+class TestSpawn(unittest.TestCase):
+
+  def setUp(self):
+    self.read_fd, self.write_fd = os.pipe()
+
+  def tearDown(self):
+    os.close(self.read_fd)
+    os.close(self.write_fd)
+
+  def inherited_fds(self):
+    proc = spawn.popen(['/bin/sh', '-c', 'ls /proc/$$/fd'], stdout=subprocess.PIPE)
+    output = proc.communicate()[0]
+    return set(int(fd) for fd in output.split())
+
+  def testChildInheritsOnlyStandardStreams(self):
+    fds = self.inherited_fds()
+    self.assertFalse(set([self.read_fd, self.write_fd]) & fds)
+
+  def testProcFallback(self):
+    with mock.patch('platform_cli.spawn.close_range_works', return_value=False):
+      self.assertEqual(spawn.cloexec_method(), 'proc')
+      fds = self.inherited_fds()
+    self.assertFalse(set([self.read_fd, self.write_fd]) & fds)
+
+  def testNoHookAddedBetweenForkAndExec(self):
+    with mock.patch('psutil.Popen') as popen_mock:
+      spawn.popen(['/bin/true'])
+    self.assertEqual(popen_mock.call_args[1], {'close_fds': False})
+
+  def testThreadsMarkAndForkUnderOneLock(self):
+    def fake_popen(*_, **kwargs):
+      self.assertTrue(spawn._SPAWN_LOCK.locked())
+      return kwargs
+    pool = ThreadPool(4)
+    try:
+      with mock.patch('psutil.Popen', side_effect=fake_popen):
+        results = pool.map(lambda _: spawn.popen(['/bin/true']), range(8))
+    finally:
+      pool.close()
+      pool.join()
+    self.assertEqual(results, [{'close_fds': False}] * 8)
+    self.assertFalse(spawn._SPAWN_LOCK.locked())
+
+  def testThreadsSpawnWithoutLeaks(self):
+    pool = ThreadPool(4)
+    try:
+      results = pool.map(lambda _: self.inherited_fds(), range(8))
+    finally:
+      pool.close()
+      pool.join()
+    for fds in results:
+      self.assertFalse(set([self.read_fd, self.write_fd]) & fds)
+
+  def testPreexecFnRunsAndExecErrorsStillRaise(self):
+    proc = spawn.popen(['/bin/sh', '-c', 'echo $(cut -d" " -f6 /proc/$$/stat) $$'],
+                       stdout=subprocess.PIPE, preexec_fn=os.setsid)
+    session, pid = proc.communicate()[0].split()
+    self.assertEqual(session, pid)
+    self.assertRaises(OSError, spawn.popen, ['/nonexistent/command'])
+
+
+if __name__ == '__main__':
+  unittest.main()
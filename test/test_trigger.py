@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import unittest
+
+from platform_cli import samplestore, trigger
+
+
+def make_sample(pid=100, cpu_seconds=0.0, rss=0, threads=1, fds=10):
+  return samplestore.Sample(0.0, pid, cpu_seconds, None, rss, threads, fds, 0, 0)
+
+
+class TestTrigger(unittest.TestCase):
+
+  def testCpuIsAveragedOverWindow(self):
+    detector = trigger.Detector(trigger.Thresholds(80, None, None, None, 10))
+    self.assertEqual(detector.check(make_sample(cpu_seconds=0), 0), [])
+    self.assertEqual(detector.check(make_sample(cpu_seconds=5), 5), [])
+    self.assertEqual(detector.check(make_sample(cpu_seconds=9), 10), ['CPU 90% over 10s'])
+    self.assertEqual(detector.check(make_sample(cpu_seconds=10), 15), [])
+
+  def testRssGrowthAndCounts(self):
+    detector = trigger.Detector(trigger.Thresholds(None, 1024, 100, 50, 2))
+    detector.check(make_sample(rss=0), 0)
+    self.assertEqual(detector.check(make_sample(rss=4096, threads=100, fds=60), 2),
+                     ['RSS growing 2048 bytes/s over 2s', '100 threads', '60 open fds'])
+
+  def testNewPidResetsHistory(self):
+    detector = trigger.Detector(trigger.Thresholds(50, None, None, None, 1))
+    detector.check(make_sample(pid=1, cpu_seconds=0), 0)
+    self.assertEqual(detector.check(make_sample(pid=2, cpu_seconds=100), 1), [])
+
+  def testIsEnabled(self):
+    self.assertFalse(trigger.is_enabled(trigger.Thresholds(None, None, None, 0, 30)))
+    self.assertTrue(trigger.is_enabled(trigger.Thresholds(None, None, 500, None, 30)))
+
+  def testCaptureLimiter(self):
+    limiter = trigger.CaptureLimiter(cooldown_seconds=60, max_per_hour=2)
+    self.assertTrue(limiter.allow('foo', 0))
+    self.assertFalse(limiter.allow('foo', 30))
+    self.assertTrue(limiter.allow('bar', 30))
+    self.assertFalse(limiter.allow('foo', 100))
+    self.assertTrue(limiter.allow('foo', 3601))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# Copyright (C) 2013 Jive Software. All rights reserved.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from platform_cli import watchdog
+
+
+class TestWatchdog(unittest.TestCase):
+
+  def testRestartBudgetBacksOffAndGivesUp(self):
+    budget = watchdog.RestartBudget(3, 60, 1, 3)
+    self.assertEqual([budget.record_crash('fooservice', now) for now in (0, 1, 2, 3)],
+                     [1, 2, 3, None])
+    self.assertEqual(budget.record_crash('barservice', 3), 1)
+
+  def testRestartBudgetWindowSlides(self):
+    budget = watchdog.RestartBudget(2, 10, 1, 300)
+    self.assertEqual(budget.record_crash('fooservice', 0), 1)
+    self.assertEqual(budget.record_crash('fooservice', 5), 2)
+    self.assertEqual(budget.record_crash('fooservice', 12), 2)
+    self.assertEqual(budget.record_crash('fooservice', 30), 1)
+
+  def testDescribeExit(self):
+    self.assertEqual(watchdog.describe_exit(3 << 8), 'exited with status 3')
+    self.assertEqual(watchdog.describe_exit(9), 'was killed by signal 9')
+
+  def testTail(self):
+    tempdir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(tempdir, 'fooservice.stdout')
+      with open(path, 'w') as stdout:
+        stdout.write(''.join('line {}\n'.format(number) for number in range(100)))
+      self.assertEqual(watchdog.tail(path, lines=2), 'line 98\nline 99\n')
+      self.assertEqual(watchdog.tail(os.path.join(tempdir, 'missing')), '')
+    finally:
+      shutil.rmtree(tempdir)